@@ -0,0 +1,42 @@
+"""
+SQLite backend with the connection options Django 5.1 adds natively.
+
+OPTIONS may contain:
+- 'init_command': SQL run on every new connection, e.g. the PRAGMAs of the
+  production profile in settings.SQLITE_PROFILES.
+- 'transaction_mode': 'DEFERRED', 'IMMEDIATE' or 'EXCLUSIVE', used when
+  atomic() begins a transaction. IMMEDIATE takes the write lock up front, so
+  concurrent writers wait in busy_timeout instead of failing with "database
+  is locked" when a read transaction tries to upgrade.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = {'DEFERRED', 'IMMEDIATE', 'EXCLUSIVE'}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        mode = (options.get('transaction_mode') or 'DEFERRED').upper()
+        if mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode must be one of {', '.join(sorted(TRANSACTION_MODES))}")
+        self.transaction_mode = mode
+        self.init_command = options.get('init_command')
+
+        kwargs = super().get_connection_params()
+        kwargs.pop('transaction_mode', None)
+        kwargs.pop('init_command', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if self.init_command:
+            for statement in self.init_command.split(';'):
+                if statement.strip():
+                    conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,11 +44,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'logic.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'logic.middleware.MembershipMiddleware',
+    'logic.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,13 +80,65 @@ WSGI_APPLICATION = 'Billing.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite connection profiles, picked with the SQLITE_PROFILE environment variable.
+# "production" is for several gunicorn workers on one file: WAL lets readers run
+# alongside the writer, writers queue in busy_timeout behind BEGIN IMMEDIATE
+# instead of failing, and connections are reused across requests.
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode = WAL;'
+                'PRAGMA synchronous = NORMAL;'  # Durable in WAL mode except on power loss
+                'PRAGMA busy_timeout = 5000;'
+                'PRAGMA mmap_size = 134217728;'  # 128 MB
+                'PRAGMA cache_size = -20000;'  # 20 MB
+                'PRAGMA temp_store = MEMORY;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        },
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'Billing.db.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **SQLITE_PROFILES[os.environ.get('SQLITE_PROFILE', 'default')],
     }
 }
 
+# Read-only replicas for GET traffic: SQLITE_REPLICAS is a comma-separated list of
+# database files, kept in sync with the primary by `manage.py sync_replica`.
+# See logic.routers for what is read where.
+for number, path in enumerate(filter(None, os.environ.get('SQLITE_REPLICAS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'Billing.db.sqlite3',
+        'NAME': path,
+        'OPTIONS': {'init_command': 'PRAGMA query_only = ON'},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['logic.routers.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Use a shared backend (Redis/Memcached) when running several workers, so cache
+# invalidation reaches every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Seconds a user's resolved business/role stays cached
+MEMBERSHIP_CACHE_TIMEOUT = 300
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',  # Default backend
 ]
@@ -92,9 +148,96 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'logic.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',  # Add this line
     ],
+    'DEFAULT_PAGINATION_CLASS': 'logic.pagination.CreatedAtCursorPagination',
+}
+
+# Token -> user lookups kept in an in-process LRU for TTL seconds. Set
+# SHARED_CACHE to a CACHES alias to share lookups between workers.
+TOKEN_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+    'SHARED_CACHE': None,
+}
+
+# Reject bills that would take an item's current_stock below zero. When off,
+# stock is floored at zero instead.
+BILL_REJECT_OVERSELL = False
+
+# Bill attachments are stored by content hash, so identical receipts share one
+# file. Thumbnails need Pillow and are made by a background job.
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 70
+
+# Database-backed job queue run by `manage.py run_jobs` (see logic.jobs)
+JOB_QUEUE = {
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 5,
+    'RETRY_MAX_DELAY': 3600,
+    'LOCK_TIMEOUT': 300,
+}
+
+# Sales that leave an item at or below this stock log a low-stock warning
+LOW_STOCK_THRESHOLD = 5
+
+# Seconds a cart's stock reservation holds before it is released
+STOCK_RESERVATION_TTL = 900
+
+# Largest batch a POS terminal may push to /api/sync/ in one request
+SYNC_MAX_OPERATIONS = 500
+
+# ?since= catalog syncs (see logic.changes) send at most PAGE_SIZE changed rows per
+# response, and hand back a cursor SAFETY_WINDOW seconds behind the newest change,
+# so writes that commit late are picked up by the next sync
+CHANGE_SYNC = {
+    'PAGE_SIZE': 500,
+    'SAFETY_WINDOW': 60,
+}
+
+# Serve the hot read endpoints from the async views in logic.async_views. Off unless
+# ASYNC_READ_VIEWS=1 is set, which only makes sense under ASGI (Billing/asgi.py): under
+# WSGI every async view would need its own event loop. Compare both with
+# `manage.py bench_async` before turning it on.
+ASYNC_READ_VIEWS = os.environ.get('ASYNC_READ_VIEWS', '0') == '1'
+
+# Per-endpoint request metrics served at /api/_metrics/ (see logic.metrics). Each
+# worker writes its totals to DIR every FLUSH_INTERVAL seconds; DIR defaults to
+# a directory under the system temp dir. Set PROFILE_SAMPLE_RATE to profile that
+# fraction of requests and keep the ones slower than PROFILE_THRESHOLD_MS.
+METRICS = {
+    'ENABLED': True,
+    'DIR': None,
+    'FLUSH_INTERVAL': 10,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_THRESHOLD_MS': 500,
+}
+
+# Server-rendered receipts at /api/bills/<id>/receipt/ (see logic.receipts). Business
+# headers and rendered receipts are kept in the CACHE alias for TIMEOUT seconds.
+# THERMAL_WIDTH is the printer's characters per line; PDF_WIDTH that of the PDF.
+RECEIPTS = {
+    'CACHE': 'default',
+    'TIMEOUT': 7 * 24 * 3600,
+    'THERMAL_WIDTH': 42,
+    'PDF_WIDTH': 80,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'logic': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
 }
 
 # Password validation
@@ -14,6 +14,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 from django.contrib.auth.models import User
@@ -43,3 +44,8 @@ urlpatterns = [
     path('api/', include('logic.urls')),  # Include logic app's URLs
     path('', include(router.urls)),
 ]
+
+if settings.ASYNC_READ_VIEWS:
+    from logic.async_views import with_async_reads
+
+    urlpatterns = with_async_reads(urlpatterns)
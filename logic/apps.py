@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class LogicConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'logic'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+
+        post_migrate.connect(signals.search_index_migrated, sender=self)
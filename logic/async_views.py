@@ -0,0 +1,143 @@
+"""
+Async variants of the hot read endpoints, for ASGI deployments.
+
+With ASYNC_READ_VIEWS on, token-authenticated JSON GETs of the bill list
+and detail, the inventory list and current-user are served by coroutines
+that use the async ORM and the token cache, so one worker keeps hundreds
+of requests in flight while they wait on the database. Everything else on
+those URLs (writes, session logins, failed authentication, the browsable
+API, format suffixes, item-name searches, ?since= syncs) is handed to the
+existing DRF view, so URLs and responses are unchanged.
+"""
+import types
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import URLPattern, URLResolver
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import aauthenticate_token
+from .changes import achange_version, catalog_etag, etag_matches, set_catalog_headers
+from .metrics import timed
+from .serializers import UserBusinessSerializer
+from .tenancy import aresolve_membership
+from .views import BillViewSet, CurrentUserBusinessView, InventoryViewSet
+
+
+def wants_json(request):
+    accept = request.META.get('HTTP_ACCEPT', '*/*')
+    return 'text/html' not in accept and 'format' not in request.GET
+
+
+def json_response(view, data, status=200):
+    """The response the DRF view would render for data with JSONRenderer"""
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status)
+    response['Allow'] = ', '.join(view.allowed_methods)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+async def setup_view(view_class, action, request, user, token, kwargs):
+    """A DRF view instance for request, authenticated without touching the sync auth classes"""
+    request.membership = await aresolve_membership(user)
+    drf_request = Request(request)
+    drf_request.user = user
+    drf_request.auth = token
+    view = view_class(request=drf_request, args=(), kwargs=kwargs, format_kwarg=None, action=action)
+    view.check_permissions(drf_request)
+    return view
+
+
+async def bill_list(request, user, token, **kwargs):
+    if 'item_name' in request.GET:
+        return None  # Resolved through the search index by the sync view
+    view = await setup_view(BillViewSet, 'list', request, user, token, kwargs)
+    paginator = view.paginator
+    page = await paginator.apaginate_queryset(view.filter_queryset(view.get_queryset()), view.request, view)
+    return json_response(view, paginator.get_paginated_response(view.get_serializer(page, many=True).data).data)
+
+
+async def bill_detail(request, user, token, pk, **kwargs):
+    view = await setup_view(BillViewSet, 'retrieve', request, user, token, dict(kwargs, pk=pk))
+    try:
+        bill = await view.get_queryset().aget(pk=pk)
+    except (ObjectDoesNotExist, ValueError):
+        return None  # The sync view renders the 404
+    return json_response(view, view.get_serializer(bill).data)
+
+
+async def inventory_list(request, user, token, **kwargs):
+    if 'since' in request.GET:
+        return None
+    view = await setup_view(InventoryViewSet, 'list', request, user, token, kwargs)
+    business = request.membership.business
+    version = await achange_version(InventoryViewSet.queryset.model, business)
+    etag = catalog_etag(InventoryViewSet.queryset.model, business, version, request.get_full_path(), 'json')
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        paginator = view.paginator
+        page = await paginator.apaginate_queryset(view.filter_queryset(view.get_queryset()), view.request, view)
+        response = json_response(view, paginator.get_paginated_response(view.get_serializer(page, many=True).data).data)
+    return set_catalog_headers(response, etag, version)
+
+
+async def current_user(request, user, token, **kwargs):
+    view = await setup_view(CurrentUserBusinessView, None, request, user, token, kwargs)
+    return json_response(view, timed(UserBusinessSerializer(user, context={'request': request})).data)
+
+
+ASYNC_READS = {
+    'bill-list': bill_list,
+    'bill-detail': bill_detail,
+    'inventory-list': inventory_list,
+    'current-user-business': current_user,
+}
+
+
+def async_read(sync_view, handler):
+    """A view serving GETs with handler where it can, and with the sync view otherwise"""
+    fallback = sync_to_async(sync_view)
+
+    async def view(request, *args, **kwargs):
+        response = None
+        if request.method == 'GET' and 'format' not in kwargs and wants_json(request):
+            auth = await aauthenticate_token(request)
+            if auth is not None:
+                try:
+                    response = await handler(request, *auth, **kwargs)
+                except APIException:
+                    response = None  # e.g. a permission check; the sync view renders the error
+        if response is None:
+            response = await fallback(request, *args, **kwargs)
+        return response
+
+    view.csrf_exempt = getattr(sync_view, 'csrf_exempt', False)
+    view.async_read = True
+    return view
+
+
+def with_async_reads(patterns):
+    """Copy of a urlpatterns list with the views named in ASYNC_READS wrapped by async_read"""
+    wrapped = []
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(pattern.pattern, with_async_reads(pattern.url_patterns), pattern.default_kwargs,
+                                  pattern.app_name, pattern.namespace)
+        elif pattern.name in ASYNC_READS and not getattr(pattern.callback, 'async_read', False):
+            pattern = URLPattern(pattern.pattern, async_read(pattern.callback, ASYNC_READS[pattern.name]),
+                                 pattern.default_args, pattern.name)
+        wrapped.append(pattern)
+    return wrapped
+
+
+def async_urlconf(urlconf='Billing.urls'):
+    """A URLconf module serving urlconf's routes with async reads, e.g. for ROOT_URLCONF in tests"""
+    module = types.ModuleType(f'{urlconf}.async_reads')
+    module.urlpatterns = with_async_reads(import_module(urlconf).urlpatterns)
+    return module
@@ -0,0 +1,118 @@
+"""
+Content-addressed storage and thumbnails for bill attachments.
+
+Uploads are streamed to disk chunk by chunk while being hashed, then moved
+to bills/<first two hex digits>/<sha256><ext>; a file whose hash is already
+stored is dropped and the existing name reused. Thumbnails are derived from
+the same hash, made by a background job after the upload commits, and need
+Pillow; without it attachments are stored but never thumbnailed.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from .jobs import job
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'thumbnails'
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'}
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by the sha256 of their content"""
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        os.makedirs(self.path(directory), exist_ok=True)
+
+        # Hash while streaming into a temporary file next to the destination, so the
+        # final move is a rename on the same filesystem
+        digest = hashlib.sha256()
+        handle, temp_path = tempfile.mkstemp(dir=self.path(directory), suffix='.upload')
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            name = os.path.join(directory, hexdigest[:2], hexdigest + extension).replace(os.sep, '/')
+            if self.exists(name):
+                return name  # Identical file already stored
+            os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+            os.replace(temp_path, self.path(name))
+            if self.file_permissions_mode is not None:
+                os.chmod(self.path(name), self.file_permissions_mode)
+            return name
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+attachment_storage = ContentAddressedStorage()
+
+
+def get_attachment_storage():
+    return attachment_storage
+
+
+def thumbnail_name(attachment_name):
+    """Where the thumbnail of an attachment lives, or None if it is not an image"""
+    stem, extension = os.path.splitext(os.path.basename(attachment_name))
+    if extension.lower() not in IMAGE_EXTENSIONS:
+        return None
+    return f'{THUMBNAIL_DIR}/{stem[:2]}/{stem}.jpg'
+
+
+def render_thumbnail(source):
+    """JPEG bytes of a compressed thumbnail of an image file"""
+    with Image.open(source) as image:
+        image.thumbnail(getattr(settings, 'THUMBNAIL_SIZE', (320, 320)))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=getattr(settings, 'THUMBNAIL_QUALITY', 70), optimize=True)
+        return output.getvalue()
+
+
+@job
+def make_thumbnail(transaction_id):
+    """Create the thumbnail of a transaction's attachment and point the row at it"""
+    from .models import Transaction
+
+    try:
+        row = Transaction.objects.filter(pk=transaction_id).values_list('bill_attachment', flat=True).first()
+        name = row and thumbnail_name(row)
+        if not name or Image is None:
+            return None
+        if not attachment_storage.exists(name):
+            with attachment_storage.open(row) as source:
+                # ContentAddressedStorage keys files by content, so write it by name directly
+                FileSystemStorage(location=attachment_storage.location).save(name, ContentFile(render_thumbnail(source)))
+        # Only if the attachment was not replaced in the meantime
+        Transaction.objects.filter(pk=transaction_id, bill_attachment=row).update(bill_thumbnail=name)
+        return name
+    except OSError as exc:
+        # Unreadable or not really an image; the attachment itself is still served
+        logger.warning('No thumbnail for transaction %s: %s', transaction_id, exc)
+        return None
+
+
+def schedule_thumbnail(transaction_id):
+    """Make the thumbnail in the background once the current transaction commits"""
+    make_thumbnail.delay(transaction_id=transaction_id)
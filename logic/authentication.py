@@ -0,0 +1,155 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+def _cache_settings():
+    options = {'MAX_SIZE': 10000, 'TTL': 60, 'SHARED_CACHE': None}
+    options.update(getattr(settings, 'TOKEN_AUTH_CACHE', {}))
+    return options
+
+
+class TokenCache:
+    """
+    Bounded, thread-safe LRU of token key -> (user, token) with a TTL per entry.
+
+    An optional shared cache (a CACHES alias) sits behind the in-process LRU so
+    workers can reuse each other's lookups.
+    """
+
+    def __init__(self, max_size, ttl, shared_alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    @staticmethod
+    def shared_key(key):
+        # Never put raw token keys into a cache other processes can read
+        return 'logic:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.shared is not None:
+            value = self.shared.get(self.shared_key(key))
+            if value is not None:
+                self.shared_hits += 1
+                self._store(key, value, now)
+                return value
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self._store(key, value, time.monotonic())
+        if self.shared is not None:
+            self.shared.set(self.shared_key(key), value, self.ttl)
+
+    def _store(self, key, value, now):
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self.shared_key(key))
+
+    def invalidate_user(self, user_id, keys=()):
+        """Drop every entry for a user, plus the given keys from the shared cache"""
+        with self._lock:
+            for key in [key for key, (_, (user, _token)) in self._entries.items() if user.pk == user_id]:
+                del self._entries[key]
+        for key in keys:
+            self.invalidate(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+_options = _cache_settings()
+token_cache = TokenCache(_options['MAX_SIZE'], _options['TTL'], _options['SHARED_CACHE'])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that resolves token -> user through token_cache"""
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            entry = super().authenticate_credentials(key)
+            token_cache.set(key, entry)
+
+        # Each request gets its own copy so per-request state never leaks between them
+        user, token = entry
+        return copy.copy(user), token
+
+
+async def aauthenticate_token(request):
+    """
+    (user, token) for a valid "Authorization: Token <key>" header, or None.
+
+    CachedTokenAuthentication for async views; other credentials, and invalid
+    ones, are left to the DRF views to accept or reject.
+    """
+    from rest_framework.authtoken.models import Token
+
+    auth = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    key = auth[1]
+
+    if token_cache.shared is None:
+        entry = token_cache.get(key)  # In-process LRU only, never blocks the event loop
+    else:
+        entry = await sync_to_async(token_cache.get)(key)
+    if entry is None:
+        token = await Token.objects.select_related('user').filter(key=key).afirst()
+        if token is None or not token.user.is_active:
+            return None
+        entry = (token.user, token)
+        await sync_to_async(token_cache.set)(key, entry)
+
+    user, token = entry
+    return copy.copy(user), token
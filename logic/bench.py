@@ -0,0 +1,338 @@
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext, setup_databases, teardown_databases
+from rest_framework.test import APIClient
+
+from .models import Bill, BillItem, Business, Customer, Inventory, Transaction
+from .reports import rebuild_rollups
+from .stock import apply_stock_changes, reserve_stock, take_reservation
+
+
+@contextmanager
+def benchmark_database(on_disk=False):
+    """
+    Run the block against a throwaway test database so db.sqlite3 is never touched.
+
+    SQLite test databases live in memory with a shared cache, where writers
+    fail at once instead of waiting for each other; on_disk puts the copy in
+    a temporary file so concurrent benchmarks see real locking.
+    """
+    test_settings = connection.settings_dict['TEST']
+    old_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as directory:
+        if on_disk and connection.vendor == 'sqlite':
+            test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        try:
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                yield
+            finally:
+                teardown_databases(old_config, verbosity=0)
+        finally:
+            test_settings['NAME'] = old_name
+
+
+def create_store(name='Benchmark Store', inventory_count=100, stock=10 ** 9):
+    """Create an owner, a business, one customer and some inventory to bill against"""
+    owner = User.objects.create_user(username=f'{name.lower().replace(" ", "_")}_owner', password='benchmark')
+    business = Business.objects.create(name=name, address='Benchmark Road', owner=owner)
+    customer = Customer.objects.create(name='Walk-in', phone='0000000000', business=business)
+    Inventory.objects.bulk_create([
+        Inventory(name=f'Item {i}', price=Decimal('10.00'), current_stock=stock, business=business)
+        for i in range(inventory_count)
+    ])
+    return owner, business, customer, list(Inventory.objects.filter(business=business).order_by('id'))
+
+
+def seed_bench_store(name='Benchmark Store', customers=1000, inventory=500, bills=2000, transactions=2000, lines=3,
+                     seed=1):
+    """
+    create_store with customers, bills and transactions, the same for the same seed.
+
+    Rows go in with bulk inserts, which skip the signals, so the customer
+    ledgers and sales rollups are rebuilt afterwards. Bills are all dated
+    now; logic.seeding.seed_store builds larger stores with a history.
+    """
+    rng = random.Random(seed)
+    owner, business, _, items = create_store(name, inventory_count=inventory)
+    Customer.objects.bulk_create([
+        Customer(name=f'Customer {i}', phone=f'9{i:09d}', business=business) for i in range(customers)
+    ], batch_size=2000)
+    customer_ids = list(Customer.objects.filter(business=business).values_list('id', flat=True))
+
+    orders = [
+        (rng.choice(customer_ids), [(rng.choice(items), rng.randint(1, 3)) for _ in range(lines)])
+        for _ in range(bills)
+    ]
+    created = Bill.objects.bulk_create([
+        Bill(customer_id=customer_id, business=business, payment_mode=rng.choice(['CASH', 'CARD', 'UPI']),
+             total_amount=sum(item.price * quantity for item, quantity in order))
+        for customer_id, order in orders
+    ], batch_size=2000)
+    BillItem.objects.bulk_create([
+        BillItem(bill=bill, inventory_item=item, quantity=quantity, price=item.price)
+        for bill, (_, order) in zip(created, orders) for item, quantity in order
+    ], batch_size=5000)
+    Transaction.objects.bulk_create([
+        Transaction(customer_id=rng.choice(customer_ids), business=business,
+                    amount=Decimal(rng.randint(100, 50000)) / 100, transaction_type=rng.choice(['CREDIT', 'DEBIT']))
+        for _ in range(transactions)
+    ], batch_size=2000)
+
+    call_command('rebuild_ledger', business=business.id, stdout=StringIO())
+    rebuild_rollups([business.id])
+    return owner, business
+
+
+class Timer:
+    """Collect wall-clock time and executed queries for a block of work"""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.queries = 0
+
+    @contextmanager
+    def measure(self):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            yield
+            self.elapsed += time.perf_counter() - start
+        self.queries += len(captured)
+
+
+def _retry_busy(func, counter):
+    # SQLite reports lock contention as an error rather than waiting forever; try again
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except OperationalError:
+            attempt += 1
+            counter['retries'] += 1
+            time.sleep(random.uniform(0, 0.002 * attempt))
+
+
+def stock_stress(business, item_ids, threads=8, sales=50, reserve_every=2, seed=1):
+    """
+    Sell one unit of a random item per iteration from many threads at once,
+    every reserve_every-th sale through a reservation, with oversell
+    rejection on. Returns ({inventory_id: units sold}, retries, seconds).
+    """
+    sold = Counter()
+    counter = Counter()
+    lock = threading.Lock()
+
+    def sell_through_reservation(pk):
+        token, _ = reserve_stock(business, {pk: 1})
+
+        def consume():
+            with transaction.atomic():
+                apply_stock_changes({pk: -1}, reject_oversell=True, released=take_reservation(business, token))
+        _retry_busy(consume, counter)
+
+    def sell(pk):
+        with transaction.atomic():
+            apply_stock_changes({pk: -1}, reject_oversell=True)
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        try:
+            for i in range(sales):
+                pk = rng.choice(item_ids)
+                if reserve_every and i % reserve_every == 0:
+                    _retry_busy(lambda: sell_through_reservation(pk), counter)
+                else:
+                    _retry_busy(lambda: sell(pk), counter)
+                with lock:
+                    sold[pk] += 1
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return dict(sold), counter['retries'], time.perf_counter() - start
+
+
+# The request mix `manage.py bench` replays when no profile file is given. Each
+# entry is one JSON Lines record of a profile file; {customer}, {item}, {bill}
+# and {transaction} are replaced by a random id of the seeded store.
+DEFAULT_PROFILE = [
+    {'name': 'inventory-list', 'method': 'GET', 'path': '/api/inventories/', 'weight': 15},
+    {'name': 'inventory-search', 'method': 'GET', 'path': '/api/inventories/search/?q=Item+1', 'weight': 10},
+    {'name': 'customer-list', 'method': 'GET', 'path': '/api/customers/', 'weight': 10},
+    {'name': 'bill-list', 'method': 'GET', 'path': '/api/bills/', 'weight': 15},
+    {'name': 'bill-detail', 'method': 'GET', 'path': '/api/bills/{bill}/', 'weight': 15},
+    {'name': 'bill-create', 'method': 'POST', 'path': '/api/bills/', 'weight': 10, 'body': {
+        'customer': '{customer}', 'total_amount': '10.00', 'payment_mode': 'CASH',
+        'items': [{'inventory_item': '{item}', 'quantity': 1, 'price': '10.00'}],
+    }},
+    {'name': 'transaction-list', 'method': 'GET', 'path': '/api/transactions/', 'weight': 5},
+    {'name': 'transaction-create', 'method': 'POST', 'path': '/api/transactions/', 'weight': 5, 'body': {
+        'customer': '{customer}', 'amount': '25.00', 'transaction_type': 'CREDIT',
+    }},
+    {'name': 'current-user', 'method': 'GET', 'path': '/api/current-user/', 'weight': 10},
+    {'name': 'reports', 'method': 'GET', 'path': '/api/reports/', 'weight': 5},
+]
+
+PLACEHOLDERS = {'customer': Customer, 'item': Inventory, 'bill': Bill, 'transaction': Transaction}
+
+
+def load_profile(path):
+    """Profile entries from a JSON Lines file, each with a name, method and path and optionally a weight and body"""
+    profile = []
+    with open(path) as handle:
+        for number, line in enumerate(handle, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as error:
+                raise ValueError(f'Line {number}: {error}')
+            if not isinstance(entry, dict) or not {'name', 'method', 'path'} <= set(entry):
+                raise ValueError(f'Line {number}: expected an object with name, method and path')
+            profile.append(entry)
+    if not profile:
+        raise ValueError(f'{path} holds no requests')
+    return profile
+
+
+def _fill(value, ids):
+    # '{bill}' alone becomes the id itself, so JSON bodies keep integer ids
+    if isinstance(value, dict):
+        return {key: _fill(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, ids) for item in value]
+    if isinstance(value, str):
+        if value.startswith('{') and value.endswith('}') and value[1:-1] in ids:
+            return ids[value[1:-1]]
+        return value.format_map(ids) if '{' in value else value
+    return value
+
+
+def replay(profile, user, clients=8, requests=1000, seed=1):
+    """
+    Send requests picked from profile by weight from clients threads at once.
+
+    Returns ({name: [(seconds, queries, ok), ...]}, seconds) for the whole run.
+    """
+    business = Business.objects.filter(owner=user).first()
+    ids = {
+        placeholder: list(model.objects.filter(business=business).values_list('id', flat=True))
+        for placeholder, model in PLACEHOLDERS.items()
+    }
+    weights = [entry.get('weight', 1) for entry in profile]
+    tickets = itertools.count()
+    results = defaultdict(list)
+    lock = threading.Lock()
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = APIClient()
+        client.force_authenticate(user)
+        samples = []
+        try:
+            while next(tickets) < requests:
+                entry = rng.choices(profile, weights)[0]
+                chosen = {placeholder: rng.choice(pks) for placeholder, pks in ids.items() if pks}
+                path = _fill(entry['path'], chosen)
+                body = json.dumps(_fill(entry['body'], chosen)) if 'body' in entry else ''
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    try:
+                        ok = client.generic(entry['method'], path, body, 'application/json').status_code < 400
+                    except Exception:
+                        ok = False  # e.g. "database is locked"
+                    elapsed = time.perf_counter() - start
+                samples.append((entry['name'], elapsed, len(captured), ok))
+        finally:
+            connection.close()
+            with lock:
+                for name, elapsed, queries, ok in samples:
+                    results[name].append((elapsed, queries, ok))
+
+    start = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(number,)) for number in range(clients)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return dict(results), time.perf_counter() - start
+
+
+def _percentile(values, fraction):
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def summarize(results, seconds):
+    """{name: stats} for every endpoint and 'total', latencies in milliseconds"""
+    def stats(samples):
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+        return {
+            'requests': len(samples),
+            'errors': sum(not ok for _, _, ok in samples),
+            'rps': round(len(samples) / seconds, 2),
+            'p50_ms': round(_percentile(latencies, 0.5), 2),
+            'p95_ms': round(_percentile(latencies, 0.95), 2),
+            'p99_ms': round(_percentile(latencies, 0.99), 2),
+            'queries': round(sum(queries for _, queries, _ in samples) / len(samples), 2),
+        }
+
+    summary = {name: stats(samples) for name, samples in sorted(results.items())}
+    summary['total'] = stats([sample for samples in results.values() for sample in samples])
+    return summary
+
+
+def combine_runs(summaries):
+    """One summary from several runs of the same mix: request and error counts add up, the rest is the median"""
+    combined = {}
+    for name in summaries[0]:
+        rows = [summary[name] for summary in summaries if name in summary]
+        combined[name] = {
+            key: sum(row[key] for row in rows) if key in ('requests', 'errors')
+            else sorted(row[key] for row in rows)[len(rows) // 2]
+            for key in rows[0]
+        }
+    return combined
+
+
+# Differences smaller than these are noise, whatever the tolerance: cold caches
+# add the odd query, and sub-millisecond latencies jitter by more than 10%
+LATENCY_NOISE_MS = 1.0
+QUERIES_NOISE = 0.5
+
+
+def find_regressions(summary, baseline, tolerance):
+    """Every way summary is worse than baseline by more than tolerance (a fraction), as text"""
+    regressions = []
+    for name, before in baseline.items():
+        after = summary.get(name)
+        if after is None:
+            continue
+        if name == 'total' and after['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {after['rps']} req/s, was {before['rps']}")
+        # A hundred or so requests per endpoint pin down the median; only the whole run has tails to compare
+        for key in ('p50_ms', 'p95_ms') if name == 'total' else ('p50_ms',):
+            if after[key] > before[key] * (1 + tolerance) and after[key] - before[key] > LATENCY_NOISE_MS:
+                regressions.append(f'{name}: {key[:3]} {after[key]}ms, was {before[key]}ms')
+        if after['queries'] > before['queries'] + QUERIES_NOISE:
+            regressions.append(f"{name}: {after['queries']} queries per request, was {before['queries']}")
+        if after['errors'] > before['errors']:
+            regressions.append(f"{name}: {after['errors']} errors, was {before['errors']}")
+    return regressions
@@ -0,0 +1,151 @@
+"""
+Change tracking for the customer and inventory catalogs.
+
+Every write sets updated_at, and deletions leave a Tombstone, so the newest
+of the two is a per-business change version: list responses carry it as
+Last-Modified and inside a strong ETag, and ?since=<timestamp> returns only
+the rows changed and the ids deleted at or after that time. Both come from
+(business, updated_at) and (business, model, deleted_at) index lookups.
+
+updated_at is stamped before the write commits, so a row can become visible
+after a newer one has already been read. The cursor handed back for the next
+?since= therefore trails the change version by SAFETY_WINDOW seconds, longer
+than any write transaction; rows changed within the window are sent again.
+Changed rows come PAGE_SIZE at a time in (updated_at, id) order, with an
+opaque position to continue from.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_etags
+
+from .models import Business, Tombstone
+
+
+def _version_query(model, business):
+    # Both halves are a LIMIT 1 scan from the end of an index, fetched in one query
+    return Business.objects.filter(pk=business.pk).annotate(
+        updated=Subquery(model.objects.filter(business=OuterRef('pk')).order_by('-updated_at').values('updated_at')[:1]),
+        deleted=Subquery(Tombstone.objects.filter(
+            business=OuterRef('pk'), model=model._meta.model_name
+        ).order_by('-deleted_at').values('deleted_at')[:1]),
+    ).values_list('updated', 'deleted')
+
+
+def change_version(model, business):
+    """Newest updated_at or deletion time of a business's rows of a model, or None"""
+    if business is None:
+        return None
+    return max(filter(None, _version_query(model, business).first() or []), default=None)
+
+
+async def achange_version(model, business):
+    if business is None:
+        return None
+    return max(filter(None, await _version_query(model, business).afirst() or []), default=None)
+
+
+def catalog_etag(model, business, version, *variants):
+    """Strong ETag for one representation of a catalog at a change version"""
+    key = ':'.join([model._meta.model_name, str(business and business.pk), version.isoformat() if version else '', *variants])
+    return '"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def etag_matches(request, etag):
+    """Whether the client's If-None-Match holds this ETag"""
+    # Only the ETag is compared: Last-Modified has one-second resolution and would
+    # hide a change made in the same second as the client's copy
+    return etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+
+def set_catalog_headers(response, etag, version):
+    response['ETag'] = etag
+    if version is not None:
+        response['Last-Modified'] = http_date(version.timestamp())
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def parse_since(value):
+    """An aware datetime from ISO 8601 or epoch seconds, or None if it is neither"""
+    try:
+        return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError):
+        pass
+    try:
+        since = parse_datetime(value)
+    except ValueError:
+        return None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def change_sync_settings():
+    options = {
+        'PAGE_SIZE': 500,
+        'SAFETY_WINDOW': 60,
+    }
+    options.update(getattr(settings, 'CHANGE_SYNC', {}))
+    return options
+
+
+def sync_cursor(version, fallback):
+    """The since to hand back for the next sync, SAFETY_WINDOW before the change version"""
+    return (version or fallback) - timedelta(seconds=change_sync_settings()['SAFETY_WINDOW'])
+
+
+def encode_position(row, cursor):
+    """Opaque token for continuing a sync after row, keeping the first page's cursor"""
+    position = [row.updated_at.isoformat(), row.pk, cursor.isoformat()]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_position(token):
+    """(updated_at, pk, cursor) from encode_position, or None if the token is not one"""
+    try:
+        updated_at, pk, cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        updated_at, cursor = parse_datetime(updated_at), parse_datetime(cursor)
+    except (TypeError, ValueError, binascii.Error):
+        return None
+    if updated_at is None or cursor is None or not isinstance(pk, int):
+        return None
+    return updated_at, pk, cursor
+
+
+def changed_page(queryset, since, position=None):
+    """
+    (rows, more) of queryset changed at or after since, after position if given.
+
+    At most PAGE_SIZE rows are returned; more says whether others follow.
+    """
+    limit = change_sync_settings()['PAGE_SIZE']
+    queryset = queryset.filter(updated_at__gte=since)
+    if position is not None:
+        updated_at, pk, _ = position
+        queryset = queryset.filter(updated_at__gte=updated_at).exclude(updated_at=updated_at, pk__lte=pk)
+    rows = list(queryset.order_by('updated_at', 'id')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def deleted_since(model, business, since):
+    return list(Tombstone.objects.filter(
+        business=business, model=model._meta.model_name, deleted_at__gte=since
+    ).order_by('deleted_at').values_list('object_id', flat=True))
+
+
+def record_deletions(model, rows):
+    """Leave a Tombstone for each (business_id, id) of deleted rows"""
+    now = timezone.now()
+    Tombstone.objects.bulk_create([
+        Tombstone(business_id=business_id, model=model._meta.model_name, object_id=pk, deleted_at=now)
+        for business_id, pk in rows
+    ])
@@ -0,0 +1,102 @@
+"""
+Streaming CSV and JSON Lines exports of bills and transactions.
+
+Rows are read in id-ordered keyset chunks and written one line at a time
+into a StreamingHttpResponse, so an export of a whole financial year never
+holds more than one chunk in memory.
+"""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import StreamingHttpResponse
+
+from .models import BillItem
+
+EXPORT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+BILL_COLUMNS = ['id', 'created_at', 'customer', 'customer_name', 'payment_mode', 'total_amount']
+BILL_ITEM_COLUMNS = ['inventory_item', 'item_name', 'quantity', 'price']
+TRANSACTION_COLUMNS = [
+    'id', 'created_at', 'customer', 'customer_name', 'transaction_type', 'amount', 'description', 'bill_attachment',
+]
+
+
+class Echo:
+    """File-like object whose write() returns the line instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def keyset_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield lists of rows ordered by id, each fetched with WHERE id > last_id"""
+    queryset = queryset.order_by('id')
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id)[:chunk_size].iterator(chunk_size=chunk_size))
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1]['id']
+
+
+def bill_rows(bills, chunk_size=EXPORT_CHUNK_SIZE):
+    """Bills as dicts with their items, loading the items of one chunk at a time"""
+    bills = bills.prefetch_related(None).values(
+        'id', 'created_at', 'customer', 'payment_mode', 'total_amount', customer_name=F('customer__name'),
+    )
+    for chunk in keyset_chunks(bills, chunk_size):
+        items = {}
+        for item in BillItem.objects.filter(bill_id__in=[bill['id'] for bill in chunk]).order_by('bill_id', 'id') \
+                .values('bill_id', 'inventory_item', 'quantity', 'price', item_name=F('inventory_item__name')):
+            items.setdefault(item.pop('bill_id'), []).append(item)
+        for bill in chunk:
+            bill['items'] = items.get(bill['id'], [])
+            yield bill
+
+
+def transaction_rows(transactions, chunk_size=EXPORT_CHUNK_SIZE):
+    transactions = transactions.values(
+        'id', 'created_at', 'customer', 'transaction_type', 'amount', 'description', 'bill_attachment',
+        customer_name=F('customer__name'),
+    )
+    for chunk in keyset_chunks(transactions, chunk_size):
+        yield from chunk
+
+
+def _csv_lines(rows, columns, item_columns=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns + (item_columns or []))
+    for row in rows:
+        values = [row[column] for column in columns]
+        if item_columns is None:
+            yield writer.writerow(values)
+        elif not row['items']:
+            yield writer.writerow(values + [''] * len(item_columns))
+        else:
+            # One line per bill item, repeating the bill columns
+            for item in row['items']:
+                yield writer.writerow(values + [item[column] for column in item_columns])
+
+
+def _jsonl_lines(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+
+def export_response(rows, output, name, columns, item_columns=None):
+    """StreamingHttpResponse writing rows as CSV or JSON Lines"""
+    if output == 'csv':
+        lines = _csv_lines(rows, columns, item_columns)
+    else:
+        lines = _jsonl_lines(rows)
+    response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{name}.{output}"'
+    return response
@@ -0,0 +1,265 @@
+"""
+Bulk import of inventory, customers and historical bills from CSV or JSON Lines.
+
+Records are validated with the API serializers, a batch at a time: related
+customers and inventory items for the whole batch are loaded in one query
+each, invalid records are reported and skipped, and the valid ones are
+written with bulk_create. Each batch commits together with its ImportRun, so
+a crashed import resumes after the last committed record.
+
+Historical bills update customer balances and the sales rollups, but not
+current stock, which is imported as it stands today.
+"""
+import csv
+import itertools
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .ledger import apply_balance_changes
+from .models import Bill, BillItem, Customer, ImportRun, Inventory, StockMovement
+from .reports import RollupDelta
+from .serializers import BillItemSerializer, BillSerializer, CustomerSerializer, InventorySerializer
+
+IMPORT_BATCH_SIZE = 500
+MAX_STORED_ERRORS = 1000
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+BILL_ITEM_FIELDS = ['inventory_item', 'quantity', 'price']
+
+
+class BatchRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field resolved from the objects the importer loaded for the whole batch"""
+
+    def to_internal_value(self, data):
+        try:
+            return self.context['related'][self.queryset.model][int(data)]
+        except (KeyError, TypeError, ValueError):
+            self.fail('does_not_exist', pk_value=data)
+
+
+class ImportInventorySerializer(InventorySerializer):
+    class Meta(InventorySerializer.Meta):
+        fields = ['name', 'description', 'price', 'current_stock', 'image_url']
+
+
+class ImportCustomerSerializer(CustomerSerializer):
+    class Meta(CustomerSerializer.Meta):
+        fields = ['name', 'phone', 'email']
+
+
+class ImportBillItemSerializer(BillItemSerializer):
+    inventory_item = BatchRelatedField(queryset=Inventory.objects.all())
+
+
+class ImportBillSerializer(BillSerializer):
+    customer = BatchRelatedField(queryset=Customer.objects.all())
+    items = ImportBillItemSerializer(many=True)
+    created_at = serializers.DateTimeField(required=False)  # Historical bills keep their date
+    reservation = None
+
+    class Meta(BillSerializer.Meta):
+        fields = ['customer', 'total_amount', 'payment_mode', 'created_at', 'items']
+
+
+def detect_format(name):
+    for extension, file_format in FORMATS.items():
+        if name.lower().endswith(extension):
+            return file_format
+    return None
+
+
+def read_records(lines, file_format, kind):
+    """
+    Yield one dict per record from an iterable of text lines.
+
+    Unreadable JSON lines are yielded as ValueError so they are reported like
+    any other invalid record. CSV bills use the layout of the bill export: one
+    line per item, consecutive lines with the same id forming one bill.
+    """
+    if file_format == 'jsonl':
+        for line in lines:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as exc:
+                    yield ValueError(f'Invalid JSON: {exc}')
+        return
+
+    # Empty cells mean "not given", so optional fields fall back to their defaults
+    rows = ({key: value for key, value in row.items() if value != ''} for row in csv.DictReader(lines))
+    if kind != 'bills':
+        yield from rows
+        return
+    for _, bill_lines in itertools.groupby(rows, key=lambda row: row.get('id') or object()):
+        bill_lines = list(bill_lines)
+        bill = {key: value for key, value in bill_lines[0].items() if key not in BILL_ITEM_FIELDS}
+        bill['items'] = [
+            {field: line.get(field) for field in BILL_ITEM_FIELDS} for line in bill_lines if line.get('inventory_item')
+        ]
+        yield bill
+
+
+def _ids(values):
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+
+class Importer:
+    serializer_class = None
+
+    def __init__(self, run, batch_size=IMPORT_BATCH_SIZE):
+        self.run = run
+        self.business = run.business
+        self.batch_size = batch_size
+
+    def related(self, records):
+        """{model: {pk: instance}} for the BatchRelatedFields of these records"""
+        return {}
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def import_records(self, records, on_batch=None):
+        """Import records, skipping the ones a previous attempt of this run already processed"""
+        records = itertools.islice(records, self.run.position, None)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                break
+            self.import_batch(batch)
+            if on_batch:
+                on_batch(self.run)
+
+        self.run.finished_at = timezone.now()
+        self.run.save(update_fields=['finished_at'])
+        return self.run
+
+    def import_batch(self, records):
+        context = {'related': self.related([record for record in records if isinstance(record, dict)])}
+        rows, errors = [], []
+        for number, record in enumerate(records, start=self.run.position + 1):
+            if isinstance(record, Exception):
+                errors.append({'record': number, 'errors': {'non_field_errors': [str(record)]}})
+                continue
+            serializer = self.serializer_class(data=record, context=context)
+            if serializer.is_valid():
+                rows.append(serializer.validated_data)
+            else:
+                errors.append({'record': number, 'errors': serializer.errors})
+
+        with transaction.atomic():
+            if rows:
+                self.write(rows)
+            self.run.position += len(records)
+            self.run.imported += len(rows)
+            self.run.failed += len(errors)
+            self.run.errors.extend(errors[:max(MAX_STORED_ERRORS - len(self.run.errors), 0)])
+            self.run.save(update_fields=['position', 'imported', 'failed', 'errors'])
+
+
+class InventoryImporter(Importer):
+    serializer_class = ImportInventorySerializer
+
+    def write(self, rows):
+        items = Inventory.objects.bulk_create([Inventory(business=self.business, **row) for row in rows])
+        StockMovement.objects.bulk_create([
+            StockMovement(inventory_item=item, delta=item.current_stock, reason='OPENING')
+            for item in items if item.current_stock
+        ])
+
+
+class CustomerImporter(Importer):
+    serializer_class = ImportCustomerSerializer
+
+    def write(self, rows):
+        Customer.objects.bulk_create([Customer(business=self.business, **row) for row in rows])
+
+
+class BillImporter(Importer):
+    serializer_class = ImportBillSerializer
+
+    def related(self, records):
+        # Only this business's rows are loaded, so foreign ids fail validation as unknown
+        customer_ids = _ids(record.get('customer') for record in records)
+        inventory_ids = _ids(
+            item.get('inventory_item') for record in records
+            if isinstance(record.get('items'), list) for item in record['items'] if isinstance(item, dict)
+        )
+        return {
+            Customer: Customer.objects.filter(business=self.business).in_bulk(customer_ids),
+            Inventory: Inventory.objects.filter(business=self.business).in_bulk(inventory_ids),
+        }
+
+    def write(self, rows):
+        _, rollup = create_bills(self.business, rows)
+        rollup.apply()
+
+
+def create_bills(business, rows):
+    """
+    Bulk-insert validated bills with their items and move customer balances.
+
+    Stock is left alone. Returns the bills and the RollupDelta for the caller
+    to apply or enqueue.
+    """
+    bills = Bill.objects.bulk_create([
+        Bill(business=business, customer=row['customer'], total_amount=row['total_amount'],
+             payment_mode=row['payment_mode'])
+        for row in rows
+    ])
+
+    # created_at is auto_now_add, so historical dates are restored afterwards
+    dated = []
+    for bill, row in zip(bills, rows):
+        if row.get('created_at'):
+            bill.created_at = row['created_at']
+            dated.append(bill)
+    if dated:
+        Bill.objects.bulk_update(dated, ['created_at'])
+
+    BillItem.objects.bulk_create([
+        BillItem(bill=bill, **item) for bill, row in zip(bills, rows) for item in row['items']
+    ])
+
+    balances = defaultdict(Decimal)
+    activity = {}
+    rollup = RollupDelta()
+    for bill, row in zip(bills, rows):
+        balances[bill.customer_id] += bill.total_amount
+        activity[bill.customer_id] = max(activity.get(bill.customer_id, bill.created_at), bill.created_at)
+        rollup.add_bill(bill, row['items'])
+    apply_balance_changes(balances, activity)
+    return bills, rollup
+
+
+IMPORTERS = {
+    'inventory': InventoryImporter,
+    'customers': CustomerImporter,
+    'bills': BillImporter,
+}
+
+
+def start_run(business, kind, source, resume=False):
+    """The unfinished run for this source when resuming, otherwise a new one"""
+    if resume:
+        run = ImportRun.objects.filter(
+            business=business, kind=kind, source=source, finished_at__isnull=True
+        ).order_by('-id').first()
+        if run is not None:
+            return run
+    return ImportRun.objects.create(business=business, kind=kind, source=source)
+
+
+def import_file(run, lines, file_format, batch_size=IMPORT_BATCH_SIZE, on_batch=None):
+    importer = IMPORTERS[run.kind](run, batch_size)
+    return importer.import_records(read_records(lines, file_format, run.kind), on_batch=on_batch)
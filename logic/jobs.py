@@ -0,0 +1,205 @@
+"""
+Database-backed background jobs.
+
+Functions decorated with @job are queued with func.delay(**payload). The Job
+row is inserted by a transaction.on_commit hook, so a worker never picks up
+work for a request that rolled back, and the request itself only pays for
+its core writes. `manage.py run_jobs` claims due jobs in batches and runs
+each one in a transaction together with the deletion of its row, so a job
+whose effects committed is never run twice. Failures are retried with
+exponential backoff and moved to DeadJob after JOB_QUEUE['MAX_ATTEMPTS'].
+
+Jobs queued just before a process crash, after their request committed, are
+lost; the rollups they maintain can be recomputed with rebuild_rollups().
+"""
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+JOBS = {}
+
+DEFAULTS = {
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 5,  # Seconds before the first retry, doubled for each further attempt
+    'RETRY_MAX_DELAY': 3600,
+    'LOCK_TIMEOUT': 300,  # Claimed jobs whose worker died are picked up again after this
+}
+
+
+def queue_setting(name):
+    return getattr(settings, 'JOB_QUEUE', {}).get(name, DEFAULTS[name])
+
+
+def job(func=None, max_attempts=None):
+    """Register a function as a job and give it .delay(**payload) to queue it after commit"""
+    def register(func):
+        name = f'{func.__module__}.{func.__name__}'
+        func.job_name = name
+        func.max_attempts = max_attempts
+        func.delay = lambda **payload: enqueue(name, payload)
+        JOBS[name] = func
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(name, payload, delay=None):
+    """Insert the job once the current transaction commits, or straight away outside one"""
+    from .models import Job
+
+    fields = {'name': name, 'payload': payload}
+    if delay:
+        fields['run_at'] = timezone.now() + timedelta(seconds=delay)
+    # robust: the request has already committed, so a failed insert is logged rather than raised
+    transaction.on_commit(lambda: Job.objects.create(**fields), robust=True)
+
+
+def resolve(name):
+    # Job modules are imported lazily by the worker the first time it meets their jobs
+    if name not in JOBS:
+        import_string(name)
+    return JOBS[name]
+
+
+def retry_delay(attempts):
+    delay = min(queue_setting('RETRY_BACKOFF') * 2 ** (attempts - 1), queue_setting('RETRY_MAX_DELAY'))
+    return delay + random.uniform(0, delay / 10)  # Jitter so failed batches do not retry in lockstep
+
+
+class Worker:
+    """Claims due jobs in batches and runs them, counting throughput and queue lag"""
+
+    def __init__(self, batch_size=20):
+        self.batch_size = batch_size
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = self.retried = self.dead = 0
+        self.lag_total = self.lag_max = 0.0
+
+    def claim(self):
+        from .models import Job
+
+        now = timezone.now()
+        stale = now - timedelta(seconds=queue_setting('LOCK_TIMEOUT'))
+        due = Job.objects.filter(Q(locked_at__isnull=True) | Q(locked_at__lt=stale), run_at__lte=now)
+        token = f'{self.name}:{uuid.uuid4().hex[:8]}'
+        # One UPDATE claims the batch, so concurrent workers never get the same job
+        Job.objects.filter(id__in=due.order_by('run_at', 'id').values('id')[:self.batch_size]).update(
+            locked_by=token, locked_at=now
+        )
+        return list(Job.objects.filter(locked_by=token).order_by('run_at', 'id'))
+
+    def run(self, job):
+        from .models import DeadJob, Job
+
+        lag = (timezone.now() - job.run_at).total_seconds()
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        try:
+            func = resolve(job.name)
+            with transaction.atomic():
+                # Deleting first takes the write lock up front; a failure rolls it back
+                deleted, _ = Job.objects.filter(id=job.id).delete()
+                if not deleted:
+                    # Reclaimed after LOCK_TIMEOUT and already run by another worker
+                    logger.info('Job %s (%s) was run by another worker, skipping it', job.id, job.name)
+                    return False
+                func(**job.payload)
+            self.processed += 1
+            return True
+        except Exception:
+            error = traceback.format_exc()
+            attempts = job.attempts + 1
+            max_attempts = getattr(JOBS.get(job.name), 'max_attempts', None) or queue_setting('MAX_ATTEMPTS')
+            if attempts >= max_attempts:
+                with transaction.atomic():
+                    DeadJob.objects.create(name=job.name, payload=job.payload, attempts=attempts, error=error,
+                                           created_at=job.created_at)
+                    Job.objects.filter(id=job.id).delete()
+                self.dead += 1
+                logger.error('Job %s (%s) failed %d times, moved to the dead-letter table', job.id, job.name, attempts)
+            else:
+                Job.objects.filter(id=job.id).update(
+                    attempts=attempts, last_error=error, locked_by=None, locked_at=None,
+                    run_at=timezone.now() + timedelta(seconds=retry_delay(attempts)),
+                )
+                self.retried += 1
+                logger.warning('Job %s (%s) failed, attempt %d of %d', job.id, job.name, attempts, max_attempts)
+            return False
+
+    def work_off(self, stop=None):
+        """Run due jobs until none are left (or stop is set) and return how many ran"""
+        count = 0
+        while stop is None or not stop.is_set():
+            jobs = self.claim()
+            if not jobs:
+                break
+            for job in jobs:
+                self.run(job)
+                count += 1
+        return count
+
+    def stats(self):
+        runs = self.processed + self.retried + self.dead
+        return {
+            'worker': self.name,
+            'processed': self.processed,
+            'retried': self.retried,
+            'dead': self.dead,
+            'lag_avg': self.lag_total / runs if runs else 0.0,
+            'lag_max': self.lag_max,
+        }
+
+
+def work_off():
+    """Run every due job in this process, e.g. from tests or a cron job"""
+    return Worker().work_off()
+
+
+def queue_stats():
+    """Queue depth and lag: how long the oldest due job has been waiting, in seconds"""
+    from .models import DeadJob, Job
+
+    now = timezone.now()
+    lock_cutoff = now - timedelta(seconds=queue_setting('LOCK_TIMEOUT'))
+    oldest = Job.objects.filter(run_at__lte=now, locked_at__isnull=True).aggregate(oldest=Min('run_at'))['oldest']
+    return {
+        'pending': Job.objects.count(),
+        'due': Job.objects.filter(run_at__lte=now).count(),
+        'running': Job.objects.filter(locked_at__gte=lock_cutoff).count(),
+        'dead': DeadJob.objects.count(),
+        'lag': (now - oldest).total_seconds() if oldest else 0.0,
+    }
+
+
+def run_worker(stop, batch_size=20, poll_interval=1.0, report_interval=30.0):
+    """Worker process loop: drain due jobs, sleep, and log throughput every report_interval"""
+    worker = Worker(batch_size)
+    started = last_report = time.monotonic()
+    reported = 0
+    while not stop.is_set():
+        if not worker.work_off(stop):
+            stop.wait(poll_interval)
+        close_old_connections()
+
+        now = time.monotonic()
+        if now - last_report >= report_interval:
+            stats = worker.stats()
+            logger.info(
+                '%s: %.1f jobs/s, %d processed, %d retried, %d dead, lag avg %.2fs max %.2fs',
+                worker.name, (stats['processed'] - reported) / (now - last_report), stats['processed'],
+                stats['retried'], stats['dead'], stats['lag_avg'], stats['lag_max'],
+            )
+            last_report, reported = now, stats['processed']
+    return worker.stats() | {'seconds': time.monotonic() - started}
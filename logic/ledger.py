@@ -0,0 +1,111 @@
+"""
+Materialised per-customer ledger.
+
+A customer's balance is what they owe the store: bill totals and CREDIT
+transactions add to it, DEBIT transactions (payments received) reduce it.
+last_activity_at is the newest of the customer's own creation time and the
+created_at of their bills and transactions.
+"""
+from decimal import Decimal
+
+from django.db.models import Case, DateTimeField, DecimalField, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from .models import Bill, Customer, Transaction
+
+ZERO = Decimal('0.00')
+
+
+def transaction_amount(transaction_type, amount):
+    """Signed effect of a transaction on the customer's balance"""
+    return amount if transaction_type == 'CREDIT' else -amount
+
+
+def apply_balance_changes(deltas, activity=None):
+    """
+    Apply {customer_id: delta} to Customer.balance in one UPDATE.
+
+    activity maps customer_id -> datetime and only ever moves last_activity_at forward.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    activity = activity or {}
+    customer_ids = deltas.keys() | activity.keys()
+    if not customer_ids:
+        return 0
+
+    # Queryset updates skip auto_now, and catalog syncs must see the new balance
+    updates = {'updated_at': timezone.now()}
+    if deltas:
+        updates['balance'] = Case(
+            *[When(id=pk, then=F('balance') + Value(delta)) for pk, delta in deltas.items()],
+            default=F('balance'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    if activity:
+        updates['last_activity_at'] = Case(
+            *[When(id=pk, then=Greatest(F('last_activity_at'), Value(at))) for pk, at in activity.items()],
+            default=F('last_activity_at'),
+            output_field=DateTimeField(),
+        )
+    return Customer.objects.filter(id__in=list(customer_ids)).update(**updates)
+
+
+def expected_ledgers(customer_ids):
+    """Recompute {customer_id: (balance, last_activity_at)} from bills and transactions"""
+    ledgers = {
+        pk: [ZERO, created_at]
+        for pk, created_at in Customer.objects.filter(id__in=customer_ids).values_list('id', 'created_at')
+    }
+
+    bills = Bill.objects.filter(customer_id__in=customer_ids).values('customer_id').annotate(
+        total=Sum('total_amount'), last=Max('created_at')
+    )
+    transactions = Transaction.objects.filter(customer_id__in=customer_ids).values('customer_id').annotate(
+        credit=Coalesce(Sum('amount', filter=Q(transaction_type='CREDIT')), ZERO),
+        debit=Coalesce(Sum('amount', filter=Q(transaction_type='DEBIT')), ZERO),
+        last=Max('created_at'),
+    )
+
+    for row in bills:
+        ledger = ledgers[row['customer_id']]
+        ledger[0] += row['total']
+        ledger[1] = max(ledger[1], row['last'])
+    for row in transactions:
+        ledger = ledgers[row['customer_id']]
+        ledger[0] += row['credit'] - row['debit']
+        ledger[1] = max(ledger[1], row['last'])
+
+    return {pk: (balance, last) for pk, (balance, last) in ledgers.items()}
+
+
+def refresh_last_activity(customer_id):
+    """Recompute last_activity_at after something was deleted from the customer's history"""
+    # Each MAX() is answered from a (customer, created_at) index
+    last_bill = Bill.objects.filter(customer_id=customer_id).aggregate(last=Max('created_at'))['last']
+    last_transaction = Transaction.objects.filter(customer_id=customer_id).aggregate(last=Max('created_at'))['last']
+    Customer.objects.filter(id=customer_id).update(
+        last_activity_at=Greatest(
+            F('created_at'),
+            Coalesce(Value(last_bill, output_field=DateTimeField()), F('created_at')),
+            Coalesce(Value(last_transaction, output_field=DateTimeField()), F('created_at')),
+        ),
+        updated_at=timezone.now(),
+    )
+
+
+def ledger_entry(instance):
+    """(customer_id, signed amount) of a Bill or Transaction"""
+    if isinstance(instance, Bill):
+        return instance.customer_id, Decimal(str(instance.total_amount))
+    return instance.customer_id, transaction_amount(instance.transaction_type, Decimal(str(instance.amount)))
+
+
+def stored_ledger_entry(instance):
+    """The entry as currently stored in the database, or None for a new row"""
+    if instance.pk is None:
+        return None
+    if isinstance(instance, Bill):
+        return Bill.objects.filter(pk=instance.pk).values_list('customer_id', 'total_amount').first()
+    row = Transaction.objects.filter(pk=instance.pk).values_list('customer_id', 'transaction_type', 'amount').first()
+    return row and (row[0], transaction_amount(row[1], row[2]))
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from logic.bench import DEFAULT_PROFILE, benchmark_database, combine_runs, find_regressions, load_profile, replay, \
+    seed_bench_store, summarize
+
+SIZES = ['customers', 'inventory', 'bills', 'transactions', 'lines']
+
+
+class Command(BaseCommand):
+    help = 'Replay a request mix against a seeded store with concurrent clients and compare with a saved baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--inventory', type=int, default=500)
+        parser.add_argument('--bills', type=int, default=2000)
+        parser.add_argument('--transactions', type=int, default=2000)
+        parser.add_argument('--lines', type=int, default=3, help='Items per seeded bill')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--profile', help='JSON Lines request mix; the built-in mix when left out')
+        parser.add_argument('--write-profile', metavar='FILE', help='Write the built-in mix to FILE and exit')
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--warmup', type=int, default=100, help='Untimed requests sent first')
+        parser.add_argument('--runs', type=int, default=3, help='Timed runs; the report shows their medians')
+        parser.add_argument('--save-baseline', metavar='FILE')
+        parser.add_argument('--baseline', metavar='FILE', help='Fail when the run is worse than this baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown as a fraction of the baseline')
+
+    def handle(self, *args, **options):
+        if options['write_profile']:
+            with open(options['write_profile'], 'w') as handle:
+                handle.writelines(json.dumps(entry) + '\n' for entry in DEFAULT_PROFILE)
+            return
+
+        try:
+            profile = load_profile(options['profile']) if options['profile'] else DEFAULT_PROFILE
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+
+        config = {key: options[key] for key in [*SIZES, 'seed', 'profile', 'clients', 'requests', 'warmup', 'runs']}
+        with benchmark_database(on_disk=True):
+            self.stdout.write('Seeding ' + ', '.join(f'{options[key]} {key}' for key in SIZES[:-1]) + '...')
+            owner, _ = seed_bench_store(**{key: options[key] for key in [*SIZES, 'seed']})
+            if options['warmup']:
+                replay(profile, owner, clients=1, requests=options['warmup'], seed=options['seed'] - 1)
+            summary = combine_runs([
+                summarize(*replay(
+                    profile, owner, clients=options['clients'], requests=options['requests'], seed=options['seed'] + run
+                ))
+                for run in range(options['runs'])
+            ])
+
+        self.stdout.write(
+            f"{'endpoint':>20} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'queries':>8} {'errors':>7}"
+        )
+        for name, row in summary.items():
+            self.stdout.write(
+                f"{name:>20} {row['requests']:>9} {row['rps']:>8.1f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                f"{row['p99_ms']:>8.2f} {row['queries']:>8.2f} {row['errors']:>7}"
+            )
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as handle:
+                json.dump({'config': config, 'results': summary}, handle, indent=2)
+            self.stdout.write(f"Baseline saved to {options['save_baseline']}")
+
+        if baseline is not None:
+            if baseline['config'] != config:
+                self.stderr.write('The baseline was taken with other options; the comparison may not be fair')
+            regressions = find_regressions(summary, baseline['results'], options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f"Within {options['tolerance']:.0%} of the baseline"))
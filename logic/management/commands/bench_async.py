@@ -0,0 +1,196 @@
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from io import BytesIO
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+
+from logic.async_views import async_urlconf
+from logic.bench import benchmark_database, create_store
+from logic.models import Bill, BillItem
+
+PATHS = ['/api/bills/', '/api/inventories/', '/api/current-user/']
+
+
+def percentile(values, fraction):
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+async def drive(call, paths, clients, requests):
+    """Closed loop: clients each send their next request as soon as the last one is answered"""
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def client(number):
+        nonlocal errors
+        for sent in remaining:
+            start = time.perf_counter()
+            status = await call(number, paths[sent % len(paths)])
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(number) for number in range(clients)])
+    return requests / (time.perf_counter() - start), sorted(latencies), errors
+
+
+def asgi_caller(headers):
+    handler = ASGIHandler()
+
+    async def call(client, path):
+        url = urlsplit(path)
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': url.path, 'raw_path': url.path.encode(), 'query_string': url.query.encode(),
+            'root_path': '', 'headers': [(b'host', b'testserver')] + [
+                (name.lower().encode(), value.encode()) for name, value in headers.items()
+            ],
+            'server': ('testserver', 80), 'client': ('127.0.0.1', client),
+        }
+        response = {}
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+
+        await handler(scope, receive, send)
+        return response.get('status')
+
+    return call
+
+
+def wsgi_caller(headers, threads):
+    handler = WSGIHandler()
+    pool = ThreadPoolExecutor(threads)
+
+    def get(path):
+        url = urlsplit(path)
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': url.path, 'QUERY_STRING': url.query,
+            'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr,
+            **{'HTTP_' + name.upper().replace('-', '_'): value for name, value in headers.items()},
+        }
+        setup_testing_defaults(environ)
+        status = []
+        body = handler(environ, lambda line, response_headers, exc_info=None: status.append(int(line.split()[0])))
+        b''.join(body)
+        body.close()  # Fires request_finished, which returns the thread's connection
+        return status[0]
+
+    async def call(client, path):
+        return await asyncio.get_running_loop().run_in_executor(pool, get, path)
+
+    return call, pool
+
+
+def http_caller(base_url, headers):
+    """Keep-alive HTTP/1.1 GETs against a running server, one connection per client"""
+    url = urlsplit(base_url)
+    connections = {}
+    request_headers = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+
+    async def call(client, path):
+        if client not in connections:
+            connections[client] = await asyncio.open_connection(url.hostname, url.port or 80)
+        reader, writer = connections[client]
+        writer.write(f'GET {url.path.rstrip("/")}{path} HTTP/1.1\r\nHost: {url.netloc}\r\n{request_headers}\r\n'.encode())
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        length, close = 0, False
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'connection' and 'close' in value.lower():
+                close = True
+        await reader.readexactly(length)
+        if close:
+            writer.close()
+            del connections[client]
+        return status
+
+    return call
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/s and tail latency of the async read views under ASGI with the sync WSGI views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[100, 500, 1000])
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run')
+        parser.add_argument('--paths', nargs='+', default=PATHS)
+        parser.add_argument('--wsgi-threads', type=int, default=32,
+                            help='Worker threads of the in-process WSGI server, like gunicorn --threads')
+        parser.add_argument('--bills', type=int, default=500, help='Bills seeded for the in-process runs')
+        parser.add_argument('--url', action='append', default=[],
+                            help='Benchmark running servers instead, e.g. uvicorn Billing.asgi and gunicorn '
+                                 'Billing.wsgi; repeat for each')
+        parser.add_argument('--token', help='API token sent to the servers given with --url')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.stdout.write(f"{'server':>28} {'clients':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        if options['url']:
+            if not options['token']:
+                raise CommandError('--url needs --token of a user on that server')
+            headers = {'Authorization': f"Token {options['token']}"}
+            for url in options['url']:
+                self.run(url, lambda: http_caller(url, headers))
+            return
+
+        if settings.ASYNC_READ_VIEWS:
+            raise CommandError('Unset ASYNC_READ_VIEWS so the WSGI runs use the sync views')
+        with benchmark_database(on_disk=True):
+            headers = self.seed()
+            with override_settings(ROOT_URLCONF=async_urlconf()):
+                self.run('asgi (async views)', lambda: asgi_caller(headers))
+            pools = []
+
+            def wsgi():
+                call, pool = wsgi_caller(headers, options['wsgi_threads'])
+                pools.append(pool)
+                return call
+
+            self.run(f"wsgi ({options['wsgi_threads']} threads)", wsgi)
+            for pool in pools:
+                pool.shutdown()
+
+    def seed(self):
+        owner, business, customer, items = create_store(inventory_count=200)
+        bills = Bill.objects.bulk_create([
+            Bill(customer=customer, business=business, total_amount=Decimal('30.00'), payment_mode='CASH')
+            for _ in range(self.options['bills'])
+        ])
+        BillItem.objects.bulk_create([
+            BillItem(bill=bill, inventory_item=items[(bill.id + line) % len(items)], quantity=1, price=Decimal('10.00'))
+            for bill in bills for line in range(3)
+        ])
+        return {'Authorization': f'Token {Token.objects.create(user=owner).key}'}
+
+    def run(self, label, make_caller):
+        for clients in self.options['concurrency']:
+            call = make_caller()
+            throughput, latencies, errors = asyncio.run(
+                drive(call, self.options['paths'], clients, self.options['requests'])
+            )
+            self.stdout.write(
+                f"{label:>28} {clients:>8} {throughput:>8.1f} {percentile(latencies, 0.5) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} {errors:>7}"
+            )
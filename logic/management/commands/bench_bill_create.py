@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from logic.bench import Timer, benchmark_database, create_store
+from logic.serializers import BillSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measure queries per bill and bills/sec for BillSerializer.create at several bill sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 100], help='Line items per bill')
+        parser.add_argument('--bills', type=int, default=200, help='Bills to create per size')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            _, _, customer, inventory = create_store(inventory_count=max(options['lines']))
+
+            self.stdout.write(f"{'lines':>6} {'queries/bill':>13} {'bills/sec':>10}")
+            for lines in options['lines']:
+                payload = {
+                    'customer': customer.id,
+                    'total_amount': Decimal('10.00') * lines,
+                    'payment_mode': 'CASH',
+                    'items': [
+                        {'inventory_item': item.id, 'quantity': 1, 'price': item.price}
+                        for item in inventory[:lines]
+                    ],
+                }
+
+                timer = Timer()
+                for _ in range(options['bills']):
+                    serializer = BillSerializer(data=payload)
+                    serializer.is_valid(raise_exception=True)
+                    with timer.measure():
+                        serializer.save()
+
+                self.stdout.write(
+                    f"{lines:>6} {timer.queries / options['bills']:>13.1f} "
+                    f"{options['bills'] / timer.elapsed:>10.1f}"
+                )
@@ -0,0 +1,76 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from logic.bench import benchmark_database, create_store
+from logic.models import Bill, BillItem, Inventory
+from logic.search import search_inventory
+
+WORDS = [
+    'paalak', 'paneer', 'aloo', 'pyaz', 'tamatar', 'atta', 'chawal', 'dal', 'masala', 'haldi',
+    'jeera', 'ghee', 'doodh', 'dahi', 'chai', 'chini', 'namak', 'tel', 'sabun', 'biscuit',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare the legacy icontains join with the indexed item search for the bill item_name filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bill-items', type=int, default=1000000)
+        parser.add_argument('--lines', type=int, default=5, help='Items per bill')
+        parser.add_argument('--inventory', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--query', default='paalak')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        with benchmark_database():
+            _, business, customer, _ = create_store(inventory_count=0)
+            Inventory.objects.bulk_create([
+                Inventory(name=' '.join(rng.sample(WORDS, 2)) + f' {i}', price=Decimal('10.00'), business=business)
+                for i in range(options['inventory'])
+            ], batch_size=5000)
+            inventory_ids = list(Inventory.objects.values_list('id', flat=True))
+
+            self.stdout.write(f"Seeding {options['bill_items']} bill items...")
+            remaining = options['bill_items']
+            while remaining > 0:
+                bills = Bill.objects.bulk_create([
+                    Bill(customer=customer, business=business, total_amount=Decimal('50.00'), payment_mode='CASH')
+                    for _ in range(min(2000, -(-remaining // options['lines'])))
+                ])
+                items = [
+                    BillItem(bill=bill, inventory_item_id=rng.choice(inventory_ids), quantity=1, price=Decimal('10.00'))
+                    for bill in bills for _ in range(options['lines'])
+                ][:remaining]
+                BillItem.objects.bulk_create(items, batch_size=5000)
+                remaining -= len(items)
+
+            query = options['query']
+            page = slice(0, 51)
+
+            def legacy():
+                return list(
+                    Bill.objects.filter(customer__business=business, items__inventory_item__name__icontains=query)
+                    .distinct().order_by('-created_at', '-id')[page]
+                )
+
+            def indexed():
+                inventory = search_inventory(business, query, substring=True)
+                bill_ids = BillItem.objects.filter(inventory_item_id__in=inventory).values('bill_id')
+                return list(
+                    Bill.objects.filter(business=business, id__in=bill_ids)
+                    .order_by('-created_at', '-id')[page]
+                )
+
+            self.stdout.write(f"{'path':>8} {'median ms':>10} {'max ms':>8}")
+            for name, run in [('legacy', legacy), ('indexed', indexed)]:
+                samples = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    run()
+                    samples.append((time.perf_counter() - start) * 1000)
+                samples.sort()
+                self.stdout.write(f"{name:>8} {samples[len(samples) // 2]:>10.2f} {samples[-1]:>8.2f}")
@@ -0,0 +1,71 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from logic.bench import Timer, benchmark_database, create_store
+from logic.models import Role, Staff
+from logic.permissions import compile_permissions, compiled_permissions
+from logic.tenancy import resolve_membership
+from logic.views import StaffViewSet
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request overhead of the role permission check on the staff list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checks', type=int, default=100000)
+        parser.add_argument('--permissions', type=int, default=50, help='Permission strings on the role')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            _, business, _, _ = create_store(inventory_count=0)
+            permissions = [f'resource{i}.*' for i in range(options['permissions'])] + ['staff.view']
+            role = Role.objects.create(business=business, name='Clerk', permissions=permissions)
+            clerk = User.objects.create_user(username='clerk', password='benchmark')
+            Staff.objects.create(user=clerk, business=business, role=role)
+
+            request = APIRequestFactory().get('/api/staff/')
+            request.membership = resolve_membership(clerk)
+            view = StaffViewSet.as_view({'get': 'list'})
+            # A view instance as dispatch would set it up, minus the query it then runs
+            drf_request = Request(request)
+            drf_request.user = clerk
+            instance = StaffViewSet(request=drf_request, action='list', format_kwarg=None, args=(), kwargs={})
+
+            def authenticated_only():
+                instance.permission_classes = view.cls.permission_classes[:1]
+                instance.check_permissions(instance.request)
+
+            def cached():
+                instance.permission_classes = view.cls.permission_classes
+                instance.check_permissions(instance.request)
+
+            def compiled_per_request():
+                # What every request would cost without the per-process cache
+                compile_permissions(request.membership.role_permissions)
+                cached()
+
+            self.stdout.write(f"{'check':>22} {'us/request':>11} {'queries':>8}")
+            for name, check in [('IsAuthenticated', authenticated_only), ('RolePermission', cached),
+                                ('compile every request', compiled_per_request)]:
+                compiled_permissions.clear()
+                timer = Timer()
+                with timer.measure():
+                    for _ in range(options['checks']):
+                        check()
+                self.stdout.write(
+                    f"{name:>22} {timer.elapsed / options['checks'] * 1e6:>11.2f} {timer.queries:>8}"
+                )
+
+            # End to end, the check is a small slice of serving the list
+            force_authenticate(request, clerk)
+            samples = []
+            for _ in range(200):
+                start = time.perf_counter()
+                view(request)
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            self.stdout.write(f'staff list median {samples[len(samples) // 2] * 1e6:.0f} us/request')
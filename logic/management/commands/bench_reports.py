@@ -0,0 +1,88 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from logic.bench import benchmark_database, create_store
+from logic.models import Bill, BillItem, Customer
+from logic.reports import rebuild_rollups, sales_report
+
+
+def raw_report(business, start, end, top=10):
+    """The same report aggregated straight from Bill and BillItem"""
+    bills = Bill.objects.filter(business=business, created_at__date__range=[start, end])
+    items = BillItem.objects.filter(bill__business=business, bill__created_at__date__range=[start, end])
+    line_total = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    return {
+        'totals': bills.aggregate(bill_count=Count('id'), revenue=Sum('total_amount')),
+        'by_day': list(bills.annotate(day=TruncDate('created_at')).values('day')
+                       .annotate(bill_count=Count('id'), revenue=Sum('total_amount')).order_by('day')),
+        'by_payment_mode': list(bills.values('payment_mode')
+                                .annotate(bill_count=Count('id'), revenue=Sum('total_amount')).order_by('-revenue')),
+        'top_customers': list(bills.values('customer', name=F('customer__name'))
+                              .annotate(bill_count=Count('id'), revenue=Sum('total_amount')).order_by('-revenue')[:top]),
+        'top_items': list(items.values('inventory_item', name=F('inventory_item__name'))
+                          .annotate(total_quantity=Sum('quantity'), revenue=Sum(line_total)).order_by('-revenue')[:top]),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare /api/reports/ rollup queries with aggregating raw bills over the same date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bills', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--lines', type=int, default=4, help='Items per bill')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        rng = random.Random(7)
+        with benchmark_database():
+            _, business, _, inventory = create_store(inventory_count=500)
+            Customer.objects.bulk_create([
+                Customer(name=f'Customer {i}', phone='0', business=business) for i in range(options['customers'])
+            ])
+            customer_ids = list(Customer.objects.values_list('id', flat=True))
+            modes = [mode for mode, _ in Bill.PAYMENT_MODES]
+            now = timezone.now()
+
+            self.stdout.write(f"Seeding {options['bills']} bills over {options['days']} days...")
+            remaining = options['bills']
+            while remaining > 0:
+                bills = Bill.objects.bulk_create([
+                    Bill(customer_id=rng.choice(customer_ids), business=business, total_amount=Decimal('40.00'),
+                         payment_mode=rng.choice(modes))
+                    for _ in range(min(2000, remaining))
+                ])
+                # created_at is auto_now_add, so spread the history out afterwards
+                for bill in bills:
+                    bill.created_at = now - timedelta(days=rng.randrange(options['days']), seconds=rng.randrange(86400))
+                Bill.objects.bulk_update(bills, ['created_at'])
+                BillItem.objects.bulk_create([
+                    BillItem(bill=bill, inventory_item=rng.choice(inventory), quantity=rng.randint(1, 5),
+                             price=Decimal('10.00'))
+                    for bill in bills for _ in range(options['lines'])
+                ], batch_size=5000)
+                remaining -= len(bills)
+
+            start = time.perf_counter()
+            rebuild_rollups([business.id])
+            self.stdout.write(f'Rollups rebuilt in {time.perf_counter() - start:.2f}s')
+
+            end_day = timezone.localdate(now)
+            start_day = end_day - timedelta(days=options['days'] - 1)
+            self.stdout.write(f"{'path':>8} {'median ms':>10} {'max ms':>8}")
+            for name, run in [('raw', raw_report), ('rollup', sales_report)]:
+                samples = []
+                for _ in range(options['repeat']):
+                    begin = time.perf_counter()
+                    run(business, start_day, end_day)
+                    samples.append((time.perf_counter() - begin) * 1000)
+                samples.sort()
+                self.stdout.write(f"{name:>8} {samples[len(samples) // 2]:>10.2f} {samples[-1]:>8.2f}")
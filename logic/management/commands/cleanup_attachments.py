@@ -0,0 +1,49 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from logic.attachments import THUMBNAIL_DIR, attachment_storage
+from logic.models import Transaction
+
+
+class Command(BaseCommand):
+    help = 'Delete stored attachments and thumbnails that no transaction refers to any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the orphaned files')
+        parser.add_argument('--min-age', type=float, default=24,
+                            help='Hours a file must be old before it is removed, so in-flight uploads are kept')
+
+    def handle(self, *args, **options):
+        referenced = set()
+        rows = Transaction.objects.filter(
+            Q(bill_attachment__gt='') | Q(bill_thumbnail__gt='')
+        ).values_list('bill_attachment', 'bill_thumbnail')
+        for attachment, thumbnail in rows.iterator(chunk_size=5000):
+            referenced.update(name for name in (attachment, thumbnail) if name)
+
+        upload_to = Transaction._meta.get_field('bill_attachment').upload_to.rstrip('/')
+        cutoff = time.time() - options['min_age'] * 3600
+        removed = kept = size = 0
+        for directory in [upload_to, THUMBNAIL_DIR]:
+            root = attachment_storage.path(directory)
+            for path, _, files in os.walk(root):
+                for filename in files:
+                    full_path = os.path.join(path, filename)
+                    name = os.path.relpath(full_path, attachment_storage.location).replace(os.sep, '/')
+                    if name in referenced or os.path.getmtime(full_path) > cutoff:
+                        kept += 1
+                        continue
+                    size += os.path.getsize(full_path)
+                    removed += 1
+                    if options['verbosity'] > 1 or options['dry_run']:
+                        self.stdout.write(name)
+                    if not options['dry_run']:
+                        attachment_storage.delete(name)
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {removed} orphaned files ({size / 1024 / 1024:.1f} MB), kept {kept}'
+        ))
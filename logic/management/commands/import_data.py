@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from logic.importers import IMPORT_BATCH_SIZE, IMPORTERS, detect_format, import_file, start_run
+from logic.models import Business
+
+
+class Command(BaseCommand):
+    help = 'Bulk import inventory, customers or historical bills from a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(IMPORTERS))
+        parser.add_argument('path')
+        parser.add_argument('--business', type=int, required=True, help='Business id to import into')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue the unfinished import of this file after its last committed batch')
+
+    def handle(self, *args, **options):
+        try:
+            business = Business.objects.get(id=options['business'])
+        except Business.DoesNotExist:
+            raise CommandError(f"Business {options['business']} does not exist")
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot tell the format from the file name, pass --format')
+
+        run = start_run(business, options['kind'], os.path.basename(options['path']), resume=options['resume'])
+        if run.position:
+            self.stdout.write(f'Resuming import {run.id} after record {run.position}')
+
+        def progress(run):
+            self.stdout.write(f'{run.position} records: {run.imported} imported, {run.failed} failed')
+
+        with open(options['path'], newline='', encoding='utf-8-sig') as lines:
+            import_file(run, lines, file_format, batch_size=options['batch_size'], on_batch=progress)
+
+        if options['verbosity'] > 1:
+            for error in run.errors:
+                self.stdout.write(f"Record {error['record']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f'Import {run.id} finished: {run.imported} imported, {run.failed} failed'
+        ))
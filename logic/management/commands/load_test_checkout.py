@@ -0,0 +1,108 @@
+import multiprocessing
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.test import override_settings
+from rest_framework.test import APIClient
+
+from logic.bench import benchmark_database, create_store
+
+
+def checkout_worker(start, results, owner, customer_id, item_ids, checkouts, lines, seed):
+    """One "gunicorn worker": post bills back to back and report each latency"""
+    rng = random.Random(seed)
+    client = APIClient()
+    client.force_authenticate(owner)
+    latencies, errors = [], 0
+    start.wait()
+    for _ in range(checkouts):
+        payload = {
+            'customer': customer_id, 'total_amount': '10.00', 'payment_mode': 'CASH',
+            'items': [{'inventory_item': pk, 'quantity': 1, 'price': '10.00'} for pk in rng.sample(item_ids, lines)],
+        }
+        begin = time.perf_counter()
+        try:
+            if client.post('/api/bills/', payload, format='json').status_code != 201:
+                errors += 1
+        except Exception:
+            errors += 1  # e.g. "database is locked" once busy_timeout ran out
+        # What the request_finished signal does after every real request
+        close_old_connections()
+        latencies.append(time.perf_counter() - begin)
+    connections.close_all()
+    results.put((latencies, errors))
+
+
+def percentile(values, fraction):
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Compare checkout throughput and p99 latency of the SQLite profiles with several worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--checkouts', type=int, default=100, help='Bills per worker')
+        parser.add_argument('--lines', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The SQLite profiles only apply to SQLite databases')
+        unknown = set(options['profiles']) - set(settings.SQLITE_PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profiles: {', '.join(sorted(unknown))}")
+
+        self.stdout.write(
+            f"{options['workers']} workers x {options['checkouts']} checkouts of {options['lines']} lines"
+        )
+        self.stdout.write(f"{'profile':>12} {'checkouts/s':>12} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for name in options['profiles']:
+            throughput, latencies, errors = self.run_profile(settings.SQLITE_PROFILES[name], options)
+            self.stdout.write(
+                f"{name:>12} {throughput:>12.1f} {percentile(latencies, 0.5) * 1000:>8.1f} "
+                f"{percentile(latencies, 0.99) * 1000:>8.1f} {errors:>7}"
+            )
+
+    def run_profile(self, profile, options):
+        settings_dict = connection.settings_dict
+        saved = {key: settings_dict[key] for key in ('OPTIONS', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+        settings_dict.update({
+            'OPTIONS': dict(profile.get('OPTIONS', {})),
+            'CONN_MAX_AGE': profile.get('CONN_MAX_AGE', 0),
+            'CONN_HEALTH_CHECKS': profile.get('CONN_HEALTH_CHECKS', False),
+        })
+        connection.close()
+        try:
+            with override_settings(DEBUG=False), benchmark_database(on_disk=True):
+                owner, _, customer, items = create_store(inventory_count=50)
+                item_ids = [item.id for item in items]
+                # Workers are forked and must open their own connections
+                connections.close_all()
+
+                context = multiprocessing.get_context('fork')
+                start, results = context.Event(), context.Queue()
+                workers = [
+                    context.Process(target=checkout_worker, args=(
+                        start, results, owner, customer.id, item_ids, options['checkouts'], options['lines'], seed,
+                    ))
+                    for seed in range(options['workers'])
+                ]
+                for worker in workers:
+                    worker.start()
+                begin = time.perf_counter()
+                start.set()
+                collected = [results.get() for _ in workers]
+                elapsed = time.perf_counter() - begin
+                for worker in workers:
+                    worker.join()
+        finally:
+            settings_dict.update(saved)
+            connection.close()
+
+        latencies = sorted(latency for worker_latencies, _ in collected for latency in worker_latencies)
+        errors = sum(worker_errors for _, worker_errors in collected)
+        return len(latencies) / elapsed, latencies, errors
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from logic.ledger import expected_ledgers
+from logic.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Recompute every customer balance and last_activity_at from bills and transactions, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report mismatches, do not fix them')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--business', type=int, help='Limit to one business id')
+
+    def handle(self, *args, **options):
+        customers = Customer.objects.order_by('id')
+        if options['business']:
+            customers = customers.filter(business_id=options['business'])
+
+        checked = mismatched = 0
+        last_id = 0
+        while True:
+            batch = list(customers.filter(id__gt=last_id).only('id', 'balance', 'last_activity_at')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            with transaction.atomic():
+                expected = expected_ledgers([customer.id for customer in batch])
+                stale = []
+                for customer in batch:
+                    balance, last_activity_at = expected[customer.id]
+                    if customer.balance != balance or customer.last_activity_at != last_activity_at:
+                        if options['verbosity'] > 1:
+                            self.stdout.write(
+                                f'Customer {customer.id}: balance {customer.balance} -> {balance}, '
+                                f'last activity {customer.last_activity_at} -> {last_activity_at}'
+                            )
+                        customer.balance = balance
+                        customer.last_activity_at = last_activity_at
+                        customer.updated_at = timezone.now()
+                        stale.append(customer)
+
+                if stale and not options['verify']:
+                    Customer.objects.bulk_update(stale, ['balance', 'last_activity_at', 'updated_at'])
+
+            checked += len(batch)
+            mismatched += len(stale)
+
+        if options['verify']:
+            if mismatched:
+                raise CommandError(f'{mismatched} of {checked} customer ledgers are out of date')
+            self.stdout.write(self.style.SUCCESS(f'All {checked} customer ledgers are correct'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Checked {checked} customers, fixed {mismatched}'))
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from logic.models import Inventory, StockMovement, StockReservation
+from logic.stock import release_reservations
+
+
+def _total(queryset, field):
+    rows = queryset.filter(inventory_item_id=OuterRef('id')).values('inventory_item_id')
+    return Coalesce(Subquery(rows.annotate(total=Sum(field)).values('total')[:1]), Value(0),
+                    output_field=IntegerField())
+
+
+class Command(BaseCommand):
+    help = 'Check current_stock against the stock movement ledger and reserved_stock against live reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report mismatches, do not fix them')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--business', type=int, help='Limit to one business id')
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            released = release_reservations(StockReservation.objects.filter(expires_at__lte=timezone.now()))
+            if released:
+                self.stdout.write(f'Released expired reservations on {len(released)} items')
+
+        items = Inventory.objects.order_by('id')
+        if options['business']:
+            items = items.filter(business_id=options['business'])
+        items = items.annotate(
+            ledger=_total(StockMovement.objects, 'delta'),
+            held=_total(StockReservation.objects.filter(expires_at__gt=timezone.now()), 'quantity'),
+        )
+
+        checked = mismatched = 0
+        last_id = 0
+        while True:
+            batch = list(items.filter(id__gt=last_id).only('id', 'current_stock', 'reserved_stock')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            stale = [item for item in batch if item.current_stock != item.ledger or item.reserved_stock != item.held]
+            for item in stale:
+                if options['verbosity'] > 1:
+                    self.stdout.write(
+                        f'Item {item.id}: stock {item.current_stock}, ledger {item.ledger}; '
+                        f'reserved {item.reserved_stock}, held {item.held}'
+                    )
+            if stale and not options['verify']:
+                with transaction.atomic():
+                    # The counted stock stands; the ledger records the difference as a correction
+                    StockMovement.objects.bulk_create([
+                        StockMovement(inventory_item_id=item.id, delta=item.current_stock - item.ledger,
+                                      reason='CORRECTION')
+                        for item in stale if item.current_stock != item.ledger
+                    ])
+                    # Relative, so a reservation made meanwhile is not overwritten
+                    now = timezone.now()
+                    for item in stale:
+                        item.reserved_stock = F('reserved_stock') + (item.held - item.reserved_stock)
+                        item.updated_at = now
+                    Inventory.objects.bulk_update(stale, ['reserved_stock', 'updated_at'])
+
+            checked += len(batch)
+            mismatched += len(stale)
+
+        if options['verify']:
+            if mismatched:
+                raise CommandError(f'{mismatched} of {checked} items do not match their stock ledger')
+            self.stdout.write(self.style.SUCCESS(f'All {checked} items match their stock ledger'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Checked {checked} items, fixed {mismatched}'))
@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from logic.models import Bill, Business
+from logic.receipts import OUTPUTS, write_receipt_archive
+
+
+class Command(BaseCommand):
+    help = "Render a month of a business's receipts in parallel into a zip file, or stream the zip to stdout"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--business', type=int, required=True)
+        parser.add_argument('--month', required=True, help='YYYY-MM')
+        parser.add_argument('--output', choices=list(OUTPUTS), default='pdf')
+        parser.add_argument('--out', help='Zip file to write, or - for stdout; receipts-<business>-<month>.zip '
+                                          'when left out')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        try:
+            month = datetime.strptime(options['month'], '%Y-%m')
+        except ValueError:
+            raise CommandError('--month must be YYYY-MM')
+        if not Business.objects.filter(pk=options['business']).exists():
+            raise CommandError(f"No business with id {options['business']}")
+        start = timezone.make_aware(month)
+        end = timezone.make_aware(month.replace(year=month.year + month.month // 12, month=month.month % 12 + 1))
+        bill_ids = list(Bill.objects.filter(
+            business_id=options['business'], created_at__gte=start, created_at__lt=end,
+        ).order_by('id').values_list('id', flat=True))
+
+        out = options['out'] or f"receipts-{options['business']}-{options['month']}.zip"
+        # With the zip on stdout, the report goes to stderr
+        report = self.stderr if out == '-' else self.stdout
+        started = time.perf_counter()
+        if out == '-':
+            written = write_receipt_archive(sys.stdout.buffer, options['business'], bill_ids, options['output'],
+                                            workers=options['workers'])
+            sys.stdout.buffer.flush()
+        else:
+            with open(out, 'wb') as handle:
+                written = write_receipt_archive(handle, options['business'], bill_ids, options['output'],
+                                                workers=options['workers'])
+        elapsed = time.perf_counter() - started
+        report.write(f'{written} receipts in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f}/s)'
+                     + ('' if out == '-' else f' written to {out}'))
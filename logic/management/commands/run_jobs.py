@@ -0,0 +1,58 @@
+import json
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from logic.jobs import Worker, queue_stats, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs in one or more worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=20, help='Jobs claimed per query')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--report-interval', type=float, default=30.0,
+                            help='Seconds between throughput and lag log lines')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now and exit')
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and lag as JSON and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(queue_stats()))
+            return
+        if options['once']:
+            worker = Worker(options['batch_size'])
+            count = worker.work_off()
+            stats = worker.stats()
+            self.stdout.write(self.style.SUCCESS(
+                f"Ran {count} jobs: {stats['processed']} done, {stats['retried']} to retry, {stats['dead']} dead"
+            ))
+            return
+
+        # Children must not share the parent's database connection
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        processes = [
+            context.Process(
+                target=run_worker, name=f'run_jobs-{i}',
+                args=(stop, options['batch_size'], options['poll'], options['report_interval']),
+            )
+            for i in range(options['processes'])
+        ]
+
+        def shutdown(signum, frame):
+            stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} worker processes, Ctrl+C to stop after the current jobs")
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
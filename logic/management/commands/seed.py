@@ -0,0 +1,62 @@
+import os
+import time
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from logic.seeding import seed_store
+
+
+class Command(BaseCommand):
+    help = 'Generate a large synthetic store: customers, SKUs, bills with Zipf-distributed items and transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='Seeded Store', help='Business name; its owner is <name>_owner')
+        parser.add_argument('--customers', type=int, default=100000)
+        parser.add_argument('--inventory', type=int, default=50000)
+        parser.add_argument('--bills', type=int, default=2000000)
+        parser.add_argument('--lines', type=float, default=5, help='Average items per bill')
+        parser.add_argument('--transactions', type=int, default=200000)
+        parser.add_argument('--days', type=int, default=365, help='Length of the window the bills fall in')
+        parser.add_argument('--end', help='Last day of the window, YYYY-MM-DD; today when left out')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--item-skew', type=float, default=1.1, help='Zipf exponent of item popularity')
+        parser.add_argument('--customer-skew', type=float, default=0.8, help='Zipf exponent of customer visits')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        if options['lines'] < 1 or min(options['customers'], options['inventory'], options['days']) < 1:
+            raise CommandError('Need at least one customer, item and day, and --lines of 1 or more')
+        name = options['name']
+        if User.objects.filter(username=f"{name.lower().replace(' ', '_')}_owner").exists():
+            raise CommandError(f'A store named {name} was seeded already; pick another --name')
+        try:
+            end = datetime.strptime(options['end'], '%Y-%m-%d').date() if options['end'] else timezone.localdate()
+        except ValueError:
+            raise CommandError('--end must be YYYY-MM-DD')
+        # Midnight after the last day, so the same --end always gives the same window
+        end = timezone.make_aware(datetime.combine(end, datetime.min.time()) + timedelta(days=1))
+
+        started = time.perf_counter()
+        last_report = [0.0]
+
+        def progress(done, total, rows):
+            elapsed = time.perf_counter() - started
+            if done == total or elapsed - last_report[0] >= 5:
+                last_report[0] = elapsed
+                self.stdout.write(f'{done}/{total} chunks, {rows} rows, {rows / elapsed:.0f} rows/s')
+
+        business = seed_store(
+            name, options['customers'], options['inventory'], options['bills'], options['lines'],
+            options['transactions'], options['days'], end, seed=options['seed'], item_skew=options['item_skew'],
+            customer_skew=options['customer_skew'], workers=options['workers'], progress=progress,
+        )
+        self.stdout.write('Rebuilding customer ledgers...')
+        call_command('rebuild_ledger', business=business.id, stdout=StringIO())
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded business {business.id} ({name}) in {time.perf_counter() - started:.0f}s'
+        ))
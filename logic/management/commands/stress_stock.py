@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from logic.bench import benchmark_database, create_store, stock_stress
+from logic.models import Inventory, StockMovement
+
+
+class Command(BaseCommand):
+    help = ('Sell from many threads at once, half through reservations, and check that no stock update '
+            'was lost. Runs against a throwaway copy of whichever database DATABASES configures.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--sales', type=int, default=100, help='Sales per thread')
+        parser.add_argument('--items', type=int, default=5, help='Fewer items means more contention')
+        parser.add_argument('--stock', type=int, default=100000)
+        parser.add_argument('--reserve-every', type=int, default=2, help='0 sells without reservations')
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True):
+            _, business, _, items = create_store(inventory_count=options['items'], stock=options['stock'])
+            StockMovement.objects.bulk_create([
+                StockMovement(inventory_item=item, delta=item.current_stock, reason='OPENING') for item in items
+            ])
+            item_ids = [item.id for item in items]
+
+            self.stdout.write(
+                f"{options['threads']} threads x {options['sales']} sales on {len(item_ids)} items ({connection.vendor})"
+            )
+            sold, retries, seconds = stock_stress(
+                business, item_ids, threads=options['threads'], sales=options['sales'],
+                reserve_every=options['reserve_every'],
+            )
+
+            ledger = dict(StockMovement.objects.filter(inventory_item_id__in=item_ids).values('inventory_item_id')
+                          .annotate(total=Sum('delta')).values_list('inventory_item_id', 'total'))
+            problems = []
+            for pk, stock, reserved in Inventory.objects.filter(id__in=item_ids).values_list(
+                    'id', 'current_stock', 'reserved_stock'):
+                expected = options['stock'] - sold.get(pk, 0)
+                if stock != expected:
+                    problems.append(f'item {pk}: stock {stock}, expected {expected} ({expected - stock} lost)')
+                if ledger[pk] != stock:
+                    problems.append(f'item {pk}: ledger {ledger[pk]} != stock {stock}')
+                if reserved:
+                    problems.append(f'item {pk}: {reserved} units still reserved')
+
+            total = sum(sold.values())
+            self.stdout.write(f'{total} sales in {seconds:.2f}s ({total / seconds:.0f}/s), {retries} busy retries')
+            if problems:
+                raise CommandError('Lost updates:\n' + '\n'.join(problems))
+            self.stdout.write(self.style.SUCCESS('No lost updates: stock, ledger and reservations all agree'))
@@ -0,0 +1,49 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database into its replica files with the online backup API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help='Replica aliases, all of DATABASE_REPLICAS by default')
+        parser.add_argument('--file', action='append', default=[], help='Copy into this file instead of an alias')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep syncing every this many seconds instead of once')
+        parser.add_argument('--pages', type=int, default=1024,
+                            help='Pages copied per step; writers on the primary are only blocked during a step')
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('sync_replica only copies SQLite databases; use the server\'s replication otherwise')
+        unknown = set(options['aliases']) - set(settings.DATABASE_REPLICAS)
+        if unknown:
+            raise CommandError(f"Not in DATABASE_REPLICAS: {', '.join(sorted(unknown))}")
+
+        aliases = options['aliases'] or ([] if options['file'] else settings.DATABASE_REPLICAS)
+        targets = [connections[alias].settings_dict['NAME'] for alias in aliases] + options['file']
+        if not targets:
+            raise CommandError('No replicas configured; set SQLITE_REPLICAS or pass --file')
+
+        while True:
+            started = time.monotonic()
+            for target in targets:
+                self.copy(primary, str(target), options['pages'])
+            self.stdout.write(f"Synced {len(targets)} replicas in {time.monotonic() - started:.2f}s")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, primary, path, pages):
+        primary.ensure_connection()
+        target = sqlite3.connect(path)
+        try:
+            # A consistent snapshot; the copy restarts if another connection writes mid-way
+            primary.connection.backup(target, pages=pages)
+        finally:
+            target.close()
@@ -0,0 +1,372 @@
+"""
+Per-endpoint request metrics.
+
+MetricsMiddleware records, for every route and method, the request count,
+a latency histogram, the database queries run and their time, the time
+spent building serializer data, the time the response's renderer took and
+the bytes sent. Serializer time is that of the .data of serializers made
+through the views' get_serializer (see timed()), including any queries it
+runs; renderer time is the encoding of DRF responses (JSON, the browsable
+API). Each thread records into
+its own table, so the request path takes no locks. Every FLUSH_INTERVAL
+seconds a worker writes its totals to its own file in DIR, and
+collect_metrics() adds up the files of every worker for /api/_metrics/.
+Deleting DIR resets the totals.
+
+With PROFILE_SAMPLE_RATE above zero, that fraction of sync requests runs
+under cProfile, and those slower than PROFILE_THRESHOLD_MS leave a .prof
+dump (for pstats, snakeviz or flameprof) and a text summary in
+DIR/profiles.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# Upper bounds of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def metrics_settings():
+    options = {
+        'ENABLED': True,
+        'DIR': None,
+        'FLUSH_INTERVAL': 10,
+        'PROFILE_SAMPLE_RATE': 0.0,
+        'PROFILE_THRESHOLD_MS': 500,
+    }
+    options.update(getattr(settings, 'METRICS', {}))
+    return options
+
+
+class EndpointStats:
+    """Totals for one route and method; adds up across threads and workers"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.queries = 0
+        self.query_ms = 0.0
+        self.serializer_ms = 0.0
+        self.renderer_ms = 0.0
+        self.response_bytes = 0
+
+    def add(self, latency_ms, sample, error, response_bytes):
+        self.count += 1
+        self.errors += error
+        self.latency_ms += latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self.histogram[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.queries += sample.queries
+        self.query_ms += sample.query_ms
+        self.serializer_ms += sample.serializer_ms
+        self.renderer_ms += sample.renderer_ms
+        self.response_bytes += response_bytes
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.latency_ms += other.latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, other.max_latency_ms)
+        self.histogram = [mine + theirs for mine, theirs in zip(self.histogram, other.histogram)]
+        self.queries += other.queries
+        self.query_ms += other.query_ms
+        self.serializer_ms += other.serializer_ms
+        self.renderer_ms += other.renderer_ms
+        self.response_bytes += other.response_bytes
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        for field in vars(stats):
+            if field in data:  # Files written before a field was added lack it
+                setattr(stats, field, data[field])
+        return stats
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of requests, capped at the slowest seen"""
+        rank, seen = fraction * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max_latency_ms)
+        return self.max_latency_ms
+
+    def summary(self):
+        count = self.count or 1
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'latency_ms': {
+                'mean': round(self.latency_ms / count, 2),
+                'p50': round(self.percentile(0.5), 2),
+                'p95': round(self.percentile(0.95), 2),
+                'p99': round(self.percentile(0.99), 2),
+                'max': round(self.max_latency_ms, 2),
+                'total': round(self.latency_ms, 2),
+            },
+            'queries': {
+                'per_request': round(self.queries / count, 2),
+                'time_ms_per_request': round(self.query_ms / count, 2),
+                'total': self.queries,
+            },
+            'serializer_ms_per_request': round(self.serializer_ms / count, 2),
+            'renderer_ms_per_request': round(self.renderer_ms / count, 2),
+            'response_bytes': {'per_request': self.response_bytes // count, 'total': self.response_bytes},
+        }
+
+
+class RequestSample:
+    """What one request spent on the database, in serializers and in its renderer, filled in as it runs"""
+    __slots__ = ('queries', 'query_ms', 'serializer_ms', 'renderer_ms', 'renderer_start')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_ms = 0.0
+        self.serializer_ms = 0.0
+        self.renderer_ms = 0.0
+        self.renderer_start = None
+
+
+# Follows the request into sync_to_async threads, so async views are counted too
+_sample = ContextVar('metrics_sample', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    sample = _sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.queries += 1
+        sample.query_ms += (time.perf_counter() - start) * 1000
+
+
+class TimedData:
+    """Serializer mixin adding the time spent building .data to the request's sample"""
+
+    @property
+    def data(self):
+        sample = _sample.get()
+        if sample is None:
+            return super().data
+        start = time.perf_counter()
+        try:
+            return super().data
+        finally:
+            sample.serializer_ms += (time.perf_counter() - start) * 1000
+
+
+@lru_cache(maxsize=None)
+def _timed_class(cls):
+    return type(cls.__name__, (TimedData, cls), {'__module__': cls.__module__})
+
+
+def timed(serializer):
+    """The serializer, with its .data timed into serializer_ms"""
+    if not isinstance(serializer, TimedData):
+        serializer.__class__ = _timed_class(type(serializer))
+    return serializer
+
+
+def install_query_recorder(connection):
+    # First in line, so connection.execute_wrapper() blocks still pop their own wrapper
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class MetricsRegistry:
+    """This worker's EndpointStats, one table per thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._tables = []
+        self._last_flush = time.monotonic()
+        self.started = int(time.time())
+
+    def table(self):
+        try:
+            return self._local.table
+        except AttributeError:
+            table = self._local.table = {}
+            self._tables.append(table)
+            return table
+
+    def snapshot(self):
+        totals = {}
+        for table in list(self._tables):
+            for key, stats in list(table.items()):
+                totals.setdefault(key, EndpointStats()).merge(stats)
+        return totals
+
+    def maybe_flush(self, directory, interval):
+        now = time.monotonic()
+        if now - self._last_flush >= interval:
+            self._last_flush = now
+            self.flush(directory)
+
+    def flush(self, directory):
+        """Replace this worker's file in directory with its current totals"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{socket.gethostname()}-{os.getpid()}-{self.started}.json')
+        temporary = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({
+                'pid': os.getpid(),
+                'flushed_at': time.time(),
+                'endpoints': [
+                    {'route': route, 'method': method, **stats.as_dict()}
+                    for (route, method), stats in self.snapshot().items()
+                ],
+            }, handle)
+        os.replace(temporary, path)
+
+    def clear(self):
+        for table in list(self._tables):
+            table.clear()
+
+
+registry = MetricsRegistry()
+
+
+def metrics_dir(options=None):
+    directory = (options or metrics_settings())['DIR']
+    return str(directory) if directory else os.path.join(tempfile.gettempdir(), 'billyatra-metrics')
+
+
+def collect_metrics(directory):
+    """(worker files read, {(route, method): EndpointStats}) summed over every worker's file"""
+    workers, totals = 0, {}
+    names = os.listdir(directory) if os.path.isdir(directory) else []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as handle:
+                data = json.load(handle)
+        except (OSError, ValueError):
+            continue  # Removed or half-written by its worker
+        workers += 1
+        for row in data['endpoints']:
+            key = (row.pop('route'), row.pop('method'))
+            totals.setdefault(key, EndpointStats()).merge(EndpointStats.from_dict(row))
+    return workers, totals
+
+
+def route_name(request):
+    match = request.resolver_match
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match.route
+
+
+def dump_profile(profiler, directory, route, method, latency_ms):
+    directory = os.path.join(directory, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^\w.-]+', '_', f'{method}-{route}')
+    path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{slug}-{int(latency_ms)}ms')
+    profiler.dump_stats(f'{path}.prof')
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+    with open(f'{path}.txt', 'w') as handle:
+        handle.write(f'{method} {route} {latency_ms:.1f}ms\n')
+        handle.write(summary.getvalue())
+    return path
+
+
+class MetricsMiddleware:
+    """Record per-endpoint metrics; goes first in MIDDLEWARE so latency covers the whole stack"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = metrics_settings()
+        if not self.options['ENABLED']:
+            raise MiddlewareNotUsed
+        self.directory = metrics_dir(self.options)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample, start = RequestSample(), time.perf_counter()
+        token = _sample.set(sample)
+        profiler = None
+        rate = self.options['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _sample.reset(token)
+        latency_ms = self.record(request, response, sample, start)
+        if profiler is not None and latency_ms >= self.options['PROFILE_THRESHOLD_MS']:
+            dump_profile(profiler, self.directory, route_name(request), request.method, latency_ms)
+        return response
+
+    async def __acall__(self, request):
+        # cProfile only sees the event loop thread, so async requests are not profiled
+        sample, start = RequestSample(), time.perf_counter()
+        token = _sample.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _sample.reset(token)
+        self.record(request, response, sample, start)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns; time the renderer, which
+        # encodes the serializer data the view already built
+        sample = _sample.get()
+        if sample is not None:
+            sample.renderer_start = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.rendered(sample))
+        return response
+
+    @staticmethod
+    def rendered(sample):
+        sample.renderer_ms += (time.perf_counter() - sample.renderer_start) * 1000
+
+    def record(self, request, response, sample, start):
+        latency_ms = (time.perf_counter() - start) * 1000
+        if response.has_header('Content-Length'):
+            response_bytes = int(response['Content-Length'])
+        else:
+            response_bytes = 0 if response.streaming else len(response.content)
+        table = registry.table()
+        key = (route_name(request), request.method)
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = EndpointStats()
+        stats.add(latency_ms, sample, response.status_code >= 500, response_bytes)
+        registry.maybe_flush(self.directory, self.options['FLUSH_INTERVAL'])
+        return latency_ms
@@ -0,0 +1,56 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.utils.functional import SimpleLazyObject
+
+from .routers import replica_reads
+from .tenancy import resolve_membership
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class MembershipMiddleware:
+    """
+    Attach request.membership, the user's business and role.
+
+    Resolution is lazy so it sees the user set by DRF token authentication, and
+    happens at most once per request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # Async views replace this with the result of aresolve_membership
+        request.membership = SimpleLazyObject(lambda: resolve_membership(request.user))
+        return self.get_response(request)
+
+
+class ReplicaMiddleware:
+    """Serve reads of safe requests from a replica until the request writes something"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.method not in SAFE_METHODS:
+            return self.get_response(request)
+        with replica_reads():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if request.method not in SAFE_METHODS:
+            return await self.get_response(request)
+        # The context variable follows the request into sync_to_async threads
+        with replica_reads():
+            return await self.get_response(request)
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from logic.search import install_search_index, uninstall_search_index
+
+
+def create_search_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('logic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='business',
+            name='owner',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='owned_business', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='billitem',
+            index=models.Index(fields=['inventory_item', 'bill'], name='billitem_item_bill_idx'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
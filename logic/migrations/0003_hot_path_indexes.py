@@ -0,0 +1,67 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_business(apps, schema_editor):
+    Customer = apps.get_model('logic', 'Customer')
+    customer_business = Subquery(Customer.objects.filter(id=OuterRef('customer_id')).values('business_id')[:1])
+    for model_name in ['Bill', 'Transaction']:
+        apps.get_model('logic', model_name).objects.update(business_id=customer_business)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0002_inventory_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='business',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bills', to='logic.business'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='business',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='logic.business'),
+        ),
+        migrations.RunPython(backfill_business, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='bill',
+            name='business',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='bills', to='logic.business'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='business',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='logic.business'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['business', 'created_at'], name='bill_business_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bill',
+            index=models.Index(fields=['customer', 'created_at'], name='bill_customer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', 'created_at'], name='customer_business_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['business', 'created_at'], name='inv_business_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['business', 'created_at'], name='txn_business_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['customer', 'created_at'], name='txn_customer_created_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:05
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import DateTimeField, DecimalField, F, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+import django.utils.timezone
+
+
+def backfill_ledger(apps, schema_editor):
+    Customer = apps.get_model('logic', 'Customer')
+    Bill = apps.get_model('logic', 'Bill')
+    Transaction = apps.get_model('logic', 'Transaction')
+
+    def total(queryset, field, **filters):
+        rows = queryset.filter(customer_id=OuterRef('id'), **filters).values('customer_id')
+        return Coalesce(
+            Subquery(rows.annotate(total=Sum(field)).values('total')[:1]), Decimal('0.00'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+
+    def latest(queryset):
+        rows = queryset.filter(customer_id=OuterRef('id')).values('customer_id')
+        return Coalesce(
+            Subquery(rows.annotate(last=Max('created_at')).values('last')[:1]), F('created_at'),
+            output_field=DateTimeField(),
+        )
+
+    Customer.objects.update(
+        balance=(
+            total(Bill.objects, 'total_amount')
+            + total(Transaction.objects, 'amount', transaction_type='CREDIT')
+            - total(Transaction.objects, 'amount', transaction_type='DEBIT')
+        ),
+        last_activity_at=Greatest(F('created_at'), latest(Bill.objects), latest(Transaction.objects)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', 'balance'], name='customer_business_balance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['business', 'last_activity_at'], name='customer_business_active_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:17
+
+from django.db import migrations, models
+import logic.attachments
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0006_import_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='bill_thumbnail',
+            field=models.FileField(blank=True, editable=False, null=True, storage=logic.attachments.get_attachment_storage, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='bill_attachment',
+            field=models.FileField(blank=True, null=True, storage=logic.attachments.get_attachment_storage, upload_to='bills/'),
+        ),
+    ]
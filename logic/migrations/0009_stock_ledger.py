@@ -0,0 +1,59 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_opening_stock(apps, schema_editor):
+    # The ledger starts from the stock every item has today
+    Inventory = apps.get_model('logic', 'Inventory')
+    StockMovement = apps.get_model('logic', 'StockMovement')
+    StockMovement.objects.bulk_create([
+        StockMovement(inventory_item_id=pk, delta=stock, reason='OPENING')
+        for pk, stock in Inventory.objects.filter(current_stock__gt=0).values_list('id', 'current_stock').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0008_job_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='reserved_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('business', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='logic.business')),
+                ('inventory_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='logic.inventory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['business', 'token'], name='reservation_token_idx'), models.Index(fields=['expires_at'], name='reservation_expires_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('OPENING', 'Opening stock'), ('SALE', 'Sale'), ('BILL_EDIT', 'Bill edit'), ('ADJUSTMENT', 'Adjustment'), ('CORRECTION', 'Reconciliation')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('bill', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='logic.bill')),
+                ('inventory_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='logic.inventory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['inventory_item', 'created_at'], name='stockmove_item_created_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.16 on 2026-10-17 23:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_business(apps, schema_editor):
+    # Roles were shared across businesses; each business using one gets its own copy
+    Role = apps.get_model('logic', 'Role')
+    Staff = apps.get_model('logic', 'Staff')
+    for role in Role.objects.filter(business__isnull=True):
+        business_ids = sorted(set(Staff.objects.filter(role=role).values_list('business_id', flat=True)))
+        if not business_ids:
+            continue  # Unused; stays out of every business's role list
+        role.business_id = business_ids[0]
+        role.save(update_fields=['business'])
+        for business_id in business_ids[1:]:
+            copy = Role.objects.create(business_id=business_id, name=role.name, permissions=role.permissions)
+            Staff.objects.filter(role=role, business_id=business_id).update(role=copy)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logic', '0011_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='role',
+            name='business',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='roles', to='logic.business'),
+        ),
+        migrations.AddField(
+            model_name='role',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(backfill_business, migrations.RunPython.noop),
+    ]
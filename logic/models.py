@@ -1,7 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
+from .attachments import get_attachment_storage
+
 
 class Business(models.Model):
     name = models.CharField(max_length=255)
@@ -23,6 +26,19 @@ class Customer(models.Model):
     email = models.EmailField(blank=True, null=True)
     business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='customers')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Materialised ledger, maintained by logic.ledger: what the customer owes the store
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    last_activity_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Set by every write, including the bulk UPDATEs of logic.ledger; drives ETags and ?since= syncs
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'created_at'], name='customer_business_created_idx'),
+            models.Index(fields=['business', 'updated_at'], name='customer_business_updated_idx'),
+            models.Index(fields=['business', 'balance'], name='customer_business_balance_idx'),
+            models.Index(fields=['business', 'last_activity_at'], name='customer_business_active_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -34,12 +50,26 @@ class Transaction(models.Model):
     ]
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='transactions')
+    # Denormalised from customer.business so tenant filters need no join
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='transactions', editable=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
     description = models.TextField(blank=True, null=True)
-    bill_attachment = models.FileField(upload_to='bills/', blank=True, null=True)
+    # Stored by content hash, so the same receipt uploaded twice is one file
+    bill_attachment = models.FileField(upload_to='bills/', storage=get_attachment_storage, blank=True, null=True)
+    bill_thumbnail = models.FileField(storage=get_attachment_storage, blank=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'created_at'], name='txn_business_created_idx'),
+            models.Index(fields=['customer', 'created_at'], name='txn_customer_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.business_id = self.customer.business_id
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.customer.name} - {self.transaction_type} - {self.amount}"
 
@@ -48,9 +78,19 @@ class Inventory(models.Model):
     description = models.TextField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     current_stock = models.PositiveIntegerField(default=0)
+    # Held by StockReservations for carts not billed yet, maintained by logic.stock
+    reserved_stock = models.PositiveIntegerField(default=0, editable=False)
     image_url = models.URLField(blank=True, null=True)
     business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='inventory_items')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set by every write, including the stock UPDATEs of logic.stock; drives ETags and ?since= syncs
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'created_at'], name='inv_business_created_idx'),
+            models.Index(fields=['business', 'updated_at'], name='inv_business_updated_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -64,10 +104,22 @@ class Bill(models.Model):
     ]
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='bills')
+    # Denormalised from customer.business so tenant filters need no join
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='bills', editable=False)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_mode = models.CharField(max_length=10, choices=PAYMENT_MODES)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'created_at'], name='bill_business_created_idx'),
+            models.Index(fields=['customer', 'created_at'], name='bill_customer_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.business_id = self.customer.business_id
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Bill {self.id} - {self.customer.name}"
 
@@ -78,12 +130,150 @@ class BillItem(models.Model):
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Resolves "bills containing these items" from the index alone
+            models.Index(fields=['inventory_item', 'bill'], name='billitem_item_bill_idx'),
+        ]
+
     def __str__(self):
         return f"{self.inventory_item.name} - {self.quantity} x {self.price}"
 
+class StockMovement(models.Model):
+    """Append-only record of every change to Inventory.current_stock"""
+    REASONS = [
+        ('OPENING', 'Opening stock'),
+        ('SALE', 'Sale'),
+        ('BILL_EDIT', 'Bill edit'),
+        ('ADJUSTMENT', 'Adjustment'),
+        ('CORRECTION', 'Reconciliation'),
+    ]
+
+    inventory_item = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='stock_movements')
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASONS)
+    bill = models.ForeignKey(Bill, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['inventory_item', 'created_at'], name='stockmove_item_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValidationError("Stock movements cannot be changed, record a correction instead.")
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.inventory_item_id} {self.delta:+d} ({self.reason})"
+
+class StockReservation(models.Model):
+    """Stock held for a cart until it is billed, released or expires_at passes"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='+')
+    token = models.CharField(max_length=64)
+    inventory_item = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'token'], name='reservation_token_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token}: {self.quantity} x {self.inventory_item_id}"
+
+class Tombstone(models.Model):
+    """A deleted customer or inventory item, so ?since= syncs can tell clients to drop it"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='+')
+    model = models.CharField(max_length=50)  # Model name of the deleted row, e.g. 'inventory'
+    object_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['business', 'model', 'deleted_at'], name='tombstone_business_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model} #{self.object_id}"
+
+class IdempotencyKey(models.Model):
+    """Client-generated key of a synced bill or transaction, so a replayed batch is not applied twice"""
+    KINDS = [
+        ('bill', 'Bill'),
+        ('transaction', 'Transaction'),
+    ]
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=64)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['business', 'key'], name='idempotency_key_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} -> {self.kind} #{self.object_id}"
+
+class DailySales(models.Model):
+    """Bills per business, day, customer and payment mode, maintained by logic.reports"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='+')
+    payment_mode = models.CharField(max_length=10, choices=Bill.PAYMENT_MODES)
+    bill_count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['business', 'day', 'customer', 'payment_mode'], name='daily_sales_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.customer_id} - {self.payment_mode} - {self.revenue}"
+
+
+class DailyItemSales(models.Model):
+    """Quantity and revenue per business, day and inventory item, maintained by logic.reports"""
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    inventory_item = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='+')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['business', 'day', 'inventory_item'], name='daily_item_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.inventory_item_id} - {self.quantity}"
+
 class Role(models.Model):
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='roles', null=True)
     name = models.CharField(max_length=50)
-    permissions = models.JSONField(default=list)  # Store permissions as a list of strings
+    permissions = models.JSONField(default=list)  # 'bill.view', 'inventory.*' or '*', see logic.permissions
+    version = models.PositiveIntegerField(default=1)  # Bumped on every save to retire compiled permission sets
+
+    def save(self, *args, **kwargs):
+        bump = not self._state.adding
+        if bump:
+            # Bumped by the UPDATE itself, so concurrent edits never share a version
+            self.version = models.F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
 
     def __str__(self):
         return self.name
@@ -94,4 +284,58 @@ class Staff(models.Model):
     role = models.ForeignKey(Role, on_delete=models.SET_NULL, null=True, blank=True)
 
     def __str__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+
+
+class ImportRun(models.Model):
+    """Progress of a bulk import, saved with every committed batch so it can resume after a crash"""
+    KINDS = [
+        ('inventory', 'Inventory'),
+        ('customers', 'Customers'),
+        ('bills', 'Bills'),
+    ]
+
+    business = models.ForeignKey(Business, on_delete=models.CASCADE, related_name='imports')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    source = models.CharField(max_length=255)  # File name the run is resumed by
+    position = models.PositiveIntegerField(default=0)  # Records processed, imported or rejected
+    imported = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} from {self.source} - {self.position} records"
+
+class Job(models.Model):
+    """Background work queued by logic.jobs and run by manage.py run_jobs"""
+    name = models.CharField(max_length=255)  # Dotted path of the @job function
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run_at', 'id'], name='job_run_at_idx'),
+            models.Index(fields=['locked_by'], name='job_locked_by_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id}"
+
+class DeadJob(models.Model):
+    """A job that used up its retries, kept with its last error for inspection or requeueing"""
+    name = models.CharField(max_length=255)
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField()
+    error = models.TextField()
+    created_at = models.DateTimeField()
+    failed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.id}"
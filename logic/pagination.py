@@ -0,0 +1,24 @@
+from asgiref.sync import sync_to_async
+from rest_framework.pagination import CursorPagination
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    Each page is a range scan from the cursor position, so deep pages cost the
+    same as the first one and no COUNT(*) is ever run.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # The page is a single query; like every Django 4.2 async ORM call it runs in the request's sync thread
+        return await sync_to_async(self.paginate_queryset)(queryset, request, view)
+
+
+class IdCursorPagination(CreatedAtCursorPagination):
+    """Keyset pagination for models without a created_at column"""
+    ordering = '-id'
@@ -0,0 +1,111 @@
+"""
+Per-action role permissions for staff.
+
+A Role's permissions are strings of the form '<resource>.<verb>', where the
+resource is the view's model name ('bill', 'inventory', 'staff', ...) or
+the permission_resource of an APIView ('report', 'import', 'reservation',
+'sync'), and the verb is view, add, change or delete. '<resource>.*'
+grants every verb on a resource and '*' grants everything. Owners hold
+every permission.
+
+The role's id, version and permission list travel in the cached
+Membership, so checking a request costs no queries. Each role is compiled
+once per process into a frozenset of granted strings and reused until a
+save bumps Role.version, which also drops the memberships that carry it.
+"""
+from rest_framework.permissions import BasePermission
+
+VERBS = ('view', 'add', 'change', 'delete')
+
+ACTION_VERBS = {
+    'list': 'view',
+    'retrieve': 'view',
+    'create': 'add',
+    'update': 'change',
+    'partial_update': 'change',
+    'destroy': 'delete',
+}
+
+METHOD_VERBS = {
+    'GET': 'view',
+    'HEAD': 'view',
+    'OPTIONS': 'view',
+    'POST': 'add',
+    'PUT': 'change',
+    'PATCH': 'change',
+    'DELETE': 'delete',
+}
+
+ALL = '*'
+
+
+def compile_permissions(permissions):
+    """The frozenset of permission strings a role's permission list grants, wildcards expanded"""
+    granted = set()
+    for permission in permissions or ():
+        if not isinstance(permission, str):
+            continue
+        if permission == ALL:
+            granted.add(ALL)
+            continue
+        resource, _, verb = permission.partition('.')
+        if verb == '*':
+            granted.update(f'{resource}.{name}' for name in VERBS)
+        else:
+            granted.add(permission)
+    return frozenset(granted)
+
+
+class CompiledPermissions:
+    """Process-wide role id -> (version, frozenset), recompiled when a role's version moves on"""
+
+    def __init__(self):
+        self._entries = {}
+        self.hits = 0
+        self.compiles = 0
+
+    def get(self, role_id, version, permissions):
+        entry = self._entries.get(role_id)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+        granted = compile_permissions(permissions)
+        # Plain dict assignment is atomic; two threads racing here compile the same set
+        self._entries[role_id] = (version, granted)
+        self.compiles += 1
+        return granted
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.compiles = 0
+
+
+compiled_permissions = CompiledPermissions()
+
+
+def granted_permissions(membership):
+    """The compiled permission set of a staff Membership"""
+    if membership.staff_role_id is None:
+        return frozenset()
+    return compiled_permissions.get(membership.staff_role_id, membership.role_version, membership.role_permissions)
+
+
+def required_permission(request, view):
+    """The '<resource>.<verb>' string the request needs, from the view's model and action"""
+    resource = getattr(view, 'permission_resource', None) or view.queryset.model._meta.model_name
+    verb = ACTION_VERBS.get(getattr(view, 'action', None)) or METHOD_VERBS.get(request.method, 'change')
+    return f'{resource}.{verb}'
+
+
+class RolePermission(BasePermission):
+    """Owners may do anything in their business; staff need the action's permission on their role"""
+    message = 'Your role does not allow this action.'
+
+    def has_permission(self, request, view):
+        membership = request.membership
+        if membership.business is None:
+            return False
+        if membership.role == 'owner':
+            return True
+        granted = granted_permissions(membership)
+        return ALL in granted or required_permission(request, view) in granted
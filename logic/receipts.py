@@ -0,0 +1,289 @@
+"""
+Server-side receipts for bills, as HTML, plain text for thermal printers
+or PDF.
+
+A receipt is built from two queries: the bill with its customer, and its
+lines with their item names. The business header comes from the cache and
+is dropped whenever the business is saved. Rendered output is cached under
+a digest of everything that goes into it, so an edit to the bill, or a
+renamed customer, item or business, gets a fresh render while reprints of
+an unchanged bill are served from the cache. The digest is also the
+receipt's ETag.
+
+PDFs are written directly with the standard Courier font, so nothing is
+embedded and only Latin text prints as is.
+
+write_receipt_archive() renders many bills in worker processes into a zip
+file, for the monthly batch run by `manage.py render_receipts`.
+"""
+import hashlib
+import json
+import multiprocessing
+import textwrap
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import Bill, BillItem, Business
+
+# Bump when a layout changes, so receipts cached with the old one are not served
+RENDER_VERSION = 1
+RENDER_CHUNK_SIZE = 200
+
+# Content type and file extension of each output
+OUTPUTS = {
+    'html': ('text/html; charset=utf-8', 'html'),
+    'text': ('text/plain; charset=utf-8', 'txt'),
+    'pdf': ('application/pdf', 'pdf'),
+}
+
+PAYMENT_MODES = dict(Bill.PAYMENT_MODES)
+
+
+def receipt_settings():
+    options = {
+        'CACHE': 'default',
+        'TIMEOUT': 7 * 24 * 3600,
+        'THERMAL_WIDTH': 42,
+        'PDF_WIDTH': 80,
+    }
+    options.update(getattr(settings, 'RECEIPTS', {}))
+    return options
+
+
+def _cache():
+    return caches[receipt_settings()['CACHE']]
+
+
+def _header_key(business_id):
+    return f'receipt-header:{business_id}'
+
+
+def business_header(business_id):
+    """Name and address printed at the top of a business's receipts, cached"""
+    key = _header_key(business_id)
+    header = _cache().get(key)
+    if header is None:
+        name, address = Business.objects.filter(pk=business_id).values_list('name', 'address').get()
+        header = {'name': name, 'address': address}
+        _cache().set(key, header, receipt_settings()['TIMEOUT'])
+    return header
+
+
+def forget_business_header(business_id):
+    _cache().delete(_header_key(business_id))
+
+
+def load_receipts(business_id, bill_ids):
+    """The business's bills among bill_ids as plain receipt data, in id order"""
+    bills = Bill.objects.filter(business_id=business_id, id__in=bill_ids).order_by('id').values_list(
+        'id', 'created_at', 'payment_mode', 'total_amount', 'customer__name', 'customer__phone',
+    )
+    receipts = {
+        pk: {
+            'id': pk,
+            'created_at': timezone.localtime(created_at).strftime('%Y-%m-%d %H:%M'),
+            'payment_mode': PAYMENT_MODES.get(mode, mode),
+            'total': f'{total:.2f}',
+            'customer': name,
+            'phone': phone,
+            'item_count': 0,
+            'lines': [],
+        }
+        for pk, created_at, mode, total, name, phone in bills
+    }
+    if not receipts:
+        return []
+    lines = BillItem.objects.filter(bill_id__in=list(receipts)).order_by('bill_id', 'id').values_list(
+        'bill_id', 'inventory_item__name', 'quantity', 'price',
+    )
+    for bill_id, name, quantity, price in lines:
+        receipt = receipts[bill_id]
+        receipt['item_count'] += quantity
+        receipt['lines'].append({
+            'name': name, 'quantity': quantity, 'price': f'{price:.2f}', 'amount': f'{quantity * price:.2f}',
+        })
+    return list(receipts.values())
+
+
+def receipt_for(business_id, bill_id):
+    """(header, receipt) of one bill, or None if the business has no such bill"""
+    receipts = load_receipts(business_id, [bill_id])
+    if not receipts:
+        return None
+    return business_header(business_id), receipts[0]
+
+
+def receipt_etag(header, receipt, output):
+    """Strong ETag of a receipt; changes with anything it prints"""
+    content = json.dumps([RENDER_VERSION, output, header, receipt], sort_keys=True)
+    return '"%s"' % hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def render_cached(header, receipt, output, etag):
+    """The rendered receipt, from the cache when this version was rendered before"""
+    cache = _cache()
+    digest = etag.strip('"')
+    key = f"receipt:{receipt['id']}:{output}:{digest}"
+    content = cache.get(key)
+    if content is None:
+        content = RENDERERS[output](header, receipt)
+        cache.set(key, content, receipt_settings()['TIMEOUT'])
+    return content
+
+
+@lru_cache(maxsize=None)
+def compiled_template(name):
+    # Parsed once per process; Django's cached template loader is off while DEBUG is on
+    return get_template(name)
+
+
+def render_html(header, receipt):
+    return compiled_template('logic/receipt.html').render({'header': header, 'receipt': receipt}).encode()
+
+
+def _spread(left, right, width):
+    # left and right on one line, right-aligned to width
+    return f'{left} {right}' if len(left) + len(right) >= width else f'{left}{right:>{width - len(left)}}'
+
+
+def receipt_lines(header, receipt, width):
+    """The receipt laid out in lines of at most width characters, for monospaced printing"""
+    rule = '-' * width
+    lines = [line.center(width).rstrip() for line in textwrap.wrap(header['name'].upper(), width)]
+    for part in header['address'].splitlines():
+        lines += [line.center(width).rstrip() for line in textwrap.wrap(part, width)]
+    lines += [rule, _spread(f"Bill #{receipt['id']}", receipt['created_at'], width)]
+    customer = f"{receipt['customer']} ({receipt['phone']})" if receipt['phone'] else receipt['customer']
+    lines += textwrap.wrap(f'Customer: {customer}', width)
+    lines.append(rule)
+
+    # Quantity, price and amount take 23 columns; names wrap in the rest
+    name_width = max(width - 23, 8)
+    lines.append(f"{'Item':<{name_width}}{'Qty':>4}{'Price':>9}{'Amount':>10}")
+    for line in receipt['lines']:
+        names = textwrap.wrap(line['name'], name_width) or ['']
+        lines.append(f"{names[0]:<{name_width}}{line['quantity']:>4}{line['price']:>9}{line['amount']:>10}")
+        lines += names[1:]
+
+    lines += [
+        rule,
+        _spread(f"TOTAL ({receipt['item_count']} items)", f"Rs. {receipt['total']}", width),
+        f"Paid by {receipt['payment_mode']}",
+        rule,
+        'Thank you, visit again!'.center(width).rstrip(),
+    ]
+    return lines
+
+
+def render_text(header, receipt):
+    return ('\n'.join(receipt_lines(header, receipt, receipt_settings()['THERMAL_WIDTH'])) + '\n').encode()
+
+
+def render_pdf(header, receipt):
+    return pdf_document(receipt_lines(header, receipt, receipt_settings()['PDF_WIDTH']))
+
+
+RENDERERS = {
+    'html': render_html,
+    'text': render_text,
+    'pdf': render_pdf,
+}
+
+
+def _pdf_string(text):
+    encoded = text.encode('cp1252', 'replace')  # What WinAnsiEncoding covers
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def pdf_document(lines, font_size=9, margin=36, page_size=(595, 842)):
+    """A PDF of text lines in Courier on A4 pages, as many pages as they need"""
+    width, height = page_size
+    leading = font_size + 3
+    per_page = max((height - 2 * margin) // leading, 1)
+    pages = [lines[first:first + per_page] for first in range(0, len(lines), per_page)] or [[]]
+
+    # Objects 1 to 3 are the catalog, the page tree and the font; each page adds its content and itself
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+    ]
+    kids = []
+    for page in pages:
+        stream = b'BT /F1 %d Tf %d TL %d %d Td\n' % (font_size, leading, margin, height - margin - font_size)
+        stream += b''.join(b'(%s) Tj T*\n' % _pdf_string(line) for line in page) + b'ET'
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> '
+            b'/Contents %d 0 R >>' % (width, height, len(objects))
+        )
+        kids.append(len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(b'%d 0 R' % kid for kid in kids), len(kids))
+
+    document = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(document))
+        document += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(document)
+    document += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    document += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    document += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(document)
+
+
+def render_chunk(task):
+    """[(file name, content)] of a (business id, bill ids, output) task, run in a worker process"""
+    business_id, bill_ids, output = task
+    header = business_header(business_id)
+    extension = OUTPUTS[output][1]
+    return [
+        (f"receipt-{receipt['id']}.{extension}", RENDERERS[output](header, receipt))
+        for receipt in load_receipts(business_id, bill_ids)
+    ]
+
+
+def _rendered_chunks(tasks, workers):
+    if workers <= 1:
+        for task in tasks:
+            yield render_chunk(task)
+        return
+    connections.close_all()  # Children must open their own connections
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        pending = deque()
+        for task in tasks:
+            # A few chunks ahead of the writer, so rendered receipts do not pile up in memory
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(pool.submit(render_chunk, task))
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_receipt_archive(fileobj, business_id, bill_ids, output, workers=1):
+    """
+    Zip the receipts of the business's bill_ids into fileobj, which need not be seekable.
+
+    Chunks of RENDER_CHUNK_SIZE bills are rendered by workers processes and
+    written in bill order. Returns the number of receipts written.
+    """
+    business_header(business_id)  # Cached before forking, so workers start with it
+    tasks = [
+        (business_id, bill_ids[first:first + RENDER_CHUNK_SIZE], output)
+        for first in range(0, len(bill_ids), RENDER_CHUNK_SIZE)
+    ]
+    written = 0
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for chunk in _rendered_chunks(tasks, workers):
+            for name, content in chunk:
+                archive.writestr(name, content)
+                written += 1
+    return written
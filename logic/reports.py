@@ -0,0 +1,195 @@
+"""
+Daily sales rollups behind /api/reports/.
+
+Bill writes describe their effect on the rollup tables as a RollupDelta, which
+is plain data and applied with a few bulk statements from a background job,
+so a report over a year reads a few hundred pre-aggregated rows instead of
+every bill.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.apps import apps as global_apps
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .jobs import job
+from .models import Customer, DailyItemSales, DailySales, Inventory
+
+
+def _line(item):
+    # BillItem rows and validated item dicts both describe a bill line
+    if isinstance(item, dict):
+        return item['inventory_item'].id, item['quantity'], item['price']
+    return item.inventory_item_id, item.quantity, item.price
+
+
+class RollupDelta:
+    """Pending changes to DailySales and DailyItemSales, keyed like their unique constraints"""
+
+    def __init__(self):
+        self.sales = defaultdict(lambda: [0, Decimal('0.00')])
+        self.items = defaultdict(lambda: [0, Decimal('0.00')])
+
+    def add_bill(self, bill, items, sign=1):
+        """Add (sign=1) or remove (sign=-1) a bill and its lines"""
+        day = timezone.localdate(bill.created_at).isoformat()
+        sales = self.sales[(bill.business_id, day, bill.customer_id, bill.payment_mode)]
+        sales[0] += sign
+        sales[1] += sign * Decimal(str(bill.total_amount))
+        for inventory_id, quantity, price in map(_line, items):
+            line = self.items[(bill.business_id, day, inventory_id)]
+            line[0] += sign * quantity
+            line[1] += sign * quantity * Decimal(str(price))
+        return self
+
+    def merge(self, other):
+        """Add another delta's changes to this one"""
+        for mine, theirs in [(self.sales, other.sales), (self.items, other.items)]:
+            for key, (count, revenue) in theirs.items():
+                mine[key][0] += count
+                mine[key][1] += revenue
+        return self
+
+    def to_json(self):
+        return {
+            'sales': [[*key, count, str(revenue)] for key, (count, revenue) in self.sales.items() if count or revenue],
+            'items': [[*key, count, str(revenue)] for key, (count, revenue) in self.items.items() if count or revenue],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        delta = cls()
+        for *key, count, revenue in data['sales']:
+            delta.sales[tuple(key)] = [count, Decimal(revenue)]
+        for *key, quantity, revenue in data['items']:
+            delta.items[tuple(key)] = [quantity, Decimal(revenue)]
+        return delta
+
+    def enqueue(self):
+        """Apply the delta from a background job once the current transaction commits"""
+        data = self.to_json()
+        if data['sales'] or data['items']:
+            apply_rollups.delay(delta=data)
+
+    def apply(self):
+        data = self.to_json()
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    self._apply(DailySales, ['business_id', 'day', 'customer_id', 'payment_mode'], 'bill_count',
+                                data['sales'])
+                    self._apply(DailyItemSales, ['business_id', 'day', 'inventory_item_id'], 'quantity', data['items'])
+                return
+            except IntegrityError:
+                # Another writer inserted one of our new rows first; retrying updates it instead
+                if attempt:
+                    raise
+
+    @staticmethod
+    def _apply(model, key_fields, count_field, rows):
+        if not rows:
+            return
+        pending = {tuple(str(value) for value in row[:-2]): row for row in rows}
+
+        # One query for the rows that already exist, filtered on each key column
+        lookup = {f'{field}__in': {row[i] for row in rows} for i, field in enumerate(key_fields)}
+        existing = []
+        for obj in model.objects.filter(**lookup):
+            row = pending.pop(tuple(str(getattr(obj, field)) for field in key_fields), None)
+            if row is not None:
+                setattr(obj, count_field, F(count_field) + row[-2])
+                obj.revenue = F('revenue') + Decimal(row[-1])
+                existing.append(obj)
+
+        if existing:
+            model.objects.bulk_update(existing, [count_field, 'revenue'])
+        if pending:
+            model.objects.bulk_create([
+                model(**dict(zip(key_fields, row[:-2])), **{count_field: row[-2]}, revenue=Decimal(row[-1]))
+                for row in pending.values()
+            ])
+
+
+@job
+def apply_rollups(delta):
+    RollupDelta.from_json(delta).apply()
+
+
+def rebuild_rollups(business_ids=None, start=None, end=None, apps=global_apps):
+    """
+    Recompute the rollups for the given businesses and date range from bills.
+
+    Takes an app registry so migrations can run it against historical models.
+    """
+    Bill = apps.get_model('logic', 'Bill')
+    BillItem = apps.get_model('logic', 'BillItem')
+    Sales = apps.get_model('logic', 'DailySales')
+    ItemSales = apps.get_model('logic', 'DailyItemSales')
+
+    bills = Bill.objects.all()
+    items = BillItem.objects.all()
+    sales = Sales.objects.all()
+    item_sales = ItemSales.objects.all()
+    if business_ids is not None:
+        bills, items = bills.filter(business_id__in=business_ids), items.filter(bill__business_id__in=business_ids)
+        sales, item_sales = sales.filter(business_id__in=business_ids), item_sales.filter(business_id__in=business_ids)
+    if start is not None:
+        bills, items = bills.filter(created_at__date__gte=start), items.filter(bill__created_at__date__gte=start)
+        sales, item_sales = sales.filter(day__gte=start), item_sales.filter(day__gte=start)
+    if end is not None:
+        bills, items = bills.filter(created_at__date__lte=end), items.filter(bill__created_at__date__lte=end)
+        sales, item_sales = sales.filter(day__lte=end), item_sales.filter(day__lte=end)
+
+    line_total = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    with transaction.atomic():
+        sales.delete()
+        item_sales.delete()
+        Sales.objects.bulk_create([
+            Sales(business_id=row['business_id'], day=row['day'], customer_id=row['customer_id'],
+                  payment_mode=row['payment_mode'], bill_count=row['bill_count'], revenue=row['revenue'])
+            for row in bills.annotate(day=TruncDate('created_at')).values(
+                'business_id', 'day', 'customer_id', 'payment_mode'
+            ).annotate(bill_count=Count('id'), revenue=Sum('total_amount')).order_by()
+        ], batch_size=1000)
+        ItemSales.objects.bulk_create([
+            ItemSales(business_id=row['bill__business_id'], day=row['day'], inventory_item_id=row['inventory_item_id'],
+                      quantity=row['total_quantity'], revenue=row['revenue'])
+            for row in items.annotate(day=TruncDate('bill__created_at')).values(
+                'bill__business_id', 'day', 'inventory_item_id'
+            ).annotate(total_quantity=Sum('quantity'), revenue=Sum(line_total)).order_by()
+        ], batch_size=1000)
+
+
+def _top(queryset, key, model, top, **aggregates):
+    # Group on the id alone and look up names for the winners only, so the join
+    # never runs over the whole date range
+    rows = list(queryset.values(key).annotate(**aggregates).order_by('-revenue')[:top])
+    names = model.objects.in_bulk([row[key] for row in rows])
+    for row in rows:
+        row['name'] = names[row[key]].name if row[key] in names else None
+    return rows
+
+
+def sales_report(business, start, end, top=10):
+    """Revenue by day, payment mode and customer, plus top items, between two dates inclusive"""
+    sales = DailySales.objects.filter(business=business, day__range=[start, end])
+    item_sales = DailyItemSales.objects.filter(business=business, day__range=[start, end])
+
+    totals = sales.aggregate(bill_count=Sum('bill_count'), revenue=Sum('revenue'))
+    return {
+        'start_date': start,
+        'end_date': end,
+        'totals': {'bill_count': totals['bill_count'] or 0, 'revenue': totals['revenue'] or Decimal('0.00')},
+        'by_day': list(
+            sales.values('day').annotate(bill_count=Sum('bill_count'), revenue=Sum('revenue')).order_by('day')
+        ),
+        'by_payment_mode': list(
+            sales.values('payment_mode').annotate(bill_count=Sum('bill_count'), revenue=Sum('revenue'))
+            .order_by('-revenue')
+        ),
+        'top_customers': _top(sales, 'customer', Customer, top, bill_count=Sum('bill_count'), revenue=Sum('revenue')),
+        'top_items': _top(item_sales, 'inventory_item', Inventory, top, quantity=Sum('quantity'), revenue=Sum('revenue')),
+    }
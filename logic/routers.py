@@ -0,0 +1,78 @@
+"""
+Read replica routing.
+
+Reads only go to the aliases in settings.DATABASE_REPLICAS inside
+replica_reads(), which ReplicaMiddleware opens around GET/HEAD/OPTIONS
+requests. Everything else stays on the primary: writes, reads inside an
+atomic block on the primary (select_for_update, read-modify-write), and
+every read that follows a write in the same request, so a request always
+sees its own changes. A request reads from one replica throughout, so it
+never mixes rows from replicas that lag by different amounts. Auth tables are always read from the primary, as a
+token issued a moment ago may not have reached the replica yet.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_ONLY_APPS = {'auth', 'authtoken', 'sessions'}
+
+
+class ReplicaState:
+    def __init__(self, replica):
+        self.replica = replica  # Every read of the block goes to this one replica
+        self.pinned = False  # Set by the first write, keeps the rest of the request on the primary
+
+
+_state = contextvars.ContextVar('replica_state', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def replica_reads():
+    """Let reads in this block go to a replica until something is written"""
+    aliases = replicas()
+    token = _state.set(ReplicaState(random.choice(aliases) if aliases else None))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary in this block, e.g. right before a write that depends on the data"""
+    token = _state.set(None)
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.pinned or state.replica is None:
+            return None
+        if model._meta.app_label in PRIMARY_ONLY_APPS or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Replicas hold the same rows as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and are never migrated directly
+        return db not in replicas()
@@ -0,0 +1,156 @@
+import re
+
+from django.db import connections
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Inventory
+
+FTS_TABLE = 'logic_inventory_fts'
+
+# External-content FTS5 index over Inventory.name/description. The triggers keep
+# it in sync on every insert, update and delete, including bulk writes.
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, content='logic_inventory', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS logic_inventory_fts_insert AFTER INSERT ON logic_inventory BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS logic_inventory_fts_delete AFTER DELETE ON logic_inventory BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS logic_inventory_fts_update AFTER UPDATE OF name, description
+        ON logic_inventory BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+# Column weights for bm25(): a hit in the name counts far more than one in the description
+FTS_RANKING = f'bm25({FTS_TABLE}, 10.0, 1.0)'
+
+_fts_enabled = {}
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT sqlite_compileoption_used(%s)', ['ENABLE_FTS5'])
+        return bool(cursor.fetchone()[0])
+
+
+def install_search_index(connection):
+    """
+    Create the FTS5 table and triggers if missing and rebuild the index.
+
+    Safe to run repeatedly. Migrations that rebuild logic_inventory on SQLite drop
+    its triggers, so this also runs after every migrate.
+    """
+    if not fts5_supported(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", ['logic_inventory_fts%']
+        )
+        triggers = cursor.fetchone()[0]
+        for statement in FTS_SCHEMA:
+            cursor.execute(statement)
+        if triggers < 3:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    _fts_enabled.pop(connection.alias, None)
+    return True
+
+
+def uninstall_search_index(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for trigger in ['insert', 'delete', 'update']:
+            cursor.execute(f'DROP TRIGGER IF EXISTS logic_inventory_fts_{trigger}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    _fts_enabled.pop(connection.alias, None)
+
+
+def search_index_available(connection):
+    if connection.alias not in _fts_enabled:
+        enabled = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                enabled = cursor.fetchone() is not None
+        _fts_enabled[connection.alias] = enabled
+    return _fts_enabled[connection.alias]
+
+
+def _match_expression(query):
+    # Every word must match as a prefix, e.g. "paal sab" -> "paal"* "sab"*
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _name_contains(business, query, using, limit=None):
+    query = query.strip()
+    if not query:
+        return []
+    ids = Inventory.objects.using(using).filter(business=business, name__icontains=query).order_by('id')
+    return list(ids.values_list('id', flat=True)[:limit])
+
+
+def search_inventory(business, query, limit=None, using='default', substring=False):
+    """
+    Return ids of the business's inventory matching query, most relevant first.
+
+    The index matches words by prefix, so "alak" does not find "Paalak". With
+    substring, items whose name contains the query anywhere are added after
+    the index's hits.
+    """
+    if business is None:
+        return []
+
+    connection = connections[using]
+    if search_index_available(connection):
+        match = _match_expression(query)
+        if not match:
+            # Nothing for the index to match, e.g. "-" or "%"; names may still contain it
+            return _name_contains(business, query, using, limit) if substring else []
+        sql = (
+            f'SELECT logic_inventory.id FROM {FTS_TABLE} '
+            f'JOIN logic_inventory ON logic_inventory.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND logic_inventory.business_id = %s '
+            f'ORDER BY {FTS_RANKING}'
+        )
+        params = [match, business.pk]
+        if limit is not None and not substring:
+            sql += ' LIMIT %s'
+            params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ids = [row[0] for row in cursor.fetchall()]
+        if substring:
+            found = set(ids)
+            ids += [pk for pk in _name_contains(business, query, using) if pk not in found]
+        return ids if limit is None else ids[:limit]
+
+    # Portable fallback: substring match ranked by where the query hits. The
+    # inventory table is small next to bill history, so this stays cheap.
+    query = query.strip()
+    if not query:
+        return []
+    queryset = Inventory.objects.using(using).filter(
+        Q(name__icontains=query) | Q(description__icontains=query), business=business
+    ).annotate(
+        relevance=Case(
+            When(name__iexact=query, then=Value(0)),
+            When(name__istartswith=query, then=Value(1)),
+            When(name__icontains=query, then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+    ).order_by('relevance', 'name')
+    if limit is not None:
+        queryset = queryset[:limit]
+    return list(queryset.values_list('id', flat=True))
@@ -0,0 +1,335 @@
+"""
+Synthetic stores at production scale for `manage.py seed`.
+
+A seeded store gets customers and SKUs, then a stream of bills with their
+lines and of customer transactions. Item and customer popularity follow a
+Zipf law, and created_at follows store hours, weekends and a growth trend
+across the window. Each chunk of CHUNK_SIZE bills or transactions is
+generated from its own random seed, so the rows are the same for the same
+seed and window however many workers write them.
+
+Chunks are written with executemany INSERTs of rows already in database
+form, skipping the ORM for the big tables, and nothing is held for the
+whole run, so memory stays flat. The sales rollups are aggregated by the
+database at the end with INSERT ... SELECT. Bill ids are assigned up front
+so lines can refer to their bill without reading it back, which assumes
+nothing else creates bills while a seed runs. Worker processes write
+chunks side by side.
+"""
+import multiprocessing
+import random
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Sum, Value
+from django.utils import timezone
+
+from .models import Bill, BillItem, Business, Customer, DailyItemSales, DailySales, Inventory, StockMovement, \
+    Transaction
+
+CHUNK_SIZE = 5000
+
+FIRST_NAMES = [
+    'Aarav', 'Aditi', 'Amit', 'Ananya', 'Arjun', 'Asha', 'Deepak', 'Divya', 'Farhan', 'Gita', 'Harish', 'Isha',
+    'Kabir', 'Kavya', 'Manoj', 'Meera', 'Neha', 'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Ravi', 'Rohan', 'Sana',
+    'Sunita', 'Suresh', 'Tanvi', 'Uday', 'Vikram', 'Zoya',
+]
+LAST_NAMES = [
+    'Agarwal', 'Bose', 'Chopra', 'Das', 'Gupta', 'Iyer', 'Jain', 'Khan', 'Kumar', 'Mehta', 'Nair', 'Patel',
+    'Rao', 'Reddy', 'Sharma', 'Singh', 'Verma', 'Yadav',
+]
+BRANDS = [
+    'Amul', 'Tata', 'Aashirvaad', 'Fortune', 'Britannia', 'Parle', 'Haldiram', 'MDH', 'Everest', 'Dabur',
+    'Patanjali', 'Nestle', 'Godrej', 'Mother Dairy', 'Saffola', 'Surf', 'Lifebuoy', 'Colgate', 'Maggi', 'Catch',
+]
+PRODUCTS = [
+    'Atta', 'Basmati Chawal', 'Toor Dal', 'Moong Dal', 'Chana Dal', 'Haldi', 'Jeera', 'Garam Masala', 'Ghee',
+    'Doodh', 'Dahi', 'Paneer', 'Makhan', 'Chai Patti', 'Coffee', 'Chini', 'Namak', 'Sarso Tel', 'Sunflower Oil',
+    'Biscuit', 'Namkeen', 'Noodles', 'Sabun', 'Shampoo', 'Toothpaste', 'Detergent', 'Poha', 'Besan', 'Suji',
+    'Rajma', 'Kaju', 'Badam', 'Kishmish', 'Achar', 'Papad', 'Sauce', 'Jam', 'Bread', 'Ande', 'Agarbatti',
+]
+SIZES = ['50g', '100g', '200g', '250g', '500g', '1kg', '2kg', '5kg', '200ml', '500ml', '1L', '5L', 'Pack of 6']
+
+PAYMENT_MODES = ['UPI', 'CASH', 'CARD', 'OTHER']
+PAYMENT_WEIGHTS = list(accumulate([45, 35, 18, 2]))
+QUANTITIES = [1, 2, 3, 4, 5]
+QUANTITY_WEIGHTS = list(accumulate([70, 15, 8, 4, 3]))
+
+# Relative traffic by hour of day and by weekday (Monday first)
+HOURLY = [0, 0, 0, 0, 0, 0, 0.2, 0.5, 1, 1.5, 1.8, 2, 2, 1.7, 1.4, 1.3, 1.5, 2, 2.4, 2.5, 2, 1.2, 0.5, 0.1]
+WEEKDAYS = [0.9, 0.85, 0.9, 0.95, 1.1, 1.4, 1.3]
+GROWTH = 0.5  # The last day of the window is this much busier than the first
+
+
+def zipf_weights(count, skew):
+    """Cumulative Zipf weights for ranks 1..count, for random.choices(cum_weights=...)"""
+    return list(accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+def _cents(cents):
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+class SeedPlan:
+    """Everything a worker needs to generate any chunk; plain data so it pickles"""
+
+    def __init__(self, business_id, customer_ids, items, first_bill_id, bills, lines, transactions, start, days,
+                 seed, item_skew, customer_skew):
+        self.business_id = business_id
+        self.first_bill_id = first_bill_id
+        self.bills = bills
+        self.lines = lines
+        self.transactions = transactions
+        self.start = start
+        self.seed = seed
+
+        rng = random.Random(seed)
+        # Popularity ranks are shuffled so the best sellers are spread across the catalog
+        self.customer_ids = rng.sample(customer_ids, len(customer_ids))
+        self.customer_weights = zipf_weights(len(customer_ids), customer_skew)
+        self.items = rng.sample(items, len(items))
+        self.item_weights = zipf_weights(len(items), item_skew)
+
+        self.slot_weights = [
+            HOURLY[hour] * WEEKDAYS[(start + timedelta(days=day)).weekday()] * (1 + GROWTH * day / days)
+            for day in range(days) for hour in range(24)
+        ]
+        self.slot_totals = list(accumulate(self.slot_weights))
+
+    def moment(self, fraction):
+        """The time by which fraction of the window's traffic has happened, so ordered fractions give ordered times"""
+        target = fraction * self.slot_totals[-1]
+        slot = min(bisect_right(self.slot_totals, target), len(self.slot_totals) - 1)
+        before = self.slot_totals[slot - 1] if slot else 0
+        return self.start + timedelta(hours=slot + (target - before) / self.slot_weights[slot])
+
+    def chunks(self, total):
+        return range(-(-total // CHUNK_SIZE))
+
+
+def bill_chunk(plan, chunk):
+    """Rows of chunk number chunk as (bills, bill items), the same for the same plan"""
+    rng = random.Random(f'{plan.seed}:bills:{chunk}')
+    adapt = connection.ops.adapt_datetimefield_value
+    first, last = chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, plan.bills)
+    customers = rng.choices(plan.customer_ids, cum_weights=plan.customer_weights, k=last - first)
+    modes = rng.choices(PAYMENT_MODES, cum_weights=PAYMENT_WEIGHTS, k=last - first)
+    stop = 1 / plan.lines
+    sizes = []
+    for _ in range(last - first):
+        size = 1
+        while rng.random() > stop and size < 50:  # Geometric, averaging plan.lines
+            size += 1
+        sizes.append(size)
+    # Drawn for the whole chunk at once, which is several times faster than per line
+    picks = iter(rng.choices(plan.items, cum_weights=plan.item_weights, k=sum(sizes)))
+    quantities = iter(rng.choices(QUANTITIES, cum_weights=QUANTITY_WEIGHTS, k=sum(sizes)))
+
+    bills, lines = [], []
+    for index, customer_id, mode, size in zip(range(first, last), customers, modes, sizes):
+        bill_id = plan.first_bill_id + index
+        basket = {}
+        for _ in range(size):
+            item = next(picks)
+            basket[item] = basket.get(item, 0) + next(quantities)
+        total = 0
+        for (item_id, price), quantity in basket.items():
+            lines.append((bill_id, item_id, quantity, _cents(price)))
+            total += price * quantity
+        created_at = plan.moment((index + rng.random()) / plan.bills)
+        bills.append((bill_id, customer_id, plan.business_id, _cents(total), mode, adapt(created_at)))
+    return bills, lines
+
+
+def transaction_chunk(plan, chunk):
+    rng = random.Random(f'{plan.seed}:transactions:{chunk}')
+    adapt = connection.ops.adapt_datetimefield_value
+    first, last = chunk * CHUNK_SIZE, min((chunk + 1) * CHUNK_SIZE, plan.transactions)
+    customers = rng.choices(plan.customer_ids, cum_weights=plan.customer_weights, k=last - first)
+    return [
+        (customer_id, plan.business_id, _cents(int(rng.lognormvariate(7, 1.2))),
+         'CREDIT' if rng.random() < 0.6 else 'DEBIT',
+         adapt(plan.moment((index + rng.random()) / plan.transactions)))
+        for index, customer_id in zip(range(first, last), customers)
+    ]
+
+
+def insert_rows(model, fields, rows):
+    """executemany INSERT of rows already in database form"""
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+def insert_select(model, queryset, renames=()):
+    """
+    INSERT the rows of a values() queryset into model's table in one statement.
+
+    Its names are model fields, except those mapped to one in renames.
+    """
+    query = queryset.query
+    renames = dict(renames)
+    fields = [renames.get(name, name) for name in [*query.values_select, *query.annotation_select]]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    sql, params = query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) {sql}', params)
+
+
+def build_rollups(business, start, days):
+    """
+    DailySales and DailyItemSales of a freshly seeded business.
+
+    The aggregation rebuild_rollups runs, but inserted by the database
+    itself so millions of rollup rows never pass through Python. Going a
+    day at a time lets the created_at index pick the rows and keeps the
+    database from truncating every timestamp.
+    """
+    line_total = ExpressionWrapper(F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    first_day = timezone.localdate(start)
+    with transaction.atomic():
+        for offset in range(days + 1):
+            day = first_day + timedelta(days=offset)
+            since = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+            until = timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+            bills = Bill.objects.filter(business=business, created_at__gte=since, created_at__lt=until)
+            items = BillItem.objects.filter(bill__in=bills)
+            insert_select(DailySales, bills.values('business', 'customer', 'payment_mode').annotate(
+                day=Value(day), bill_count=Count('id'), revenue=Sum('total_amount'),
+            ).order_by())
+            insert_select(DailyItemSales, items.values('inventory_item').annotate(
+                business=Value(business.id), day=Value(day), total_quantity=Sum('quantity'), revenue=Sum(line_total),
+            ).order_by(), renames={'total_quantity': 'quantity'})
+
+
+def _retry_locked(write, attempts=20):
+    # SQLite allows one writer; a worker that waited out the busy timeout tries again
+    for attempt in range(attempts):
+        try:
+            return write()
+        except OperationalError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+
+
+def write_chunk(plan, kind, chunk):
+    """Generate and write one chunk in its own transaction; returns the rows written"""
+    if kind == 'bills':
+        bills, lines = bill_chunk(plan, chunk)
+
+        def write():
+            with transaction.atomic():
+                insert_rows(Bill, ['id', 'customer', 'business', 'total_amount', 'payment_mode', 'created_at'], bills)
+                insert_rows(BillItem, ['bill', 'inventory_item', 'quantity', 'price'], lines)
+        _retry_locked(write)
+        return len(bills) + len(lines)
+
+    rows = transaction_chunk(plan, chunk)
+
+    def write():
+        with transaction.atomic():
+            insert_rows(Transaction, ['customer', 'business', 'amount', 'transaction_type', 'created_at'], rows)
+    _retry_locked(write)
+    return len(rows)
+
+
+def create_catalog(business, customers, inventory, start, seed):
+    """Customers and SKUs with opening stock, created before the window; returns their ids and prices"""
+    rng = random.Random(f'{seed}:catalog')
+    adapt = connection.ops.adapt_datetimefield_value
+    now = adapt(timezone.now())
+
+    def joined(count, index):
+        return adapt(start - timedelta(days=365) + timedelta(days=365) * (index + rng.random()) / count)
+
+    for first in range(0, customers, CHUNK_SIZE):
+        rows = []
+        for index in range(first, min(first + CHUNK_SIZE, customers)):
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            email = f"{name.lower().replace(' ', '.')}{index}@example.com" if rng.random() < 0.3 else None
+            rows.append((name, f'9{rng.randrange(10 ** 9):09d}', email, business.id, joined(customers, index),
+                         '0.00', now, now))
+        insert_rows(Customer, ['name', 'phone', 'email', 'business', 'created_at', 'balance', 'last_activity_at',
+                               'updated_at'], rows)
+
+    for first in range(0, inventory, CHUNK_SIZE):
+        rows = []
+        for index in range(first, min(first + CHUNK_SIZE, inventory)):
+            price = min(max(int(rng.lognormvariate(4.5, 0.9) * 100), 500), 500000)
+            rows.append((f'{rng.choice(BRANDS)} {rng.choice(PRODUCTS)} {rng.choice(SIZES)}', f'SKU {index:06d}',
+                         _cents(price), rng.randint(0, 500), 0, business.id, joined(inventory, index), now))
+        insert_rows(Inventory, ['name', 'description', 'price', 'current_stock', 'reserved_stock', 'business',
+                                'created_at', 'updated_at'], rows)
+
+    items = list(Inventory.objects.filter(business=business).order_by('id').values_list('id', 'price', 'current_stock'))
+    opening = adapt(start - timedelta(days=365))
+    for first in range(0, len(items), CHUNK_SIZE):
+        insert_rows(StockMovement, ['inventory_item', 'delta', 'reason', 'created_at'], [
+            (pk, stock, 'OPENING', opening) for pk, _, stock in items[first:first + CHUNK_SIZE] if stock
+        ])
+    customer_ids = list(Customer.objects.filter(business=business).order_by('id').values_list('id', flat=True))
+    return customer_ids, [(pk, int(price * 100)) for pk, price, _ in items]
+
+
+_plan = None
+
+
+def _start_worker(plan):
+    global _plan
+    _plan = plan
+
+
+def _run_task(task):
+    return task[0], write_chunk(_plan, *task)
+
+
+def seed_store(name, customers, inventory, bills, lines, transactions, days, end, seed=1, item_skew=1.1,
+               customer_skew=0.8, workers=1, progress=None):
+    """
+    Create a business named name with an owner and generate its data.
+
+    bills end at end and span days; lines is the average number of items
+    per bill. progress, if given, is called with (chunks done, chunks,
+    rows written) as chunks finish. Returns the business.
+    """
+    start = end - timedelta(days=days)
+    username = f"{name.lower().replace(' ', '_')}_owner"
+    with transaction.atomic():
+        owner = User.objects.create_user(username=username)
+        business = Business.objects.create(name=name, address='Seeded', owner=owner)
+        customer_ids, items = create_catalog(business, customers, inventory, start, seed)
+        first_bill_id = (Bill.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    plan = SeedPlan(business.id, customer_ids, items, first_bill_id, bills, lines, transactions, start, days, seed,
+                    item_skew, customer_skew)
+    tasks = [('bills', chunk) for chunk in plan.chunks(bills)] + \
+            [('transactions', chunk) for chunk in plan.chunks(transactions)]
+    written = 0
+    if workers > 1:
+        connections.close_all()  # Children must open their own connections
+        with multiprocessing.get_context('fork').Pool(workers, _start_worker, (plan,)) as pool:
+            for done, (_, rows) in enumerate(pool.imap_unordered(_run_task, tasks), 1):
+                written += rows
+                if progress:
+                    progress(done, len(tasks), written)
+    else:
+        for done, task in enumerate(tasks, 1):
+            written += write_chunk(plan, *task)
+            if progress:
+                progress(done, len(tasks), written)
+
+    build_rollups(business, start, days)
+    # Explicit ids leave sequences behind on databases that have them
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Bill]):
+            cursor.execute(sql)
+    return business
@@ -1,5 +1,13 @@
+import logging
+
+from django.db import transaction
 from rest_framework import serializers
-from .models import Business, Customer, Transaction, Role, Staff, Inventory, BillItem, Bill, User
+from .models import Business, Customer, Transaction, Role, Staff, Inventory, BillItem, Bill, User, ImportRun
+from .reports import RollupDelta
+from .stock import apply_stock_changes, collect_quantities, take_reservation
+from .tenancy import resolve_membership
+
+logger = logging.getLogger(__name__)
 
 class BusinessSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,67 +36,162 @@ class BillItemSerializer(serializers.ModelSerializer):
         model = BillItem
         fields = ['inventory_item', 'quantity', 'price']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Expanded form (?expand=items), served from the inventory rows prefetched with the items
+        if self.context.get('expand_items'):
+            data['item_name'] = instance.inventory_item.name
+            data['line_total'] = str(instance.quantity * instance.price)
+        return data
+
 
 class BillSerializer(serializers.ModelSerializer):
     items = BillItemSerializer(many=True)
+    # Token from /api/reservations/ whose held stock this bill consumes
+    reservation = serializers.CharField(write_only=True, required=False)
 
     class Meta:
         model = Bill
-        fields = ['id', 'customer', 'total_amount', 'payment_mode', 'created_at', 'items']
+        fields = ['id', 'customer', 'total_amount', 'payment_mode', 'created_at', 'items', 'reservation']
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')  # Extract items data
-        bill = Bill.objects.create(**validated_data)  # Create the Bill object
+        reservation = validated_data.pop('reservation', None)
 
-        for item_data in items_data:
-            inventory_item = item_data['inventory_item']
-            quantity = item_data['quantity']
+        with transaction.atomic():
+            bill = Bill.objects.create(**validated_data)  # Create the Bill object
 
-            # Check if the requested quantity is available in the inventory, can uncomment later
-            # if inventory_item.current_stock < quantity:
-            #     raise serializers.ValidationError(f"Not enough stock for {inventory_item.name}")
+            # Insert every line in one statement instead of one INSERT per item
+            BillItem.objects.bulk_create([BillItem(bill=bill, **item_data) for item_data in items_data])
 
-            # Deduct the quantity from the inventory
-            inventory_item.current_stock -= quantity
-            inventory_item.save()
+            # Deduct the sold quantities from the inventory in one atomic UPDATE, releasing
+            # the cart's reservation and optionally rejecting the bill if an item would be oversold
+            released = take_reservation(bill.business_id, reservation) if reservation else None
+            apply_stock_changes(
+                {pk: -quantity for pk, quantity in collect_quantities(items_data).items()},
+                released=released, bill=bill,
+            )
 
-            BillItem.objects.create(bill=bill, **item_data)
+            RollupDelta().add_bill(bill, items_data).enqueue()
 
         return bill
 
     def update(self, instance, validated_data):
-        items_data = validated_data.pop('items')  # Extract items data
+        items_data = validated_data.pop('items', None)  # Extract items data, absent on partial updates
 
-        # Update the Bill object
-        instance.customer = validated_data.get('customer', instance.customer)
-        instance.total_amount = validated_data.get('total_amount', instance.total_amount)
-        instance.payment_mode = validated_data.get('payment_mode', instance.payment_mode)
-        instance.save()
+        with transaction.atomic():
+            existing_items = list(instance.items.order_by('id'))
+            # Take the bill as it was out of the sales rollups before anything changes
+            rollup = RollupDelta().add_bill(instance, existing_items, sign=-1)
 
-        # Delete existing BillItem objects for this bill
-        instance.items.all().delete()
+            # Update the Bill object
+            instance.customer = validated_data.get('customer', instance.customer)
+            instance.total_amount = validated_data.get('total_amount', instance.total_amount)
+            instance.payment_mode = validated_data.get('payment_mode', instance.payment_mode)
+            instance.save()
 
-        # Create new BillItem objects for each item in the payload
-        for item_data in items_data:
-            BillItem.objects.create(bill=instance, **item_data)
+            if items_data is not None:
+                # Rows touched by this edit, kept on the serializer and logged for auditing
+                self.item_changes = changes = self._sync_items(instance, existing_items, items_data)
+                logger.info(
+                    "Bill %s items: %d inserted, %d updated, %d deleted",
+                    instance.id, changes['inserted'], changes['updated'], changes['deleted'],
+                )
+
+            rollup.add_bill(instance, existing_items if items_data is None else items_data).enqueue()
 
         return instance
 
+    def _sync_items(self, bill, existing_items, items_data):
+        """Write only the BillItem rows that differ from items_data and move stock by the net change"""
+        # Existing lines grouped by inventory item, so incoming lines can be matched against them
+        existing = {}
+        for item in existing_items:
+            existing.setdefault(item.inventory_item_id, []).append(item)
+        old_quantities = {pk: sum(item.quantity for item in rows) for pk, rows in existing.items()}
+
+        to_create = []
+        to_update = []
+        for item_data in items_data:
+            rows = existing.get(item_data['inventory_item'].id)
+            if not rows:
+                to_create.append(BillItem(bill=bill, **item_data))
+                continue
+            item = rows.pop(0)
+            if item.quantity != item_data['quantity'] or item.price != item_data['price']:
+                item.quantity = item_data['quantity']
+                item.price = item_data['price']
+                to_update.append(item)
+        to_delete = [item.id for rows in existing.values() for item in rows]
+
+        if to_delete:
+            BillItem.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            BillItem.objects.bulk_update(to_update, ['quantity', 'price'])
+        if to_create:
+            BillItem.objects.bulk_create(to_create)
+
+        # Selling more of an item takes stock out, selling less puts it back
+        new_quantities = collect_quantities(items_data)
+        apply_stock_changes({
+            pk: old_quantities.get(pk, 0) - new_quantities.get(pk, 0)
+            for pk in old_quantities.keys() | new_quantities.keys()
+        }, reason='BILL_EDIT', bill=bill)
+
+        return {'inserted': len(to_create), 'updated': len(to_update), 'deleted': len(to_delete)}
+
+class ReservationItemSerializer(serializers.Serializer):
+    inventory_item = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class ReservationSerializer(serializers.Serializer):
+    token = serializers.CharField(max_length=64, required=False)  # Add to an existing cart
+    items = ReservationItemSerializer(many=True, allow_empty=False)
+
+class ImportRunSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImportRun
+        fields = '__all__'
+
 class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Lists link the small thumbnail instead of the full attachment once one is made;
+        # until then, or for files that get none (PDFs, or no Pillow), the attachment stays
+        if self.context.get('thumbnails_only') and data.get('bill_thumbnail'):
+            data.pop('bill_attachment', None)
+        return data
+
 class RoleSerializer(serializers.ModelSerializer):
     class Meta:
         model = Role
         fields = '__all__'
+        read_only_fields = ['business', 'version']
+
+    def validate_permissions(self, value):
+        if not isinstance(value, list) or not all(isinstance(permission, str) for permission in value):
+            raise serializers.ValidationError("Expected a list of permission strings.")
+        return value
 
 class StaffSerializer(serializers.ModelSerializer):
     class Meta:
         model = Staff
         fields = '__all__'
 
+    def validate_role(self, value):
+        # Roles belong to a business; another business's role would leak its permissions
+        request = self.context.get('request')
+        if value is None or request is None:
+            return value
+        business = request.membership.business
+        if business is None or value.business_id != business.id:
+            raise serializers.ValidationError("Role belongs to another business.")
+        return value
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -107,10 +210,9 @@ class UserBusinessSerializer(serializers.Serializer):
         }
 
     def get_business(self, obj):
-        # Check if user owns a business
-        if hasattr(obj, 'owned_business'):
-            return BusinessSerializer(obj.owned_business).data
-        # Check if user is staff of any business
-        elif obj.staff_memberships.exists():
-            return BusinessSerializer(obj.staff_memberships.first().business).data
-        return None
+        # The business the user owns or is staff of, from the per-request membership
+        request = self.context.get('request')
+        membership = request.membership if request is not None else resolve_membership(obj)
+        if membership.business is None:
+            return None
+        return BusinessSerializer(membership.business).data
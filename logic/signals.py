@@ -0,0 +1,157 @@
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .attachments import schedule_thumbnail, thumbnail_name
+from .authentication import token_cache
+from .changes import record_deletions
+from .metrics import install_query_recorder
+from .ledger import apply_balance_changes, ledger_entry, refresh_last_activity, stored_ledger_entry
+from .models import Bill, Business, Customer, Inventory, Role, Staff, StockMovement, Transaction
+from .receipts import forget_business_header
+from .reports import RollupDelta
+from .search import install_search_index
+from .tenancy import invalidate_memberships
+
+
+@receiver([post_save, post_delete], sender=Business)
+def business_changed(sender, instance, **kwargs):
+    # The owner and every staff member have this business cached
+    user_ids = list(Staff.objects.filter(business_id=instance.id).values_list('user_id', flat=True))
+    invalidate_memberships([instance.owner_id, *user_ids])
+    forget_business_header(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Staff)
+def staff_changed(sender, instance, **kwargs):
+    invalidate_memberships([instance.user_id])
+
+
+@receiver([post_save, pre_delete], sender=Role)
+def role_changed(sender, instance, **kwargs):
+    # Memberships carry the role's version and permissions; before a delete, while staff still point at it
+    invalidate_memberships(Staff.objects.filter(role_id=instance.id).values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # Covers deactivation as well as any other change to the cached user
+    keys = Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+    token_cache.invalidate_user(instance.pk, keys)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_recorder(connection)
+
+
+def search_index_migrated(sender, using, **kwargs):
+    # Table rebuilds during migrate drop the FTS triggers on logic_inventory
+    install_search_index(connections[using])
+
+
+LEDGER_FIELDS = {'customer', 'customer_id', 'total_amount', 'amount', 'transaction_type'}
+
+
+@receiver(pre_save, sender=Bill)
+@receiver(pre_save, sender=Transaction)
+def remember_ledger_entry(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not LEDGER_FIELDS & set(update_fields)):
+        instance._ledger_skip = True
+        return
+    instance._ledger_skip = False
+    instance._stored_ledger_entry = stored_ledger_entry(instance)
+
+
+@receiver(post_save, sender=Bill)
+@receiver(post_save, sender=Transaction)
+def update_ledger_on_save(sender, instance, **kwargs):
+    if instance.__dict__.pop('_ledger_skip', True):
+        return
+    stored = instance.__dict__.pop('_stored_ledger_entry', None)
+    customer_id, amount = ledger_entry(instance)
+
+    deltas = {customer_id: amount}
+    if stored is not None:
+        deltas[stored[0]] = deltas.get(stored[0], 0) - stored[1]
+    apply_balance_changes(deltas, {customer_id: instance.created_at})
+
+    if stored is not None and stored[0] != customer_id:
+        refresh_last_activity(stored[0])
+
+
+@receiver(post_delete, sender=Bill)
+@receiver(post_delete, sender=Transaction)
+def update_ledger_on_delete(sender, instance, origin=None, **kwargs):
+    # When the customer or business itself is being deleted there is no ledger left to maintain
+    if getattr(origin, 'model', type(origin)) in (Customer, Business):
+        return
+    customer_id, amount = ledger_entry(instance)
+    apply_balance_changes({customer_id: -amount})
+    refresh_last_activity(customer_id)
+
+
+@receiver(pre_delete, sender=Bill)
+def remove_bill_from_rollups(sender, instance, origin=None, **kwargs):
+    # Runs before the cascade removes the bill's items; a deleted business takes its rollups with it
+    source = getattr(origin, 'model', type(origin))
+    if source is Business:
+        return
+    delta = RollupDelta().add_bill(instance, instance.items.all(), sign=-1)
+    if source is Customer:
+        # The cascade removes the customer's DailySales rows; the job would recreate them for a missing customer
+        delta.sales.clear()
+    delta.enqueue()
+
+
+@receiver(post_save, sender=Transaction)
+def attachment_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    expected = thumbnail_name(instance.bill_attachment.name) if instance.bill_attachment else None
+    if (instance.bill_thumbnail.name or None) == expected:
+        return
+    if expected is None:
+        # The attachment was removed or is not an image
+        Transaction.objects.filter(pk=instance.pk).update(bill_thumbnail=None)
+        instance.bill_thumbnail = None
+    else:
+        schedule_thumbnail(instance.pk)
+
+
+@receiver(pre_save, sender=Inventory)
+def remember_stock(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None or (update_fields is not None and 'current_stock' not in update_fields):
+        instance._stored_stock = None
+        return
+    instance._stored_stock = Inventory.objects.filter(pk=instance.pk).values_list('current_stock', flat=True).first()
+
+
+@receiver(post_save, sender=Inventory)
+def record_stock_edit(sender, instance, created, raw=False, **kwargs):
+    # Stock set directly on the item (creation or an edit) rather than through a sale
+    if raw:
+        return
+    stored = instance.__dict__.pop('_stored_stock', None)
+    if created and instance.current_stock:
+        StockMovement.objects.create(inventory_item=instance, delta=instance.current_stock, reason='OPENING')
+    elif stored is not None and stored != instance.current_stock:
+        StockMovement.objects.create(inventory_item=instance, delta=instance.current_stock - stored,
+                                     reason='ADJUSTMENT')
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Inventory)
+def leave_tombstone(sender, instance, origin=None, **kwargs):
+    # A deleted business takes its whole catalog, and its clients, with it
+    if getattr(origin, 'model', type(origin)) is Business:
+        return
+    record_deletions(sender, [(instance.business_id, instance.pk)])
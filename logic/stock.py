@@ -0,0 +1,215 @@
+"""
+Stock engine: atomic stock changes, cart reservations and the movement ledger.
+
+Every change to Inventory.current_stock is a single UPDATE relative to the
+stored value, so parallel checkouts never overwrite each other, and is
+recorded as StockMovement rows in the same transaction; the sum of an
+item's movements is its current_stock. Reservations hold stock for carts
+that are not billed yet: reserved_stock counts the held units and is
+checked in the same UPDATE that takes them, and holds lapse after
+STOCK_RESERVATION_TTL seconds.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, ExpressionWrapper, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework import serializers
+
+from .jobs import enqueue, job
+from .models import Inventory, StockMovement, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+def collect_quantities(items_data):
+    """Sum the quantity of every inventory item across the lines of a bill"""
+    quantities = {}
+    for item_data in items_data:
+        inventory_id = item_data['inventory_item'].id
+        quantities[inventory_id] = quantities.get(inventory_id, 0) + item_data['quantity']
+    return quantities
+
+
+def _shifted(field, delta):
+    return ExpressionWrapper(F(field) + delta, output_field=IntegerField())
+
+
+def _not_enough_stock(pks):
+    names = Inventory.objects.filter(id__in=pks).values_list('name', flat=True)
+    return serializers.ValidationError(
+        {'items': [f"Not enough stock for {name}" for name in names] or ["Inventory item not found"]}
+    )
+
+
+def apply_stock_changes(deltas, reject_oversell=None, released=None, reason='SALE', bill=None):
+    """
+    Apply {inventory_id: delta} to Inventory.current_stock in a single UPDATE.
+
+    Negative deltas deduct stock. released maps inventory_id -> reserved units
+    this change consumes, which come off reserved_stock in the same UPDATE.
+    When oversell rejection is on, the update only touches rows whose stock
+    not held by other carts covers the sale, and a ValidationError is raised
+    if any row was skipped, so the caller's transaction rolls back. Otherwise
+    stock is floored at zero. The change is recorded as StockMovements.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    released = {pk: quantity for pk, quantity in (released or {}).items() if quantity}
+    pks = deltas.keys() | released.keys()
+    if not pks:
+        return 0
+
+    if reject_oversell is None:
+        reject_oversell = getattr(settings, 'BILL_REJECT_OVERSELL', False)
+
+    decrements = [pk for pk, delta in deltas.items() if delta < 0]
+    stored = {}
+    if decrements and not reject_oversell:
+        # Flooring can take less than asked, so read the stock under the row locks to record the real change
+        stored = dict(
+            Inventory.objects.select_for_update().filter(id__in=decrements).values_list('id', 'current_stock')
+        )
+
+    # Queryset updates skip auto_now, and catalog syncs must see the new stock
+    updates = {'updated_at': timezone.now()}
+    if deltas:
+        whens = []
+        for pk, delta in deltas.items():
+            if delta < 0 and not reject_oversell:
+                whens.append(When(id=pk, then=Greatest(_shifted('current_stock', delta), Value(0))))
+            else:
+                whens.append(When(id=pk, then=_shifted('current_stock', delta)))
+        updates['current_stock'] = Case(*whens, default=F('current_stock'), output_field=IntegerField())
+    if released:
+        updates['reserved_stock'] = Case(
+            *[When(id=pk, then=Greatest(_shifted('reserved_stock', -quantity), Value(0)))
+              for pk, quantity in released.items()],
+            default=F('reserved_stock'), output_field=IntegerField(),
+        )
+
+    queryset = Inventory.objects.filter(id__in=list(pks))
+    if decrements and reject_oversell:
+        # Rows without enough stock outside other carts' reservations fall out of the UPDATE
+        queryset = queryset.filter(current_stock__gte=Case(
+            *[When(id=pk, then=_shifted('reserved_stock', -deltas[pk] - released.get(pk, 0)))
+              for pk in decrements],
+            default=F('current_stock'), output_field=IntegerField(),
+        ))
+    updated = queryset.update(**updates)
+
+    if updated != len(pks):
+        # Only reached on failure, so the extra lookup never slows down a normal sale
+        short = Inventory.objects.filter(id__in=decrements).values_list('id', 'current_stock', 'reserved_stock')
+        raise _not_enough_stock([
+            pk for pk, stock, reserved in short if stock - reserved + released.get(pk, 0) < -deltas[pk]
+        ] or list(pks))
+
+    movements = []
+    for pk, delta in deltas.items():
+        if pk in stored:
+            delta = max(stored[pk] + delta, 0) - stored[pk]
+        if delta:
+            movements.append(StockMovement(inventory_item_id=pk, delta=delta, reason=reason, bill=bill))
+    StockMovement.objects.bulk_create(movements)
+
+    if decrements:
+        check_low_stock.delay(inventory_ids=decrements)
+    return updated
+
+
+def reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', 900)
+
+
+def reserve_stock(business, quantities, token=None, ttl=None):
+    """
+    Hold {inventory_id: quantity} of a business's stock for a cart, all or nothing.
+
+    Returns (token, expires_at); reserving again with the same token adds to the cart.
+    """
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    token = token or uuid.uuid4().hex
+    expires_at = timezone.now() + timedelta(seconds=ttl or reservation_ttl())
+    if not quantities:
+        return token, expires_at
+
+    with transaction.atomic():
+        # Holds that lapsed on these items no longer count against them
+        release_reservations(StockReservation.objects.filter(
+            inventory_item_id__in=list(quantities), expires_at__lte=timezone.now()
+        ))
+        updated = Inventory.objects.filter(business=business, id__in=list(quantities)).filter(
+            current_stock__gte=Case(
+                *[When(id=pk, then=_shifted('reserved_stock', quantity)) for pk, quantity in quantities.items()],
+                output_field=IntegerField(),
+            )
+        ).update(updated_at=timezone.now(), reserved_stock=Case(
+            *[When(id=pk, then=_shifted('reserved_stock', quantity)) for pk, quantity in quantities.items()],
+            default=F('reserved_stock'), output_field=IntegerField(),
+        ))
+        if updated != len(quantities):
+            available = Inventory.objects.filter(business=business, id__in=list(quantities)).values_list(
+                'id', 'current_stock', 'reserved_stock'
+            )
+            raise _not_enough_stock([
+                pk for pk, stock, reserved in available if stock - reserved < quantities[pk]
+            ] or list(quantities))
+
+        StockReservation.objects.filter(business=business, token=token).update(expires_at=expires_at)
+        StockReservation.objects.bulk_create([
+            StockReservation(business=business, token=token, inventory_item_id=pk, quantity=quantity,
+                             expires_at=expires_at)
+            for pk, quantity in quantities.items()
+        ])
+    enqueue(expire_reservations.job_name, {}, delay=(expires_at - timezone.now()).total_seconds() + 1)
+    return token, expires_at
+
+
+def release_reservations(reservations):
+    """Delete reservations and give their units back to available stock; returns {inventory_id: units}"""
+    with transaction.atomic():
+        rows = list(reservations.select_for_update().values_list('id', 'inventory_item_id', 'quantity'))
+        if not rows:
+            return {}
+        units = defaultdict(int)
+        for _, pk, quantity in rows:
+            units[pk] += quantity
+        StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+        Inventory.objects.filter(id__in=list(units)).update(updated_at=timezone.now(), reserved_stock=Case(
+            *[When(id=pk, then=Greatest(_shifted('reserved_stock', -quantity), Value(0)))
+              for pk, quantity in units.items()],
+            default=F('reserved_stock'), output_field=IntegerField(),
+        ))
+    return dict(units)
+
+
+def take_reservation(business, token):
+    """Remove a cart's reservations so a bill can consume them; returns {inventory_id: units}"""
+    rows = list(StockReservation.objects.select_for_update().filter(business=business, token=token)
+                .values_list('id', 'inventory_item_id', 'quantity'))
+    units = defaultdict(int)
+    for _, pk, quantity in rows:
+        units[pk] += quantity
+    if rows:
+        StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+    return dict(units)
+
+
+@job
+def expire_reservations():
+    """Release every reservation whose hold has lapsed"""
+    return release_reservations(StockReservation.objects.filter(expires_at__lte=timezone.now()))
+
+
+@job
+def check_low_stock(inventory_ids):
+    """Warn about items whose stock fell to LOW_STOCK_THRESHOLD or below"""
+    threshold = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+    low = Inventory.objects.filter(id__in=inventory_ids, current_stock__lte=threshold)
+    for pk, name, business_id, stock in low.values_list('id', 'name', 'business_id', 'current_stock'):
+        logger.warning('Low stock in business %s: %s (#%s) has %d left', business_id, name, pk, stock)
@@ -0,0 +1,194 @@
+"""
+Offline batch sync for POS terminals.
+
+A terminal that was offline pushes the bills and transactions it recorded as
+one ordered batch, each operation carrying a client-generated idempotency
+key. The batch is validated as a whole and written in one transaction, in
+the order it was recorded: each run of consecutive bills or transactions is
+bulk-inserted, and each bill's stock change is recorded against it. Keys
+applied before are answered with the ids they created instead of being
+applied again, so retrying after a lost response never duplicates a bill.
+The response also carries the inventory changed since the terminal's last
+sync cursor, a page of it at most (see logic.changes).
+"""
+from collections import defaultdict
+from decimal import Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .changes import change_version, changed_page, deleted_since, encode_position, parse_since, sync_cursor
+from .importers import BatchRelatedField, ImportBillSerializer, _ids, create_bills
+from .ledger import apply_balance_changes, transaction_amount
+from .models import Customer, IdempotencyKey, Inventory, Transaction
+from .reports import RollupDelta
+from .serializers import InventorySerializer, TransactionSerializer
+from .stock import apply_stock_changes, collect_quantities
+
+
+class SyncTransactionSerializer(TransactionSerializer):
+    customer = BatchRelatedField(queryset=Customer.objects.all())
+    created_at = serializers.DateTimeField(required=False)  # When the terminal recorded it
+
+    class Meta(TransactionSerializer.Meta):
+        fields = ['customer', 'amount', 'transaction_type', 'description', 'created_at']
+
+
+OPERATION_SERIALIZERS = {
+    'bill': ImportBillSerializer,
+    'transaction': SyncTransactionSerializer,
+}
+
+
+class SyncOperationSerializer(serializers.Serializer):
+    key = serializers.CharField(max_length=64)
+    type = serializers.ChoiceField(choices=list(OPERATION_SERIALIZERS))
+    data = serializers.DictField()
+
+
+class SyncBatchSerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False, allow_null=True)  # version from the previous sync
+    operations = SyncOperationSerializer(many=True)
+
+    def validate_cursor(self, value):
+        if value is None:
+            return None
+        cursor = parse_since(value)
+        if cursor is None:
+            raise serializers.ValidationError('Expected an ISO 8601 datetime or epoch seconds.')
+        return cursor
+
+    def validate_operations(self, value):
+        limit = getattr(settings, 'SYNC_MAX_OPERATIONS', 500)
+        if len(value) > limit:
+            raise serializers.ValidationError(f'At most {limit} operations per batch.')
+        return value
+
+
+def load_related(business, operations):
+    """{model: {pk: instance}} of the customers and items the operations refer to, one query each"""
+    # Malformed values are skipped here and reported by the serializers under their operation
+    customer_ids, inventory_ids = [], []
+    for operation in operations:
+        data = operation['data']
+        customer_ids.append(data.get('customer'))
+        items = data.get('items')
+        if isinstance(items, list):
+            inventory_ids += [item.get('inventory_item') for item in items if isinstance(item, dict)]
+    return {
+        Customer: Customer.objects.filter(business=business).in_bulk(_ids(customer_ids)),
+        Inventory: Inventory.objects.filter(business=business).in_bulk(_ids(inventory_ids)),
+    }
+
+
+def _restore_created_at(model, objects, rows):
+    # created_at is auto_now_add, so the terminal's times are written afterwards
+    dated = []
+    for obj, row in zip(objects, rows):
+        if row.get('created_at'):
+            obj.created_at = row['created_at']
+            dated.append(obj)
+    if dated:
+        model.objects.bulk_update(dated, ['created_at'])
+
+
+def create_transactions(business, rows):
+    transactions = Transaction.objects.bulk_create([
+        Transaction(business=business, **{field: value for field, value in row.items() if field != 'created_at'})
+        for row in rows
+    ])
+    _restore_created_at(Transaction, transactions, rows)
+
+    balances = defaultdict(Decimal)
+    activity = {}
+    for txn in transactions:
+        balances[txn.customer_id] += transaction_amount(txn.transaction_type, Decimal(str(txn.amount)))
+        activity[txn.customer_id] = max(activity.get(txn.customer_id, txn.created_at), txn.created_at)
+    apply_balance_changes(balances, activity)
+    return transactions
+
+
+def known_keys(business, keys):
+    return dict(IdempotencyKey.objects.filter(business=business, key__in=keys).values_list('key', 'object_id'))
+
+
+def apply_batch(business, operations, cursor=None):
+    """
+    Apply validated SyncOperationSerializer data in order.
+
+    Returns the server id of every operation, whether it was a replay, the
+    inventory changed since cursor and the cursor for the next sync. Raises
+    ValidationError with the errors of each invalid operation by index, in
+    which case nothing is written.
+    """
+    # Replays are answered from their keys and need no validation
+    replayed = known_keys(business, [operation['key'] for operation in operations])
+    context = {'related': load_related(business, [op for op in operations if op['key'] not in replayed])}
+    validated, errors, seen = [], {}, set(replayed)
+    for index, operation in enumerate(operations):
+        if operation['key'] in seen:
+            continue  # Applied before, or earlier in this batch
+        seen.add(operation['key'])
+        serializer = OPERATION_SERIALIZERS[operation['type']](data=operation['data'], context=context)
+        if serializer.is_valid():
+            validated.append((operation, serializer.validated_data))
+        else:
+            errors[index] = serializer.errors
+    if errors:
+        raise serializers.ValidationError({'operations': errors})
+
+    with transaction.atomic():
+        # A concurrent sync of the same batch may have committed since the first look
+        replayed.update(known_keys(business, [operation['key'] for operation, _ in validated]))
+        validated = [(operation, row) for operation, row in validated if operation['key'] not in replayed]
+
+        # Runs of consecutive operations of one type are bulk-inserted together, so the
+        # batch is applied in the order the terminal recorded it
+        created, rollup = {}, RollupDelta()
+        for kind, run in groupby(validated, key=lambda pair: pair[0]['type']):
+            run = list(run)
+            rows = [row for _, row in run]
+            if kind == 'bill':
+                bills, delta = create_bills(business, rows)
+                for bill, row in zip(bills, rows):
+                    apply_stock_changes(
+                        {pk: -quantity for pk, quantity in collect_quantities(row['items']).items()}, bill=bill,
+                    )
+                rollup.merge(delta)
+                objects = bills
+            else:
+                objects = create_transactions(business, rows)
+            created.update({operation['key']: obj.id for (operation, _), obj in zip(run, objects)})
+        rollup.enqueue()
+
+        # A unique constraint violation here means a concurrent sync won the race; the batch rolls back
+        IdempotencyKey.objects.bulk_create([
+            IdempotencyKey(business=business, key=operation['key'], kind=operation['type'],
+                           object_id=created[operation['key']])
+            for operation, _ in validated
+        ])
+
+        version = sync_cursor(change_version(Inventory, business), timezone.now())
+        inventory = None
+        if cursor is not None:
+            changed, more = changed_page(Inventory.objects.filter(business=business), cursor)
+            inventory = {
+                'changed': InventorySerializer(changed, many=True).data,
+                'deleted': deleted_since(Inventory, business, cursor),
+                # The rest of a long delta: GET /api/inventories/?since=<cursor>&after=<after>
+                'after': encode_position(changed[-1], version) if more else None,
+            }
+
+    ids = {**replayed, **created}
+    return {
+        'results': [
+            {'key': operation['key'], 'type': operation['type'], 'id': ids[operation['key']],
+             'replayed': operation['key'] in replayed}
+            for operation in operations
+        ],
+        'inventory': inventory,
+        'cursor': version,
+    }
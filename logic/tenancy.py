@@ -0,0 +1,81 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Business, Staff
+from .routers import use_primary
+
+# The business a user works in and how: role is 'owner', 'staff' or None. Staff
+# also carry their Role's id, version and permission list for logic.permissions.
+Membership = namedtuple(
+    'Membership', ['business', 'role', 'staff_role_id', 'role_version', 'role_permissions'], defaults=[None, ()]
+)
+
+NO_MEMBERSHIP = Membership(None, None, None)
+
+
+def _cache_key(user_id):
+    return f'logic:membership:{user_id}'
+
+
+def _staff_membership(staff):
+    role = staff.role
+    if role is None:
+        return Membership(staff.business, 'staff', None)
+    return Membership(staff.business, 'staff', role.id, role.version, tuple(role.permissions or ()))
+
+
+def _load_membership(user):
+    # From the primary: the result is cached, so a replica yet to receive a new
+    # business or staff row would leave the user without one for the whole timeout
+    with use_primary():
+        business = Business.objects.filter(owner=user).first()
+        if business is not None:
+            return Membership(business, 'owner', None)
+        staff = Staff.objects.select_related('business', 'role').filter(user=user).first()
+    if staff is not None:
+        return _staff_membership(staff)
+    return NO_MEMBERSHIP
+
+
+def resolve_membership(user):
+    """Return the user's Membership, served from the cache after the first lookup"""
+    if user is None or not user.is_authenticated:
+        return NO_MEMBERSHIP
+
+    key = _cache_key(user.pk)
+    membership = cache.get(key)
+    if membership is None:
+        membership = _load_membership(user)
+        cache.set(key, membership, getattr(settings, 'MEMBERSHIP_CACHE_TIMEOUT', 300))
+    return membership
+
+
+async def _aload_membership(user):
+    with use_primary():
+        business = await Business.objects.filter(owner=user).afirst()
+        if business is not None:
+            return Membership(business, 'owner', None)
+        staff = await Staff.objects.select_related('business', 'role').filter(user=user).afirst()
+    if staff is not None:
+        return _staff_membership(staff)
+    return NO_MEMBERSHIP
+
+
+async def aresolve_membership(user):
+    """resolve_membership for async views"""
+    if user is None or not user.is_authenticated:
+        return NO_MEMBERSHIP
+
+    key = _cache_key(user.pk)
+    membership = await cache.aget(key)
+    if membership is None:
+        membership = await _aload_membership(user)
+        await cache.aset(key, membership, getattr(settings, 'MEMBERSHIP_CACHE_TIMEOUT', 300))
+    return membership
+
+
+def invalidate_memberships(user_ids):
+    """Drop cached memberships, called whenever a Business, Staff or Role row changes"""
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -1,3 +1,1622 @@
-from django.test import TestCase
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from contextlib import closing, contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, router, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .async_views import async_urlconf
+from .attachments import Image
+from .authentication import TokenCache, token_cache
+from .jobs import Worker, job, queue_stats, work_off
+from .metrics import LATENCY_BUCKETS_MS, EndpointStats, registry
+from .middleware import ReplicaMiddleware
+from .models import Business, Customer, Inventory, Bill, BillItem, Transaction, Staff, DailySales, DailyItemSales, \
+    Job, DeadJob, StockMovement, StockReservation, IdempotencyKey, Role
+from .permissions import compile_permissions, compiled_permissions
+from .routers import replica_reads, use_primary
+from .tenancy import resolve_membership
+from .views import BillViewSet, InventoryViewSet
+
+
+class StoreTestCase(TestCase):
+    """Common fixture: an owner with a business, a customer and a few inventory items"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='secret123')
+        self.business = Business.objects.create(name='Store', address='Main Road', owner=self.owner)
+        self.customer = Customer.objects.create(name='Asha', phone='9999999999', business=self.business)
+        self.items = [
+            Inventory.objects.create(name=f'Item {i}', price=Decimal('10.00'), current_stock=100, business=self.business)
+            for i in range(5)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        # Warm the membership cache so query counts only cover the endpoint's own work
+        resolve_membership(self.owner)
+
+    @contextmanager
+    def running_jobs(self):
+        """Commit the block's on_commit hooks, which queue jobs, then run the queue"""
+        with self.captureOnCommitCallbacks(execute=True):
+            yield
+        work_off()
+
+    def bill_payload(self, lines, quantity=1):
+        return {
+            'customer': self.customer.id,
+            'total_amount': '10.00',
+            'payment_mode': 'CASH',
+            'items': [
+                {'inventory_item': item.id, 'quantity': quantity, 'price': '10.00'}
+                for item in lines
+            ],
+        }
+
+
+class BillCreateTests(StoreTestCase):
+
+    def test_create_deducts_stock_and_inserts_items(self):
+        response = self.client.post('/api/bills/', self.bill_payload(self.items[:3], quantity=4), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(BillItem.objects.filter(bill_id=response.data['id']).count(), 3)
+        self.assertEqual(
+            list(Inventory.objects.order_by('id').values_list('current_stock', flat=True)),
+            [96, 96, 96, 100, 100],
+        )
+
+    def test_repeated_lines_are_summed(self):
+        payload = self.bill_payload([self.items[0], self.items[0]], quantity=3)
+        response = self.client.post('/api/bills/', payload, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].current_stock, 94)
+
+    def test_write_queries_do_not_grow_with_lines(self):
+        from .serializers import BillSerializer
+
+        def save_queries(lines):
+            serializer = BillSerializer(data=self.bill_payload(lines))
+            serializer.is_valid(raise_exception=True)
+            # Only the core writes plus the stock ledger: rollups and low-stock checks are queued after commit
+            with self.assertNumQueries(8):
+                serializer.save()
+
+        save_queries(self.items[:1])
+        save_queries(self.items[1:])
+
+    def test_oversell_floors_stock_at_zero_by_default(self):
+        response = self.client.post('/api/bills/', self.bill_payload(self.items[:1], quantity=150), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].current_stock, 0)
+
+    @override_settings(BILL_REJECT_OVERSELL=True)
+    def test_oversell_rejected_when_enabled(self):
+        payload = self.bill_payload(self.items[:2], quantity=60)
+        payload['items'][1]['quantity'] = 150
+        response = self.client.post('/api/bills/', payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Item 1', str(response.data))
+        self.assertFalse(Bill.objects.exists())
+        self.assertEqual(set(Inventory.objects.values_list('current_stock', flat=True)), {100})
+
+
+class BillUpdateTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/bills/', self.bill_payload(self.items[:3], quantity=2), format='json')
+        self.bill_id = response.data['id']
+        self.original_rows = dict(BillItem.objects.values_list('inventory_item_id', 'id'))
+
+    def stock(self):
+        return list(Inventory.objects.order_by('id').values_list('current_stock', flat=True))
+
+    def test_only_changed_rows_are_written(self):
+        payload = self.bill_payload(self.items[1:4], quantity=2)
+        payload['items'][1]['quantity'] = 5
+
+        with self.assertLogs('logic.serializers', 'INFO') as logs:
+            response = self.client.put(f'/api/bills/{self.bill_id}/', payload, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('1 inserted, 1 updated, 1 deleted', logs.output[0])
+        rows = dict(BillItem.objects.values_list('inventory_item_id', 'id'))
+        # Untouched and edited lines keep their primary keys
+        self.assertEqual(rows[self.items[1].id], self.original_rows[self.items[1].id])
+        self.assertEqual(rows[self.items[2].id], self.original_rows[self.items[2].id])
+        self.assertNotIn(self.items[0].id, rows)
+
+    def test_stock_moves_by_net_change(self):
+        payload = self.bill_payload(self.items[1:4], quantity=2)
+        payload['items'][1]['quantity'] = 5
+        with self.assertLogs('logic.serializers', 'INFO'):
+            self.client.put(f'/api/bills/{self.bill_id}/', payload, format='json')
+
+        # Item 0 removed (+2 back), item 2 went from 2 to 5 (-3), item 3 added (-2)
+        self.assertEqual(self.stock(), [100, 98, 95, 98, 100])
+
+    def test_partial_update_without_items_keeps_lines(self):
+        response = self.client.patch(f'/api/bills/{self.bill_id}/', {'payment_mode': 'UPI'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(BillItem.objects.filter(bill_id=self.bill_id).count(), 3)
+        self.assertEqual(self.stock(), [98, 98, 98, 100, 100])
+
+
+class PaginationTests(StoreTestCase):
+
+    def add_rows(self, count):
+        Customer.objects.bulk_create([
+            Customer(name=f'Customer {i}', phone='1', business=self.business) for i in range(count)
+        ])
+        Inventory.objects.bulk_create([
+            Inventory(name=f'Bulk {i}', price=Decimal('1.00'), business=self.business) for i in range(count)
+        ])
+        Transaction.objects.bulk_create([
+            Transaction(customer=self.customer, business=self.business, amount=Decimal('1.00'), transaction_type='CREDIT') for _ in range(count)
+        ])
+
+    def assert_page_queries(self, url, expected):
+        with self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_page_query_count_is_independent_of_table_size(self):
+        # Catalog lists also look up their change version for the ETag
+        endpoints = {'customers': 2, 'inventories': 2, 'transactions': 1}
+        for endpoint, queries in endpoints.items():
+            self.assert_page_queries(f'/api/{endpoint}/?page_size=10', queries)
+        self.add_rows(300)
+        for endpoint, queries in endpoints.items():
+            page = self.assert_page_queries(f'/api/{endpoint}/?page_size=10', queries)
+            self.assertEqual(len(page['results']), 10)
+            # A deep page costs the same as the first one
+            for _ in range(5):
+                page = self.assert_page_queries(page['next'], queries)
+
+    def test_pages_walk_every_row_once(self):
+        self.add_rows(120)
+        seen = []
+        url = '/api/customers/?page_size=50'
+        while url:
+            page = self.client.get(url).data
+            seen.extend(row['id'] for row in page['results'])
+            url = page['next']
+        self.assertEqual(sorted(seen), sorted(Customer.objects.values_list('id', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_page_size_is_capped(self):
+        self.add_rows(600)
+        page = self.client.get('/api/customers/?page_size=10000').data
+        self.assertEqual(len(page['results']), 500)
+
+
+class BillListQueryTests(StoreTestCase):
+
+    def add_bills(self, count):
+        bills = Bill.objects.bulk_create([
+            Bill(customer=self.customer, business=self.business, total_amount=Decimal('20.00'), payment_mode='CASH') for _ in range(count)
+        ])
+        BillItem.objects.bulk_create([
+            BillItem(bill=bill, inventory_item=item, quantity=2, price=item.price)
+            for bill in bills for item in self.items[:2]
+        ])
+
+    def test_list_query_count_is_constant(self):
+        total = 0
+        for count in [1, 100, 1000]:
+            self.add_bills(count - total)
+            total = count
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/bills/?page_size=500&expand=items')
+            self.assertEqual(len(response.data['results']), min(count, 500))
+
+    def test_retrieve_query_count(self):
+        self.add_bills(1)
+        bill = Bill.objects.get()
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/bills/{bill.id}/?expand=items')
+        self.assertEqual(response.status_code, 200)
+
+    def test_expanded_items(self):
+        self.add_bills(1)
+        compact = self.client.get('/api/bills/').data['results'][0]['items'][0]
+        expanded = self.client.get('/api/bills/?expand=items').data['results'][0]['items'][0]
+
+        self.assertEqual(set(compact), {'inventory_item', 'quantity', 'price'})
+        self.assertEqual(expanded['item_name'], 'Item 0')
+        self.assertEqual(expanded['line_total'], '20.00')
+
+
+class MembershipTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clerk = User.objects.create_user(username='clerk', password='secret123')
+        role = Role.objects.create(business=self.business, name='Clerk', permissions=['customer.view'])
+        Staff.objects.create(user=self.clerk, business=self.business, role=role)
+
+    def test_staff_see_their_business(self):
+        self.client.force_authenticate(self.clerk)
+        response = self.client.get('/api/customers/')
+
+        self.assertEqual([row['id'] for row in response.data['results']], [self.customer.id])
+        self.assertEqual(self.client.get('/api/current-user/').data['business']['id'], self.business.id)
+
+    def test_membership_is_cached_across_requests(self):
+        self.client.force_authenticate(self.clerk)
+        with self.assertNumQueries(4):
+            # Owner lookup, staff lookup, the catalog's change version, then the page itself
+            self.client.get('/api/customers/')
+        with self.assertNumQueries(2):
+            self.client.get('/api/customers/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/current-user/')
+
+    def test_cache_invalidated_when_staff_removed(self):
+        self.client.force_authenticate(self.clerk)
+        self.client.get('/api/customers/')
+        Staff.objects.filter(user=self.clerk).delete()
+
+        self.assertEqual(self.client.get('/api/customers/').status_code, 403)
+        self.assertIsNone(self.client.get('/api/current-user/').data['business'])
+
+    def test_user_without_business(self):
+        stranger = User.objects.create_user(username='stranger', password='secret123')
+        self.client.force_authenticate(stranger)
+
+        self.assertEqual(self.client.get('/api/bills/').status_code, 403)
+        self.assertEqual(self.client.get('/api/businesses/').status_code, 403)
+        self.assertIsNone(self.client.get('/api/current-user/').data['business'])
+
+
+class RolePermissionTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        compiled_permissions.clear()
+        self.role = Role.objects.create(business=self.business, name='Cashier', permissions=['staff.view'])
+        self.clerk = User.objects.create_user(username='clerk', password='secret123')
+        self.staff = Staff.objects.create(user=self.clerk, business=self.business, role=self.role)
+
+    def test_compile_expands_wildcards(self):
+        self.assertEqual(
+            compile_permissions(['role.*', 'staff.view', 7]),
+            {'role.view', 'role.add', 'role.change', 'role.delete', 'staff.view'},
+        )
+
+    def test_owner_manages_roles_of_their_business(self):
+        Role.objects.create(business=Business.objects.create(name='Other', owner=self.clerk), name='Elsewhere')
+        response = self.client.post('/api/roles/', {'name': 'Manager', 'permissions': ['*']}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Role.objects.get(id=response.data['id']).business, self.business)
+        self.assertEqual(
+            sorted(row['name'] for row in self.client.get('/api/roles/').data['results']), ['Cashier', 'Manager']
+        )
+
+    def test_staff_need_the_actions_permission(self):
+        self.client.force_authenticate(self.clerk)
+
+        self.assertEqual(self.client.get('/api/staff/').status_code, 200)
+        self.assertEqual(self.client.get('/api/roles/').status_code, 403)
+        self.assertEqual(self.client.delete(f'/api/staff/{self.staff.id}/').status_code, 403)
+
+        Staff.objects.filter(id=self.staff.id).update(role=None)
+        Staff.objects.get(id=self.staff.id).save()  # Fires the signal that drops the cached membership
+        self.assertEqual(self.client.get('/api/staff/').status_code, 403)
+
+    def test_a_read_only_role_is_denied_writes(self):
+        self.role.permissions = ['bill.view', 'inventory.view']
+        self.role.save()
+        self.client.force_authenticate(self.clerk)
+
+        self.assertEqual(self.client.get('/api/bills/').status_code, 200)
+        self.assertEqual(self.client.get(f'/api/inventories/{self.items[0].id}/').status_code, 200)
+        self.assertEqual(self.client.post('/api/bills/', self.bill_payload(self.items[:1]), format='json').status_code,
+                         403)
+        self.assertEqual(self.client.delete(f'/api/inventories/{self.items[0].id}/').status_code, 403)
+        self.assertEqual(self.client.get('/api/customers/').status_code, 403)
+        self.assertEqual(self.client.get('/api/reports/').status_code, 403)
+        self.assertEqual(self.client.post('/api/sync/', {'operations': []}, format='json').status_code, 403)
+        self.assertEqual(self.client.post('/api/reservations/', {'items': []}, format='json').status_code, 403)
+        self.assertFalse(Bill.objects.exists())
+        self.assertTrue(Inventory.objects.filter(id=self.items[0].id).exists())
+
+        # Registering a business of one's own needs no role
+        newcomer = User.objects.create_user(username='newcomer')
+        self.client.force_authenticate(newcomer)
+        response = self.client.post('/api/businesses/', {'name': 'New Shop', 'address': 'Lane 2', 'owner': newcomer.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_checks_reuse_the_compiled_set(self):
+        self.client.force_authenticate(self.clerk)
+        self.client.get('/api/staff/')
+        with self.assertNumQueries(1):
+            self.client.get('/api/staff/')
+
+        self.assertEqual((compiled_permissions.compiles, compiled_permissions.hits), (1, 1))
+
+    def test_saving_a_role_retires_its_compiled_set(self):
+        self.client.force_authenticate(self.clerk)
+        self.assertEqual(self.client.get('/api/roles/').status_code, 403)
+
+        self.role.permissions = ['role.view']
+        self.role.save()
+        self.assertEqual(self.role.version, 2)
+        self.assertEqual(self.client.get('/api/roles/').status_code, 200)
+        self.assertEqual(self.client.get('/api/staff/').status_code, 403)
+        self.assertEqual(compiled_permissions.compiles, 2)
+
+    def test_concurrent_role_edits_get_their_own_versions(self):
+        first, second = Role.objects.get(pk=self.role.pk), Role.objects.get(pk=self.role.pk)
+        first.permissions = ['role.view']
+        first.save()
+        second.permissions = ['bill.view']
+        second.save(update_fields=['permissions'])
+
+        self.assertEqual((first.version, second.version), (2, 3))
+        self.role.refresh_from_db()
+        self.assertEqual((self.role.version, self.role.permissions), (3, ['bill.view']))
+
+    def test_staff_cannot_get_another_business_role(self):
+        other = Role.objects.create(
+            business=Business.objects.create(name='Other', owner=User.objects.create_user(username='rival')),
+            name='Admin', permissions=['*'],
+        )
+        response = self.client.patch(f'/api/staff/{self.staff.id}/', {'role': other.id}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('role', response.data)
+
+    def test_role_validation_without_a_business(self):
+        from types import SimpleNamespace
+        from .serializers import StaffSerializer
+
+        request = SimpleNamespace(membership=resolve_membership(User.objects.create_user(username='loner')))
+        serializer = StaffSerializer(self.staff, data={'role': self.role.id}, partial=True, context={'request': request})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('role', serializer.errors)
+
+
+class TokenCacheTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.owner)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_is_cached(self):
+        with self.assertNumQueries(3):
+            # Token lookup, the catalog's change version, then the page
+            self.client.get('/api/customers/')
+        with self.assertNumQueries(2):
+            self.client.get('/api/customers/')
+        self.assertEqual(token_cache.stats()['hits'], 1)
+        self.assertEqual(token_cache.stats()['misses'], 1)
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get('/api/customers/')
+        self.token.delete()
+
+        self.assertEqual(self.client.get('/api/customers/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/customers/')
+        self.owner.is_active = False
+        self.owner.save()
+
+        self.assertEqual(self.client.get('/api/customers/').status_code, 401)
+
+    def test_lru_is_bounded(self):
+        lru = TokenCache(max_size=2, ttl=60)
+        for key in 'abc':
+            lru.set(key, (self.owner, key))
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.get('c'), (self.owner, 'c'))
+        self.assertEqual(lru.stats()['evictions'], 1)
+
+    def test_expired_entries_are_dropped(self):
+        lru = TokenCache(max_size=2, ttl=-1)
+        lru.set('a', (self.owner, 'a'))
+        self.assertIsNone(lru.get('a'))
+
+
+class ItemSearchTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.palak = Inventory.objects.create(name='Paalak Bunch', price=Decimal('20.00'), business=self.business)
+        self.paneer = Inventory.objects.create(
+            name='Paneer', description='Goes well with paalak', price=Decimal('80.00'), business=self.business
+        )
+        self.palak_bill = self.client.post('/api/bills/', self.bill_payload([self.palak]), format='json').data['id']
+        self.paneer_bill = self.client.post('/api/bills/', self.bill_payload([self.paneer]), format='json').data['id']
+        self.client.post('/api/bills/', self.bill_payload(self.items[:2]), format='json')
+
+    def bill_ids(self, query):
+        response = self.client.get('/api/bills/', {'item_name': query})
+        return sorted(row['id'] for row in response.data['results'])
+
+    def test_bill_filter_by_item(self):
+        self.assertEqual(self.bill_ids('paal'), [self.palak_bill, self.paneer_bill])
+        self.assertEqual(self.bill_ids('paneer'), [self.paneer_bill])
+        self.assertEqual(self.bill_ids('  '), [])
+
+    def test_bill_filter_matches_inside_names(self):
+        self.assertEqual(self.bill_ids('alak'), [self.palak_bill])
+        self.assertEqual(self.bill_ids('ALAK B'), [self.palak_bill])
+        self.assertEqual(self.client.get('/api/inventories/search/', {'q': 'alak'}).data, [])
+
+    def test_bill_filter_matches_names_without_words(self):
+        dal = Inventory.objects.create(name='Dal - 100%', price=Decimal('5.00'), business=self.business)
+        dal_bill = self.client.post('/api/bills/', self.bill_payload([dal]), format='json').data['id']
+        self.assertEqual(self.bill_ids('-'), [dal_bill])
+        self.assertEqual(self.bill_ids('%'), [dal_bill])
+        self.assertEqual(self.bill_ids('_'), [])
+
+    def test_name_matches_rank_first(self):
+        response = self.client.get('/api/inventories/search/', {'q': 'paalak'})
+        self.assertEqual([row['id'] for row in response.data], [self.palak.id, self.paneer.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.palak.name = 'Spinach'
+        self.palak.save()
+        self.assertEqual(self.bill_ids('spinach'), [self.palak_bill])
+        self.assertEqual(self.bill_ids('bunch'), [])
+
+        Inventory.objects.bulk_create([Inventory(name='Spinach Leaves', price=Decimal('5.00'), business=self.business)])
+        self.assertEqual(len(self.client.get('/api/inventories/search/', {'q': 'spin'}).data), 2)
+
+        self.paneer.delete()
+        self.assertEqual(self.client.get('/api/inventories/search/', {'q': 'paneer'}).data, [])
+
+    def test_other_businesses_are_not_searched(self):
+        other_owner = User.objects.create_user(username='other', password='secret123')
+        other = Business.objects.create(name='Other', address='Elsewhere', owner=other_owner)
+        Inventory.objects.create(name='Paalak', price=Decimal('1.00'), business=other)
+
+        response = self.client.get('/api/inventories/search/', {'q': 'paalak'})
+        self.assertEqual(len(response.data), 2)
+
+    def test_portable_fallback(self):
+        with mock.patch('logic.search.search_index_available', return_value=False):
+            self.assertEqual(self.bill_ids('aala'), [self.palak_bill, self.paneer_bill])
+            response = self.client.get('/api/inventories/search/', {'q': 'paalak'})
+        self.assertEqual([row['id'] for row in response.data], [self.palak.id, self.paneer.id])
+
+
+class QueryPlanTests(StoreTestCase):
+    """Fail if a hot tenant-filtered path falls back to scanning a whole table"""
+
+    HOT_TABLES = ['logic_bill', 'logic_transaction', 'logic_billitem', 'logic_customer', 'logic_inventory']
+
+    def assert_no_full_scans(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertTrue(captured.captured_queries)
+        with connection.cursor() as cursor:
+            for query in captured.captured_queries:
+                plan = [row[3] for row in cursor.execute('EXPLAIN QUERY PLAN ' + query['sql']).fetchall()]
+                for step in plan:
+                    # Pages must come straight off an index in cursor order; only the
+                    # search ranking query is allowed to sort its (few) matches
+                    if 'logic_inventory_fts' not in query['sql']:
+                        self.assertNotIn('TEMP B-TREE FOR ORDER BY', step, f'{url} sorts rows: {plan}')
+                    for table in self.HOT_TABLES:
+                        self.assertFalse(
+                            step == f'SCAN {table}' or step.startswith(f'SCAN {table} '),
+                            f'{url} scans {table}: {plan}\n{query["sql"]}',
+                        )
+
+    def test_bill_paths_use_indexes(self):
+        self.client.post('/api/bills/', self.bill_payload(self.items[:2]), format='json')
+        self.assert_no_full_scans('/api/bills/')
+        self.assert_no_full_scans('/api/bills/?start_date=2020-01-01&end_date=2100-01-01')
+        self.assert_no_full_scans(f'/api/bills/?customer={self.customer.id}')
+        self.assert_no_full_scans('/api/bills/?item_name=item')
+
+    def test_tenant_list_paths_use_indexes(self):
+        Transaction.objects.create(customer=self.customer, amount=Decimal('5.00'), transaction_type='CREDIT')
+        for endpoint in ['transactions', 'customers', 'inventories']:
+            self.assert_no_full_scans(f'/api/{endpoint}/')
+        self.assert_no_full_scans('/api/inventories/?since=0')
+
+    def test_business_is_denormalised(self):
+        bill_id = self.client.post('/api/bills/', self.bill_payload(self.items[:1]), format='json').data['id']
+        transaction = Transaction.objects.create(customer=self.customer, amount=Decimal('5.00'), transaction_type='DEBIT')
+
+        self.assertEqual(Bill.objects.get(id=bill_id).business_id, self.business.id)
+        self.assertEqual(transaction.business_id, self.business.id)
+
+
+class LedgerTests(StoreTestCase):
+
+    def balance(self, customer=None):
+        customer = customer or self.customer
+        customer.refresh_from_db()
+        return customer.balance
+
+    def test_bills_and_transactions_move_the_balance(self):
+        bill_id = self.client.post('/api/bills/', self.bill_payload(self.items[:1]), format='json').data['id']
+        self.assertEqual(self.balance(), Decimal('10.00'))
+
+        credit = Transaction.objects.create(customer=self.customer, amount=Decimal('5.50'), transaction_type='CREDIT')
+        debit = Transaction.objects.create(customer=self.customer, amount=Decimal('12.00'), transaction_type='DEBIT')
+        self.assertEqual(self.balance(), Decimal('3.50'))
+        self.assertEqual(self.customer.last_activity_at, debit.created_at)
+
+        debit.transaction_type = 'CREDIT'
+        debit.save()
+        self.assertEqual(self.balance(), Decimal('27.50'))
+
+        self.client.patch(f'/api/bills/{bill_id}/', {'total_amount': '30.00'}, format='json')
+        self.assertEqual(self.balance(), Decimal('47.50'))
+
+        debit.delete()
+        self.assertEqual(self.balance(), Decimal('35.50'))
+        self.assertEqual(self.customer.last_activity_at, credit.created_at)
+
+    def test_moving_a_transaction_between_customers(self):
+        other = Customer.objects.create(name='Ravi', phone='1', business=self.business)
+        transaction = Transaction.objects.create(customer=self.customer, amount=Decimal('8.00'), transaction_type='CREDIT')
+        transaction.customer = other
+        transaction.save()
+
+        self.assertEqual(self.balance(), Decimal('0.00'))
+        self.assertEqual(self.balance(other), Decimal('8.00'))
+
+    def test_rebuild_command_verifies_and_fixes(self):
+        Transaction.objects.create(customer=self.customer, amount=Decimal('8.00'), transaction_type='CREDIT')
+        call_command('rebuild_ledger', '--verify', stdout=StringIO())
+
+        Customer.objects.filter(id=self.customer.id).update(balance=Decimal('999.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ledger', '--verify', stdout=StringIO())
+
+        call_command('rebuild_ledger', '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(self.balance(), Decimal('8.00'))
+
+    def test_customers_sortable_and_filterable_by_balance(self):
+        low = Customer.objects.create(name='Low', phone='1', business=self.business)
+        high = Customer.objects.create(name='High', phone='1', business=self.business)
+        Transaction.objects.create(customer=low, amount=Decimal('5.00'), transaction_type='CREDIT')
+        Transaction.objects.create(customer=high, amount=Decimal('500.00'), transaction_type='CREDIT')
+
+        response = self.client.get('/api/customers/', {'ordering': '-balance'})
+        self.assertEqual([row['id'] for row in response.data['results']], [high.id, low.id, self.customer.id])
+        self.assertEqual(response.data['results'][0]['balance'], '500.00')
+
+        response = self.client.get('/api/customers/', {'min_balance': '1', 'max_balance': '100'})
+        self.assertEqual([row['id'] for row in response.data['results']], [low.id])
+
+
+class ReportTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Ravi', phone='1', business=self.business)
+        self.post_bill(self.customer, 'CASH', [(self.items[0], 2), (self.items[1], 1)], '30.00')
+        self.post_bill(self.other, 'UPI', [(self.items[0], 1)], '10.00')
+
+    def post_bill(self, customer, mode, lines, total):
+        payload = {
+            'customer': customer.id,
+            'total_amount': total,
+            'payment_mode': mode,
+            'items': [{'inventory_item': item.id, 'quantity': quantity, 'price': '10.00'} for item, quantity in lines],
+        }
+        with self.running_jobs():
+            return self.client.post('/api/bills/', payload, format='json').data['id']
+
+    def report(self):
+        response = self.client.get('/api/reports/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_report_from_rollups(self):
+        report = self.report()
+
+        self.assertEqual(report['totals'], {'bill_count': 2, 'revenue': Decimal('40.00')})
+        self.assertEqual([(row['payment_mode'], row['revenue']) for row in report['by_payment_mode']],
+                         [('CASH', Decimal('30.00')), ('UPI', Decimal('10.00'))])
+        self.assertEqual([row['name'] for row in report['top_customers']], ['Asha', 'Ravi'])
+        self.assertEqual([(row['name'], row['quantity']) for row in report['top_items']],
+                         [('Item 0', 3), ('Item 1', 1)])
+
+    def test_rollups_follow_updates_and_deletes(self):
+        bill_id = Bill.objects.get(customer=self.other).id
+        payload = {
+            'customer': self.other.id, 'total_amount': '50.00', 'payment_mode': 'CARD',
+            'items': [{'inventory_item': self.items[2].id, 'quantity': 5, 'price': '10.00'}],
+        }
+        with self.assertLogs('logic.serializers', 'INFO'), self.running_jobs():
+            self.client.put(f'/api/bills/{bill_id}/', payload, format='json')
+
+        report = self.report()
+        self.assertEqual(report['totals']['revenue'], Decimal('80.00'))
+        self.assertEqual({row['payment_mode'] for row in report['by_payment_mode'] if row['bill_count']},
+                         {'CASH', 'CARD'})
+        self.assertEqual({row['name']: row['quantity'] for row in report['top_items']},
+                         {'Item 2': 5, 'Item 0': 2, 'Item 1': 1})
+
+        with self.running_jobs():
+            self.client.delete(f'/api/bills/{bill_id}/')
+        self.assertEqual(self.report()['totals'], {'bill_count': 1, 'revenue': Decimal('30.00')})
+
+    def test_deleting_a_customer_takes_their_bills_out_of_the_rollups(self):
+        with self.running_jobs():
+            self.other.delete()
+
+        self.assertFalse(DeadJob.objects.exists())
+        self.assertFalse(Job.objects.exists())
+        self.assertFalse(DailySales.objects.filter(customer_id=self.other.id).exists())
+        self.assertEqual(dict(DailyItemSales.objects.values_list('inventory_item__name', 'quantity')),
+                         {'Item 0': 2, 'Item 1': 1})
+
+    def test_rebuild_matches_incremental_rollups(self):
+        from .reports import rebuild_rollups
+
+        incremental = sorted(DailySales.objects.values_list('customer_id', 'payment_mode', 'bill_count', 'revenue'))
+        items = sorted(DailyItemSales.objects.values_list('inventory_item_id', 'quantity', 'revenue'))
+        rebuild_rollups()
+
+        self.assertEqual(sorted(DailySales.objects.values_list('customer_id', 'payment_mode', 'bill_count', 'revenue')),
+                         incremental)
+        self.assertEqual(sorted(DailyItemSales.objects.values_list('inventory_item_id', 'quantity', 'revenue')), items)
+
+    def test_date_range(self):
+        response = self.client.get('/api/reports/', {'start_date': '2000-01-01', 'end_date': '2000-12-31'})
+        self.assertEqual(response.data['totals']['bill_count'], 0)
+        self.assertEqual(self.client.get('/api/reports/', {'start_date': 'yesterday'}).status_code, 400)
+
+
+class ExportTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Customer.objects.create(name='Ravi', phone='1', business=self.business)
+        for customer, lines in [(self.customer, self.items[:2]), (self.other, self.items[2:3]), (self.customer, [])]:
+            self.client.post('/api/bills/', dict(self.bill_payload(lines), customer=customer.id), format='json')
+        Transaction.objects.create(customer=self.customer, amount=Decimal('15.00'), transaction_type='DEBIT')
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_bills_csv_has_a_line_per_item(self):
+        rows = list(csv.DictReader(StringIO(self.export('/api/bills/export/', output='csv'))))
+
+        self.assertEqual([(row['customer_name'], row['item_name']) for row in rows],
+                         [('Asha', 'Item 0'), ('Asha', 'Item 1'), ('Ravi', 'Item 2'), ('Asha', '')])
+
+    def test_bills_jsonl_honours_filters(self):
+        lines = self.export('/api/bills/export/', output='jsonl', customer=self.customer.id).splitlines()
+        bills = [json.loads(line) for line in lines]
+
+        self.assertEqual([len(bill['items']) for bill in bills], [2, 0])
+        self.assertEqual(bills[0]['items'][0]['price'], '10.00')
+        self.assertEqual(self.export('/api/bills/export/', start_date='2000-01-01', end_date='2000-12-31').count('\n'), 1)
+
+    def test_export_reads_in_keyset_chunks(self):
+        from .exports import bill_rows
+
+        # Two bills per chunk plus one empty chunk: 3 bill queries and 2 item queries
+        with self.assertNumQueries(5):
+            bills = list(bill_rows(Bill.objects.filter(business=self.business), chunk_size=2))
+        self.assertEqual(len(bills), 3)
+
+    def test_transactions_export(self):
+        content = self.export('/api/transactions/export/', output='jsonl')
+        self.assertIn('"amount": "15.00"', content)
+        self.assertEqual(self.client.get('/api/transactions/export/', {'output': 'xml'}).status_code, 400)
+
+
+class ReceiptTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/api/bills/', self.bill_payload(self.items[:2], quantity=2), format='json')
+        self.bill_id = response.data['id']
+        self.url = f'/api/bills/{self.bill_id}/receipt/'
+
+    def test_html_text_and_pdf(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        self.assertContains(response, '<td>Item 1</td><td class="number">2</td>')
+        self.assertContains(response, 'Main Road')
+
+        text = self.client.get(self.url, {'output': 'text'}).content.decode()
+        self.assertTrue(all(len(line) <= 42 for line in text.splitlines()))
+        self.assertIn('Item 0                2    10.00     20.00', text)
+        self.assertIn('Customer: Asha (9999999999)', text)
+        self.assertIn('Rs. 10.00', text)
+
+        response = self.client.get(self.url, {'output': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = response.content
+        self.assertTrue(pdf.startswith(b'%PDF-1.4') and pdf.endswith(b'%%EOF\n'))
+        self.assertIn(b'(Customer: Asha \\(9999999999\\)) Tj', pdf)
+        # Every cross-reference entry points at its object
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        entries = pdf[xref:].split(b'\n')[3:3 + pdf.count(b' 0 obj\n')]
+        for number, entry in enumerate(entries, 1):
+            self.assertTrue(pdf[int(entry[:10]):].startswith(b'%d 0 obj' % number))
+
+        self.assertEqual(self.client.get(self.url, {'output': 'docx'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/bills/999/receipt/').status_code, 404)
+        other = User.objects.create_user(username='other')
+        Business.objects.create(name='Other', address='Elsewhere', owner=other)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_reprints_are_served_from_the_cache(self):
+        first = self.client.get(self.url, {'output': 'text'})
+        with mock.patch.dict('logic.receipts.RENDERERS', text=mock.Mock(side_effect=AssertionError)):
+            # The bill and its lines; the business header and the rendering are cached
+            with self.assertNumQueries(2):
+                again = self.client.get(self.url, {'output': 'text'})
+            self.assertEqual(again.content, first.content)
+            self.assertEqual(self.client.get(self.url, {'output': 'text'}, HTTP_IF_NONE_MATCH=first['ETag']).status_code,
+                             304)
+
+        # Anything printed on the receipt changing renders it again
+        with self.assertLogs('logic.serializers', 'INFO'):
+            self.client.put(f'/api/bills/{self.bill_id}/', self.bill_payload(self.items[1:4]), format='json')
+        edited = self.client.get(self.url, {'output': 'text'})
+        self.assertNotEqual(edited['ETag'], first['ETag'])
+        self.assertIn(b'Item 3', edited.content)
+        self.business.name = 'Corner Shop'
+        self.business.save()
+        self.assertIn(b'CORNER SHOP', self.client.get(self.url, {'output': 'text'}).content)
+
+    def test_month_of_receipts_in_a_zip(self):
+        import zipfile
+
+        older = self.client.post('/api/bills/', self.bill_payload(self.items[:1]), format='json').data['id']
+        Bill.objects.filter(id=older).update(created_at=timezone.now() - timezone.timedelta(days=40))
+        latest = self.client.post('/api/bills/', self.bill_payload(self.items[2:3]), format='json').data['id']
+
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'receipts.zip')
+        call_command('render_receipts', business=self.business.id, month=timezone.localdate().strftime('%Y-%m'),
+                     output='text', out=path, workers=1, stdout=StringIO())
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(archive.namelist(), [f'receipt-{self.bill_id}.txt', f'receipt-{latest}.txt'])
+            self.assertEqual(archive.read(f'receipt-{self.bill_id}.txt'),
+                             self.client.get(self.url, {'output': 'text'}).content)
+
+        with self.assertRaises(CommandError):
+            call_command('render_receipts', business=self.business.id, month='June', out=path, stdout=StringIO())
+
+
+class ImportTests(StoreTestCase):
+
+    def upload(self, kind, name, content, **data):
+        return self.client.post('/api/imports/', {'kind': kind, 'file': SimpleUploadedFile(name, content.encode()), **data})
+
+    def test_inventory_csv_reports_bad_rows_and_keeps_the_rest(self):
+        content = 'name,price,current_stock\nRice,55.00,10\nNo price,,3\nOil,120.50,\n'
+        response = self.upload('inventory', 'stock.csv', content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['imported'], response.data['failed']), (2, 1))
+        self.assertEqual(response.data['errors'][0]['record'], 2)
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(Inventory.objects.get(name='Oil').current_stock, 0)
+
+    def test_historical_bills_keep_their_date_and_update_ledger_and_rollups(self):
+        other_business = Business.objects.create(name='Other', address='x', owner=User.objects.create_user('other'))
+        stranger = Customer.objects.create(name='Stranger', phone='1', business=other_business)
+        lines = [
+            {'customer': self.customer.id, 'total_amount': '30.00', 'payment_mode': 'CASH',
+             'created_at': '2024-04-01T10:00:00Z',
+             'items': [{'inventory_item': self.items[0].id, 'quantity': 3, 'price': '10.00'}]},
+            {'customer': stranger.id, 'total_amount': '10.00', 'payment_mode': 'CASH', 'items': []},
+            'not a bill',
+        ]
+        content = '\n'.join(json.dumps(line) for line in lines) + '\n{broken\n'
+        response = self.upload('bills', 'history.jsonl', content)
+
+        self.assertEqual((response.data['imported'], response.data['failed']), (1, 3))
+        bill = Bill.objects.get()
+        self.assertEqual(bill.created_at.date().isoformat(), '2024-04-01')
+        self.assertEqual(bill.items.get().quantity, 3)
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('30.00'))
+        self.assertEqual(DailyItemSales.objects.get().quantity, 3)
+        # Stock is imported as it stands today, so history does not move it
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].current_stock, 100)
+
+    def test_bill_with_malformed_items_is_reported_and_skipped(self):
+        lines = [
+            {'customer': self.customer.id, 'total_amount': '10.00', 'payment_mode': 'CASH', 'items': 5},
+            {'customer': self.customer.id, 'total_amount': '10.00', 'payment_mode': 'CASH',
+             'items': [{'inventory_item': self.items[0].id, 'quantity': 1, 'price': '10.00'}]},
+        ]
+        response = self.upload('bills', 'bills.jsonl', ''.join(json.dumps(line) + '\n' for line in lines))
+
+        self.assertEqual((response.data['imported'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['record'], 1)
+        self.assertIn('items', response.data['errors'][0]['errors'])
+
+    def test_export_csv_imports_back(self):
+        for lines in [self.items[:2], self.items[2:3]]:
+            self.client.post('/api/bills/', self.bill_payload(lines), format='json')
+        exported = b''.join(self.client.get('/api/bills/export/').streaming_content).decode()
+        Bill.objects.all().delete()
+
+        response = self.upload('bills', 'bills.csv', exported)
+        self.assertEqual((response.data['imported'], response.data['failed']), (2, 0))
+        self.assertEqual(BillItem.objects.count(), 3)
+
+    def test_queries_per_batch_do_not_grow_with_rows(self):
+        from .importers import import_file, start_run
+
+        def import_queries(count):
+            content = ''.join(
+                json.dumps({'customer': self.customer.id, 'total_amount': '10.00', 'payment_mode': 'UPI',
+                            'items': [{'inventory_item': item.id, 'quantity': 1, 'price': '10.00'}
+                                      for item in self.items]}) + '\n'
+                for _ in range(count)
+            )
+            run = start_run(self.business, 'bills', f'{count}.jsonl')
+            with CaptureQueriesContext(connection) as queries:
+                import_file(run, content.splitlines(), 'jsonl')
+            return len(queries)
+
+        self.assertEqual(import_queries(2), import_queries(20))
+
+    def test_command_resumes_after_a_crash(self):
+        from .importers import InventoryImporter
+
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'items.jsonl')
+        with open(path, 'w') as stream:
+            stream.writelines(json.dumps({'name': f'New {i}', 'price': '5.00'}) + '\n' for i in range(5))
+
+        write = InventoryImporter.write
+        calls = []
+
+        def crash_on_second_batch(importer, rows):
+            calls.append(rows)
+            if len(calls) == 2:
+                raise RuntimeError('worker killed')
+            write(importer, rows)
+
+        with mock.patch.object(InventoryImporter, 'write', crash_on_second_batch), self.assertRaises(RuntimeError):
+            call_command('import_data', 'inventory', path, business=self.business.id, batch_size=2, stdout=StringIO())
+        self.assertEqual(Inventory.objects.filter(name__startswith='New').count(), 2)
+
+        out = StringIO()
+        call_command('import_data', 'inventory', path, business=self.business.id, batch_size=2, resume=True, stdout=out)
+        self.assertIn('Resuming import', out.getvalue())
+        self.assertEqual(sorted(Inventory.objects.filter(name__startswith='New').values_list('name', flat=True)),
+                         [f'New {i}' for i in range(5)])
+
+
+class AttachmentTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(MEDIA_ROOT=self.media))
+
+    def upload(self, content, name='Scan 2025-03-21 at 4.43.22 AM.pdf'):
+        with self.running_jobs():
+            response = self.client.post('/api/transactions/', {
+                'customer': self.customer.id, 'amount': '10.00', 'transaction_type': 'CREDIT',
+                'bill_attachment': SimpleUploadedFile(name, content),
+            })
+        self.assertEqual(response.status_code, 201)
+        return Transaction.objects.get(id=response.data['id'])
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(path, name), self.media)
+            for path, _, files in os.walk(self.media) for name in files
+        )
+
+    def test_identical_receipts_are_stored_once(self):
+        first = self.upload(b'receipt bytes')
+        second = self.upload(b'receipt bytes', name='copy.PDF')
+        third = self.upload(b'another receipt')
+
+        digest = hashlib.sha256(b'receipt bytes').hexdigest()
+        self.assertEqual(first.bill_attachment.name, f'bills/{digest[:2]}/{digest}.pdf')
+        self.assertEqual(second.bill_attachment.name, first.bill_attachment.name)
+        self.assertNotEqual(third.bill_attachment.name, first.bill_attachment.name)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    @skipUnless(Image, 'Pillow is not installed')
+    def test_list_links_thumbnails_only(self):
+        image = BytesIO()
+        Image.new('RGB', (1200, 900), 'white').save(image, 'PNG')
+        transaction = self.upload(image.getvalue(), name='receipt.png')
+
+        listed = self.client.get('/api/transactions/').data['results'][0]
+        self.assertNotIn('bill_attachment', listed)
+        self.assertTrue(listed['bill_thumbnail'])
+        detail = self.client.get(f'/api/transactions/{transaction.id}/').data
+        self.assertTrue(detail['bill_attachment'].endswith(transaction.bill_attachment.name))
+
+    def test_list_links_attachments_without_a_thumbnail(self):
+        transaction = self.upload(b'receipt bytes')
+
+        listed = self.client.get('/api/transactions/').data['results'][0]
+        self.assertIsNone(listed['bill_thumbnail'])
+        self.assertTrue(listed['bill_attachment'].endswith(transaction.bill_attachment.name))
+
+    @skipUnless(Image, 'Pillow is not installed')
+    def test_thumbnail_is_made_after_commit(self):
+        image = BytesIO()
+        Image.new('RGB', (1200, 900), 'white').save(image, 'PNG')
+        transaction = self.upload(image.getvalue(), name='receipt.png')
+
+        transaction.refresh_from_db()
+        self.assertTrue(transaction.bill_thumbnail.name.startswith('thumbnails/'))
+        with Image.open(transaction.bill_thumbnail.path) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 320)
+
+    def test_cleanup_removes_only_orphans(self):
+        kept = self.upload(b'kept receipt')
+        orphan = self.upload(b'orphaned receipt')
+        orphan.delete()
+
+        out = StringIO()
+        call_command('cleanup_attachments', min_age=0, stdout=out)
+
+        self.assertIn('Removed 1 orphaned files', out.getvalue())
+        self.assertEqual(self.stored_files(), [kept.bill_attachment.name])
+
+
+@job(max_attempts=2)
+def failing_job(message):
+    raise RuntimeError(message)
+
+
+@job
+def create_customer_job(name, business_id):
+    Customer.objects.create(name=name, phone='0', business_id=business_id)
+
+
+class JobQueueTests(StoreTestCase):
+
+    def test_jobs_are_queued_only_when_the_transaction_commits(self):
+        from django.db import transaction
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                create_customer_job.delay(name='Queued', business_id=self.business.id)
+                self.assertFalse(Job.objects.exists())
+        self.assertEqual(Job.objects.get().name, 'logic.tests.create_customer_job')
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    create_customer_job.delay(name='Rolled back', business_id=self.business.id)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+
+        self.assertEqual(work_off(), 1)
+        self.assertTrue(Customer.objects.filter(name='Queued').exists())
+        self.assertFalse(Job.objects.exists())
+
+    def test_failures_back_off_then_go_to_the_dead_letter_table(self):
+        with self.assertLogs('logic.jobs', 'WARNING'), self.running_jobs():
+            failing_job.delay(message='printer offline')
+
+        retry = Job.objects.get()
+        self.assertEqual(retry.attempts, 1)
+        self.assertIn('printer offline', retry.last_error)
+        self.assertGreater(retry.run_at, retry.created_at)
+        self.assertEqual(work_off(), 0)  # Not due yet
+
+        Job.objects.update(run_at=retry.created_at)
+        with self.assertLogs('logic.jobs', 'ERROR'):
+            work_off()
+        self.assertFalse(Job.objects.exists())
+        dead = DeadJob.objects.get()
+        self.assertEqual((dead.attempts, dead.payload), (2, {'message': 'printer offline'}))
+
+    def test_workers_claim_disjoint_batches(self):
+        Job.objects.bulk_create([Job(name='logic.tests.create_customer_job', payload={}) for _ in range(5)])
+
+        first, second = Worker(batch_size=3).claim(), Worker(batch_size=3).claim()
+
+        self.assertEqual((len(first), len(second)), (3, 2))
+        self.assertFalse({job.id for job in first} & {job.id for job in second})
+        self.assertEqual(queue_stats()['running'], 5)
+
+    def test_a_job_run_by_another_worker_is_skipped(self):
+        Job.objects.create(name='logic.tests.create_customer_job',
+                           payload={'name': 'Once', 'business_id': self.business.id})
+        slow, other = Worker(), Worker()
+        job = slow.claim()[0]
+        # The slow worker's lock went stale; another worker reclaimed and ran the job
+        Job.objects.update(locked_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(other.work_off(), 1)
+
+        with self.assertLogs('logic.jobs', 'INFO'):
+            self.assertFalse(slow.run(job))
+        self.assertEqual(Customer.objects.filter(name='Once').count(), 1)
+        self.assertEqual(slow.processed, 0)
+
+    def test_sales_queue_rollups_and_low_stock_checks(self):
+        with self.assertLogs('logic.stock', 'WARNING') as logs, self.running_jobs():
+            self.client.post('/api/bills/', self.bill_payload(self.items[:1], quantity=96), format='json')
+
+        self.assertIn('Item 0 (#%d) has 4 left' % self.items[0].id, logs.output[0])
+        self.assertEqual(DailyItemSales.objects.get().quantity, 96)
+
+    def test_run_jobs_command(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_customer_job.delay(name='From command', business_id=self.business.id)
+
+        out = StringIO()
+        call_command('run_jobs', stats=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['due'], 1)
+
+        out = StringIO()
+        call_command('run_jobs', once=True, stdout=out)
+        self.assertIn('Ran 1 jobs: 1 done', out.getvalue())
+
+
+class StockTests(StoreTestCase):
+
+    def reserve(self, item, quantity, **data):
+        return self.client.post('/api/reservations/', {
+            'items': [{'inventory_item': item.id, 'quantity': quantity}], **data
+        }, format='json')
+
+    def assert_ledger_matches(self):
+        out = StringIO()
+        call_command('reconcile_stock', verify=True, stdout=out)
+        self.assertIn('match their stock ledger', out.getvalue())
+
+    @override_settings(BILL_REJECT_OVERSELL=True)
+    def test_reserved_stock_is_held_for_the_cart(self):
+        response = self.reserve(self.items[0], 95)
+        self.assertEqual(response.status_code, 201)
+        token = response.data['token']
+
+        # Only 5 units are left for everyone else
+        self.assertEqual(self.reserve(self.items[0], 6).status_code, 400)
+        other_sale = self.client.post('/api/bills/', self.bill_payload(self.items[:1], quantity=6), format='json')
+        self.assertEqual(other_sale.status_code, 400)
+
+        payload = dict(self.bill_payload(self.items[:1], quantity=95), reservation=token)
+        self.assertEqual(self.client.post('/api/bills/', payload, format='json').status_code, 201)
+        self.items[0].refresh_from_db()
+        self.assertEqual((self.items[0].current_stock, self.items[0].reserved_stock), (5, 0))
+        self.assert_ledger_matches()
+
+    def test_released_and_expired_reservations_free_the_stock(self):
+        token = self.reserve(self.items[0], 40).data['token']
+        self.assertEqual(self.client.delete(f'/api/reservations/{token}/').status_code, 204)
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].reserved_stock, 0)
+
+        with self.running_jobs():
+            self.reserve(self.items[1], 30)
+        # Time passes: the hold lapses and the expiry job queued with it falls due
+        StockReservation.objects.update(expires_at=timezone.now())
+        Job.objects.update(run_at=timezone.now())
+        work_off()
+        self.items[1].refresh_from_db()
+        self.assertEqual(self.items[1].reserved_stock, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_every_change_is_in_the_movement_ledger(self):
+        bill_id = self.client.post('/api/bills/', self.bill_payload(self.items[:2], quantity=30), format='json').data['id']
+        payload = self.bill_payload(self.items[:1], quantity=120)
+        with self.assertLogs('logic.serializers', 'INFO'):
+            self.client.put(f'/api/bills/{bill_id}/', payload, format='json')
+        self.client.patch(f'/api/inventories/{self.items[2].id}/', {'current_stock': 50}, format='json')
+
+        reasons = list(StockMovement.objects.filter(inventory_item=self.items[0]).values_list('reason', 'delta'))
+        # Flooring at zero only takes the 70 units that were left
+        self.assertEqual(reasons, [('OPENING', 100), ('SALE', -30), ('BILL_EDIT', -70)])
+        self.assertEqual(StockMovement.objects.get(inventory_item=self.items[2], reason='ADJUSTMENT').delta, -50)
+        self.assert_ledger_matches()
+
+    def test_reconcile_records_corrections(self):
+        Inventory.objects.filter(id=self.items[0].id).update(current_stock=90, reserved_stock=3)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stock', verify=True, stdout=StringIO())
+        call_command('reconcile_stock', stdout=StringIO())
+
+        self.assertEqual(StockMovement.objects.get(reason='CORRECTION').delta, -10)
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].reserved_stock, 0)
+        self.assert_ledger_matches()
+
+
+class StockConcurrencyTests(TransactionTestCase):
+
+    def test_parallel_sales_lose_no_updates(self):
+        from .bench import create_store, stock_stress
+
+        _, business, _, items = create_store(inventory_count=2, stock=1000)
+        StockMovement.objects.bulk_create([
+            StockMovement(inventory_item=item, delta=item.current_stock, reason='OPENING') for item in items
+        ])
+
+        sold, _, _ = stock_stress(business, [item.id for item in items], threads=6, sales=10)
+
+        self.assertEqual(sum(sold.values()), 60)
+        for item in Inventory.objects.filter(business=business):
+            self.assertEqual(item.current_stock, 1000 - sold.get(item.id, 0))
+            self.assertEqual(item.reserved_stock, 0)
+        call_command('reconcile_stock', verify=True, stdout=StringIO())
+
+
+class BenchReplayTests(TransactionTestCase):
+
+    def test_replay_reports_every_endpoint_of_the_mix(self):
+        from .bench import DEFAULT_PROFILE, replay, seed_bench_store, summarize
+
+        cache.clear()  # Memberships cached by earlier tests may name reused user ids
+        owner, business = seed_bench_store(customers=20, inventory=10, bills=30, transactions=30)
+        self.assertEqual(Bill.objects.filter(business=business).count(), 30)
+        self.assertEqual(
+            sum(DailySales.objects.filter(business=business).values_list('bill_count', flat=True)), 30
+        )
+
+        # Writers to the shared-cache test database fail rather than wait, so only one client writes
+        summary = summarize(*replay(DEFAULT_PROFILE, owner, clients=1, requests=60))
+        self.assertEqual(summary['total']['requests'], 60)
+        self.assertEqual(summary['total']['errors'], 0)
+        self.assertEqual(summary['bill-create']['errors'], 0)
+
+        reads = [entry for entry in DEFAULT_PROFILE if entry['method'] == 'GET']
+        summary = summarize(*replay(reads, owner, clients=3, requests=60))
+        self.assertEqual((summary['total']['requests'], summary['total']['errors']), (60, 0))
+        self.assertEqual(summary['bill-detail']['queries'], 2)
+
+    def test_regressions_beyond_tolerance(self):
+        from .bench import find_regressions
+
+        baseline = {
+            'total': {'rps': 100, 'p50_ms': 20, 'p95_ms': 80, 'queries': 3, 'errors': 0},
+            'bill-list': {'rps': 20, 'p50_ms': 10, 'p95_ms': 40, 'queries': 2, 'errors': 0},
+        }
+        noisy = {
+            'total': {'rps': 90, 'p50_ms': 23, 'p95_ms': 150, 'queries': 3.2, 'errors': 0},
+            'bill-list': {'rps': 10, 'p50_ms': 11, 'p95_ms': 90, 'queries': 2, 'errors': 0},
+        }
+        self.assertEqual(find_regressions(noisy, baseline, 0.25), ['total: p95 150ms, was 80ms'])
+
+        worse = {**noisy, 'bill-list': {'rps': 20, 'p50_ms': 30, 'p95_ms': 40, 'queries': 3, 'errors': 1}}
+        self.assertEqual(find_regressions(worse, baseline, 0.25)[1:], [
+            'bill-list: p50 30ms, was 10ms', 'bill-list: 3 queries per request, was 2', 'bill-list: 1 errors, was 0',
+        ])
+
+
+class SeedTests(TestCase):
+    def test_seeded_store_is_consistent(self):
+        from .reports import rebuild_rollups
+
+        end = timezone.make_aware(timezone.datetime(2024, 7, 1))
+        call_command('seed', name='Seed Test', customers=40, inventory=30, bills=300, transactions=80, days=20,
+                     end='2024-06-30', workers=1, stdout=StringIO())
+        business = Business.objects.get(name='Seed Test')
+        bills = Bill.objects.filter(business=business).order_by('id')
+        self.assertEqual((bills.count(), Transaction.objects.filter(business=business).count()), (300, 80))
+        self.assertEqual(BillItem.objects.filter(bill__business=business).exclude(bill__in=bills).count(), 0)
+
+        times = list(bills.values_list('created_at', flat=True))
+        self.assertEqual(times, sorted(times))
+        self.assertTrue(end - timezone.timedelta(days=20) <= times[0] and times[-1] < end)
+        for bill in bills.prefetch_related('items')[:50]:
+            self.assertEqual(bill.total_amount, sum(line.quantity * line.price for line in bill.items.all()))
+
+        # Rollups built by the database match the ORM rebuild
+        def rollups():
+            return (
+                sorted(DailySales.objects.filter(business=business).values_list(
+                    'day', 'customer', 'payment_mode', 'bill_count', 'revenue')),
+                sorted(DailyItemSales.objects.filter(business=business).values_list(
+                    'day', 'inventory_item', 'quantity', 'revenue')),
+            )
+        seeded = rollups()
+        self.assertEqual(sum(row[3] for row in seeded[0]), 300)
+        rebuild_rollups([business.id])
+        self.assertEqual(rollups(), seeded)
+        call_command('rebuild_ledger', business=business.id, verify=True, stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('seed', name='Seed Test', customers=1, inventory=1, bills=1, transactions=0, workers=1,
+                         stdout=StringIO())
+
+    def test_chunks_are_deterministic_and_skewed(self):
+        from .seeding import SeedPlan, bill_chunk
+
+        start = timezone.make_aware(timezone.datetime(2024, 1, 1))
+        items = [(pk, 1000 + pk) for pk in range(1, 201)]
+        plan = SeedPlan(1, list(range(1, 101)), items, 1, 6000, 4, 0, start, 30, 7, 1.1, 0.8)
+        bills, lines = bill_chunk(plan, 1)
+        self.assertEqual(bill_chunk(plan, 1), (bills, lines))
+        self.assertNotEqual(bill_chunk(plan, 0)[0], bills)
+        self.assertEqual([bill[0] for bill in bills], list(range(5001, 6001)))
+        self.assertAlmostEqual(len(lines) / len(bills), 4, delta=0.6)
+
+        sold = {}
+        for _, item_id, quantity, _ in lines:
+            sold[item_id] = sold.get(item_id, 0) + 1
+        # The best seller under Zipf is bought far more often than the median item
+        ranked = sorted(sold.values(), reverse=True)
+        self.assertGreater(ranked[0], 10 * ranked[len(ranked) // 2])
+
+
+class SQLiteProfileTests(TestCase):
+    def test_production_options_apply_to_new_connections(self):
+        from django.conf import settings
+        from django.db import connections
+
+        settings_dict = dict(connection.settings_dict, **settings.SQLITE_PROFILES['production'])
+        settings_dict['NAME'] = os.path.join(tempfile.mkdtemp(), 'profile.sqlite3')
+        wrapper = connections.create_connection('default').__class__(settings_dict, alias='profile')
+        try:
+            with wrapper.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], 'wal')
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0], 5000)
+            self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+        finally:
+            wrapper.close()
+
+
+class ChangeTrackingTests(StoreTestCase):
+    def test_unchanged_catalog_is_answered_with_304(self):
+        response = self.client.get('/api/inventories/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/inventories/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # Only the change-version lookup, nothing is serialized
+        self.assertEqual(len(queries), 1)
+
+    def test_sales_and_deletions_change_the_etag(self):
+        etag = self.client.get('/api/inventories/')['ETag']
+        self.client.post('/api/bills/', self.bill_payload(self.items[:1]), format='json')
+        response = self.client.get('/api/inventories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.items[4].delete()
+        self.assertEqual(self.client.get('/api/inventories/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_since_returns_changed_and_deleted_rows(self):
+        since = timezone.now()
+        self.client.post('/api/bills/', self.bill_payload(self.items[:2]), format='json')
+        deleted_id = self.items[4].id
+        self.items[4].delete()
+
+        response = self.client.get('/api/inventories/', {'since': since.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['changed']], [self.items[0].id, self.items[1].id])
+        self.assertEqual(response.data['changed'][0]['current_stock'], 99)
+        self.assertEqual(response.data['deleted'], [deleted_id])
+
+        # Without a safety window, the deletion is the newest change and is sent again from its own version
+        self.assertEqual(response.data['next'], None)
+        with override_settings(CHANGE_SYNC={'SAFETY_WINDOW': 0}):
+            version = self.client.get('/api/inventories/', {'since': since.isoformat()}).data['version']
+        response = self.client.get('/api/inventories/', {'since': version.isoformat()})
+        self.assertEqual(response.data['changed'], [])
+        self.assertEqual(response.data['deleted'], [deleted_id])
+
+        # Bills move customer balances, which customer syncs pick up too
+        response = self.client.get('/api/customers/', {'since': str(since.timestamp())})
+        self.assertEqual([customer['id'] for customer in response.data['changed']], [self.customer.id])
+        self.assertEqual(response.data['deleted'], [])
+
+    def test_invalid_since_is_rejected(self):
+        self.assertEqual(self.client.get('/api/inventories/', {'since': 'yesterday'}).status_code, 400)
+        response = self.client.get('/api/inventories/', {'since': '0', 'after': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_trails_the_newest_change(self):
+        self.client.post('/api/bills/', self.bill_payload(self.items[:1]), format='json')
+        newest = Inventory.objects.get(pk=self.items[0].pk).updated_at
+
+        response = self.client.get('/api/inventories/', {'since': '0'})
+        self.assertEqual(response.data['version'], newest - timedelta(seconds=60))
+        with override_settings(CHANGE_SYNC={'SAFETY_WINDOW': 0}):
+            response = self.client.get('/api/inventories/', {'since': '0'})
+        self.assertEqual(response.data['version'], newest)
+
+    @override_settings(CHANGE_SYNC={'PAGE_SIZE': 2})
+    def test_changed_rows_come_in_pages(self):
+        # Rows written by one statement share updated_at, so pages must split ties
+        Inventory.objects.filter(pk__in=[item.pk for item in self.items[1:]]).update(updated_at=timezone.now())
+        deleted_id = self.items[0].id
+        self.items[0].delete()
+
+        pages = [self.client.get('/api/inventories/', {'since': '0'}).data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+
+        self.assertEqual([len(page['changed']) for page in pages], [2, 2])
+        self.assertEqual([item['id'] for page in pages for item in page['changed']],
+                         [item.id for item in self.items[1:]])
+        self.assertEqual([page['deleted'] for page in pages], [[deleted_id], []])
+        self.assertEqual(len({page['version'] for page in pages}), 1)
+
+
+class SyncTests(StoreTestCase):
+    def batch(self, cursor=None):
+        return {
+            'cursor': cursor,
+            'operations': [
+                {'key': 'till-1:1', 'type': 'bill', 'data': self.bill_payload(self.items[:2], quantity=2)},
+                {'key': 'till-1:2', 'type': 'transaction', 'data': {
+                    'customer': self.customer.id, 'amount': '5.00', 'transaction_type': 'DEBIT',
+                }},
+                {'key': 'till-1:3', 'type': 'bill', 'data': self.bill_payload(self.items[1:3])},
+            ],
+        }
+
+    def sync(self, payload):
+        return self.client.post('/api/sync/', payload, format='json')
+
+    def test_batch_is_applied_once_and_replays_return_the_same_ids(self):
+        with self.running_jobs():
+            response = self.sync(self.batch())
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([result['replayed'] for result in results], [False, False, False])
+        self.assertEqual(Bill.objects.count(), 2)
+        self.assertEqual(Transaction.objects.get().id, results[1]['id'])
+
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('15.00'))  # Two bills of 10.00, a 5.00 payment
+        self.items[1].refresh_from_db()
+        self.assertEqual(self.items[1].current_stock, 97)
+        self.assertEqual(DailySales.objects.get().bill_count, 2)
+
+        response = self.sync(self.batch())
+        self.assertEqual([result['id'] for result in response.data['results']], [result['id'] for result in results])
+        self.assertEqual([result['replayed'] for result in response.data['results']], [True, True, True])
+        self.assertEqual(Bill.objects.count(), 2)
+        self.items[1].refresh_from_db()
+        self.assertEqual(self.items[1].current_stock, 97)
+
+    def test_queries_do_not_grow_with_bill_lines(self):
+        short = self.batch()
+        long = self.batch()
+        for operation in long['operations']:
+            operation['key'] += ':long'
+            if operation['type'] == 'bill':
+                operation['data'] = self.bill_payload(self.items)
+        with CaptureQueriesContext(connection) as few:
+            self.sync(short)
+        with CaptureQueriesContext(connection) as many:
+            self.sync(long)
+        self.assertEqual(len(few), len(many))
+
+    def test_stock_movements_follow_the_batch_order(self):
+        payload = self.batch()
+        payload['operations'].reverse()
+        results = self.sync(payload).data['results']
+
+        movements = StockMovement.objects.filter(reason='SALE').order_by('id').values_list(
+            'bill_id', 'inventory_item_id', 'delta'
+        )
+        self.assertEqual(list(movements), [
+            (results[0]['id'], self.items[1].id, -1), (results[0]['id'], self.items[2].id, -1),
+            (results[2]['id'], self.items[0].id, -2), (results[2]['id'], self.items[1].id, -2),
+        ])
+
+    def test_invalid_operation_rejects_the_whole_batch(self):
+        payload = self.batch()
+        payload['operations'][2]['data']['items'][0]['inventory_item'] = 999999
+        response = self.sync(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(2, response.data['operations'])
+        self.assertFalse(Bill.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_malformed_operations_are_reported_by_index(self):
+        payload = self.batch()
+        payload['operations'][0]['data']['customer'] = [self.customer.id]
+        payload['operations'][1]['data']['customer'] = {'id': self.customer.id}
+        payload['operations'][2]['data']['items'] = 5
+        response = self.sync(payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['operations']), [0, 1, 2])
+        self.assertFalse(Bill.objects.exists())
+
+    @override_settings(CHANGE_SYNC={'SAFETY_WINDOW': 0})
+    def test_inventory_changes_since_cursor_are_returned(self):
+        cursor = self.sync({'operations': []}).data['cursor']
+        self.items[4].price = Decimal('12.00')
+        self.items[4].save()
+
+        response = self.sync(self.batch(cursor.isoformat()))
+        changed = {item['id']: item for item in response.data['inventory']['changed']}
+        self.assertEqual(set(changed), {self.items[0].id, self.items[1].id, self.items[2].id, self.items[4].id})
+        self.assertEqual(changed[self.items[1].id]['current_stock'], 97)
+        self.assertEqual(response.data['inventory']['deleted'], [])
+
+
+@override_settings(ROOT_URLCONF=async_urlconf())
+class AsyncReadTests(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.owner)
+        self.bill = self.client.post('/api/bills/', self.bill_payload(self.items[:2]), format='json').data
+        self.auth = {'Authorization': f'Token {self.token.key}'}
+        self.sync_client = APIClient()
+        self.sync_client.credentials(HTTP_AUTHORIZATION=self.auth['Authorization'])
+
+    async def test_responses_match_the_sync_views(self):
+        for url in ['/api/bills/', f"/api/bills/{self.bill['id']}/", '/api/bills/?expand=items',
+                    '/api/inventories/?page_size=2', '/api/current-user/']:
+            with mock.patch.object(BillViewSet, 'list', side_effect=AssertionError('sync view used')), \
+                    mock.patch.object(BillViewSet, 'retrieve', side_effect=AssertionError('sync view used')), \
+                    mock.patch.object(InventoryViewSet, 'list', side_effect=AssertionError('sync view used')):
+                response = await self.async_client.get(url, headers=self.auth)
+            expected = await sync_to_async(self.sync_client.get)(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.json(), expected.json(), url)
+            self.assertEqual(response.get('ETag'), expected.get('ETag'), url)
+
+    async def test_unchanged_inventory_is_answered_with_304(self):
+        etag = (await self.async_client.get('/api/inventories/', headers=self.auth))['ETag']
+        response = await self.async_client.get('/api/inventories/', headers=dict(self.auth, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+    async def test_other_requests_fall_back_to_the_sync_views(self):
+        response = await self.async_client.get('/api/bills/', headers={'Authorization': 'Token nope'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual((await self.async_client.get('/api/bills/999999/', headers=self.auth)).status_code, 404)
+        response = await self.async_client.post(
+            '/api/bills/', self.bill_payload(self.items[:1]), content_type='application/json', headers=self.auth
+        )
+        self.assertEqual(response.status_code, 201)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # TestCase would wrap every test in an atomic block, which keeps reads on the primary
+    def route(self, method):
+        seen = {}
+
+        def view(request):
+            seen['before'] = router.db_for_read(Bill)
+            with transaction.atomic():
+                seen['atomic'] = router.db_for_read(Bill)
+            seen['write'] = router.db_for_write(Bill)
+            seen['after'] = router.db_for_read(Bill)
+            seen['auth'] = router.db_for_read(User)
+            return None
+
+        ReplicaMiddleware(view)(RequestFactory().generic(method, '/api/bills/'))
+        return seen
+
+    def test_safe_requests_read_from_replica_until_they_write(self):
+        self.assertEqual(self.route('GET'), {
+            'before': 'replica', 'atomic': 'default', 'write': 'default', 'after': 'default', 'auth': 'default',
+        })
+
+    def test_unsafe_requests_and_code_outside_requests_use_primary(self):
+        self.assertEqual(self.route('POST')['before'], 'default')
+        self.assertEqual(router.db_for_read(Bill), 'default')
+        with replica_reads(), use_primary():
+            self.assertEqual(router.db_for_read(Bill), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica1', 'replica2', 'replica3'])
+    def test_a_request_reads_from_one_replica(self):
+        chosen = set()
+        for _ in range(20):
+            with replica_reads():
+                seen = {router.db_for_read(model) for model in [Bill, Inventory, Customer, Bill]}
+            self.assertEqual(len(seen), 1)
+            chosen |= seen
+        self.assertGreater(len(chosen), 1)  # Requests are still spread over the replicas
+
+    def test_memberships_are_loaded_from_the_primary(self):
+        cache.clear()
+        owner = User.objects.create_user('fresh')
+        business = Business.objects.create(name='Fresh', owner=owner)
+        # The 'replica' alias does not exist, so a lookup routed to it would raise
+        with replica_reads():
+            self.assertEqual(resolve_membership(owner).business, business)
+
+    def test_sync_replica_copies_the_primary(self):
+        path = os.path.join(tempfile.mkdtemp(), 'replica.sqlite3')
+        Business.objects.create(name='Replicated', owner=User.objects.create_user('replicated'))
+        call_command('sync_replica', '--file', path, stdout=StringIO())
+        with closing(sqlite3.connect(path)) as replica:
+            self.assertEqual(replica.execute('SELECT name FROM logic_business').fetchall(), [('Replicated',)])
+
+
+class MetricsTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.metrics = {'DIR': self.directory, 'FLUSH_INTERVAL': 3600}
+        self.enterContext(override_settings(METRICS=self.metrics))
+        registry.clear()
+
+    def test_records_queries_serializer_and_renderer_time_and_bytes(self):
+        self.client.get('/api/customers/')
+        response = self.client.get('/api/customers/')
+
+        stats = registry.snapshot()[('customer-list', 'GET')]
+        self.assertEqual(stats.count, 2)
+        self.assertEqual(stats.queries, 4)  # Change version and page, twice
+        self.assertGreater(stats.serializer_ms, 0)
+        self.assertGreater(stats.renderer_ms, 0)
+        self.assertEqual(stats.response_bytes, 2 * len(response.content))
+
+    def test_percentiles_come_from_the_histogram(self):
+        stats = EndpointStats()
+        stats.count, stats.max_latency_ms = 100, 730.0
+        stats.histogram[LATENCY_BUCKETS_MS.index(10)] = 95
+        stats.histogram[LATENCY_BUCKETS_MS.index(1000)] = 5
+
+        self.assertEqual((stats.percentile(0.5), stats.percentile(0.95), stats.percentile(0.99)), (10, 10, 730.0))
+
+    def test_endpoint_sums_every_worker(self):
+        other = EndpointStats()
+        other.count, other.latency_ms, other.max_latency_ms = 3, 30.0, 10.0
+        with open(os.path.join(self.directory, 'elsewhere-1-1.json'), 'w') as handle:
+            json.dump({'endpoints': [{'route': 'customer-list', 'method': 'GET', **other.as_dict()}]}, handle)
+        self.client.get('/api/customers/')
+
+        self.assertEqual(self.client.get('/api/_metrics/').status_code, 403)
+        User.objects.filter(id=self.owner.id).update(is_staff=True)
+        self.client.force_authenticate(User.objects.get(id=self.owner.id))
+        data = self.client.get('/api/_metrics/').data
+
+        self.assertEqual(data['workers'], 2)
+        row = next(row for row in data['endpoints'] if row['route'] == 'customer-list')
+        self.assertEqual(row['count'], 4)  # Three from the other worker, one from this one
+
+    def test_slow_requests_leave_a_profile(self):
+        self.metrics.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_THRESHOLD_MS=0)
+        self.client.get('/api/customers/')
+
+        dumps = sorted(os.listdir(os.path.join(self.directory, 'profiles')))
+        self.assertEqual([name.rsplit('.', 1)[1] for name in dumps], ['prof', 'txt'])
+        self.assertIn('GET-customer-list', dumps[0])
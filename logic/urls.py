@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BusinessViewSet, CustomerViewSet, TransactionViewSet, RoleViewSet, StaffViewSet, InventoryViewSet, BillViewSet, UserRegistrationView, CurrentUserBusinessView
+from .views import BusinessViewSet, CustomerViewSet, TransactionViewSet, RoleViewSet, StaffViewSet, InventoryViewSet, BillViewSet, UserRegistrationView, CurrentUserBusinessView, ReportView, ImportView, ReservationView, SyncView, MetricsView
 
 router = DefaultRouter()
 router.register(r'businesses', BusinessViewSet)
@@ -15,4 +15,10 @@ urlpatterns = [
     path('', include(router.urls)),
     path('register/', UserRegistrationView.as_view(), name='user-registration'),
     path('current-user/', CurrentUserBusinessView.as_view(), name='current-user-business'),
+    path('reports/', ReportView.as_view(), name='reports'),
+    path('imports/', ImportView.as_view(), name='imports'),
+    path('reservations/', ReservationView.as_view(), name='reservations'),
+    path('reservations/<str:token>/', ReservationView.as_view(), name='reservation-detail'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('_metrics/', MetricsView.as_view(), name='metrics'),
 ]
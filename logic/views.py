@@ -1,125 +1,317 @@
+import codecs
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 
+from django.db import IntegrityError
+from django.db.models import Prefetch
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from rest_framework import viewsets, permissions, status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
-from .models import Business, Customer, Transaction, Role, Staff, Inventory, BillItem, Bill
+from .changes import catalog_etag, change_version, changed_page, decode_position, deleted_since, encode_position, \
+    etag_matches, parse_since, set_catalog_headers, sync_cursor
+from .exports import BILL_COLUMNS, BILL_ITEM_COLUMNS, CONTENT_TYPES, TRANSACTION_COLUMNS, bill_rows, \
+    export_response, transaction_rows
+from .importers import IMPORTERS, detect_format, import_file, start_run
+from .metrics import collect_metrics, metrics_dir, registry, timed
+from .models import Business, Customer, Transaction, Role, Staff, Inventory, BillItem, Bill, StockReservation
+from .pagination import IdCursorPagination
+from .permissions import RolePermission
+from .receipts import OUTPUTS, receipt_etag, receipt_for, render_cached
+from .reports import sales_report
+from .search import search_inventory
+from .stock import release_reservations, reserve_stock
+from .sync import SyncBatchSerializer, apply_batch
 from .serializers import BusinessSerializer, CustomerSerializer, TransactionSerializer, RoleSerializer, StaffSerializer, \
-    InventorySerializer, BillSerializer, BillItemSerializer, UserSerializer, UserBusinessSerializer
+    InventorySerializer, BillSerializer, BillItemSerializer, UserSerializer, UserBusinessSerializer, ImportRunSerializer, \
+    ReservationSerializer
 
 
-class BusinessViewSet(viewsets.ModelViewSet):
+def filter_history(queryset, params):
+    """Apply the start_date/end_date and customer filters shared by bills and transactions"""
+    # Date range filtering
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    if start_date and end_date:
+        try:
+            start = timezone.make_aware(datetime.strptime(start_date, '%Y-%m-%d'))
+            end = timezone.make_aware(datetime.strptime(end_date, '%Y-%m-%d'))
+            queryset = queryset.filter(created_at__range=[start, end])
+        except ValueError:
+            pass  # Handle invalid date format if needed
+
+    # Customer filtering
+    customer_id = params.get('customer')
+    if customer_id:
+        queryset = queryset.filter(customer__id=customer_id)
+    return queryset
+
+
+def export_format(request):
+    output = request.query_params.get('output', 'csv')
+    return output if output in CONTENT_TYPES else None
+
+
+class SerializerTimingMixin:
+    """Count the time spent building serializer data in the endpoint's metrics"""
+
+    def get_serializer(self, *args, **kwargs):
+        return timed(super().get_serializer(*args, **kwargs))
+
+
+class BusinessViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Business.objects.all()
     serializer_class = BusinessSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
 
     def get_queryset(self):
         # A user can only access their own business or the business they are staff of
-        if hasattr(self.request.user, 'owned_business'):
-            return Business.objects.filter(owner=self.request.user)
-        elif hasattr(self.request.user, 'staff'):
-            return Business.objects.filter(id=self.request.user.staff.business.id)
-        return Business.objects.none()
+        business = self.request.membership.business
+        if business is None:
+            return Business.objects.none()
+        return Business.objects.filter(id=business.id)
+
+    def get_permissions(self):
+        # Registering a business is how a user without one gets started
+        if self.action == 'create':
+            return [IsAuthenticated()]
+        return super().get_permissions()
 
     def perform_create(self, serializer):
         # Automatically set the owner to the logged-in user
         serializer.save(owner=self.request.user)
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class ChangeTrackingMixin:
+    """
+    Conditional GET and ?since= delta sync for a business's catalog list.
+
+    The ETag is computed from the change version before anything is queried
+    for the page, so an unchanged catalog is answered with 304 straight away.
+    """
+
+    def list(self, request, *args, **kwargs):
+        business = request.membership.business
+        model = self.get_queryset().model
+        version = change_version(model, business)
+        # The full path covers filters, cursors and since; the renderer covers JSON vs browsable API
+        etag = catalog_etag(model, business, version, request.get_full_path(), request.accepted_renderer.format)
+
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        elif 'since' in request.query_params:
+            since = parse_since(request.query_params['since'])
+            if since is None:
+                return Response({'since': ['Expected an ISO 8601 datetime or epoch seconds.']},
+                                status=status.HTTP_400_BAD_REQUEST)
+            position = None
+            if 'after' in request.query_params:
+                position = decode_position(request.query_params['after'])
+                if position is None:
+                    return Response({'after': ['Invalid position.']}, status=status.HTTP_400_BAD_REQUEST)
+            changed, more = changed_page(self.get_queryset(), since, position)
+            # Pass back as since once there is no next page. It trails the version, so
+            # rows that commit late are not skipped; recent rows are sent again.
+            cursor = position[2] if position else sync_cursor(version, since)
+            next_url = None
+            if more:
+                next_url = replace_query_param(
+                    request.build_absolute_uri(), 'after', encode_position(changed[-1], cursor)
+                )
+            response = Response({
+                'version': cursor,
+                'next': next_url,
+                'changed': self.get_serializer(changed, many=True).data,
+                # Deletions come with the first page only
+                'deleted': [] if position else deleted_since(model, business, since),
+            })
+        else:
+            response = super().list(request, *args, **kwargs)
+
+        return set_catalog_headers(response, etag, version)
+
+
+class CustomerViewSet(SerializerTimingMixin, ChangeTrackingMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['created_at', 'name', 'balance', 'last_activity_at']
+    ordering = ('-created_at', '-id')
 
+    # http://127.0.0.1:8000/api/customers/?ordering=-balance&min_balance=100&active_since=2025-01-01
     def get_queryset(self):
         # A user can only access customers of their associated business
-        business = self.request.user.owned_business
-        return Customer.objects.filter(business=business)
+        business = self.request.membership.business
+        queryset = Customer.objects.filter(business=business)
+
+        # Balance range filtering
+        min_balance = self.request.query_params.get('min_balance')
+        max_balance = self.request.query_params.get('max_balance')
+        try:
+            if min_balance:
+                queryset = queryset.filter(balance__gte=Decimal(min_balance))
+            if max_balance:
+                queryset = queryset.filter(balance__lte=Decimal(max_balance))
+        except InvalidOperation:
+            pass  # Ignore malformed amounts like the date filters do
+
+        # Customers with activity since a date
+        active_since = self.request.query_params.get('active_since')
+        if active_since:
+            try:
+                since = datetime.strptime(active_since, '%Y-%m-%d')
+                queryset = queryset.filter(last_activity_at__gte=timezone.make_aware(since))
+            except ValueError:
+                pass
+
+        return queryset
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class InventoryViewSet(SerializerTimingMixin, ChangeTrackingMixin, viewsets.ModelViewSet):
     queryset = Inventory.objects.all()
     serializer_class = InventorySerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
 
     def get_queryset(self):
         # A user can only access inventory of their associated business
-        business = self.request.user.owned_business
+        business = self.request.membership.business
         return Inventory.objects.filter(business=business)
 
-class BillViewSet(viewsets.ModelViewSet):
+    # http://127.0.0.1:8000/api/inventories/search/?q=paalak&limit=10
+    @action(detail=False)
+    def search(self, request):
+        """Inventory items matching q, most relevant first"""
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            limit = 20
+        ids = search_inventory(request.membership.business, request.query_params.get('q', ''), limit=limit)
+        items = Inventory.objects.in_bulk(ids)
+        serializer = self.get_serializer([items[pk] for pk in ids if pk in items], many=True)
+        return Response(serializer.data)
+
+class BillViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Bill.objects.all()
     serializer_class = BillSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
 
     # http://127.0.0.1:8000/api/bills/?start_date=2023-01-01&end_date=2026-01-31&customer=1&?item_name=paalak
     def get_queryset(self):
         queryset = Bill.objects.filter(
-            customer__business=self._get_user_business()
+            business=self.request.membership.business
+        ).select_related('customer').prefetch_related(
+            # One query for the lines of every bill on the page, with their inventory rows joined in
+            Prefetch('items', queryset=BillItem.objects.select_related('inventory_item'))
         )
 
-        # Date range filtering
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
-        if start_date and end_date:
-            try:
-                start = datetime.strptime(start_date, '%Y-%m-%d')
-                end = datetime.strptime(end_date, '%Y-%m-%d')
-                queryset = queryset.filter(created_at__range=[start, end])
-            except ValueError:
-                pass  # Handle invalid date format if needed
+        queryset = filter_history(queryset, self.request.query_params)
 
-        # Customer filtering
-        customer_id = self.request.query_params.get('customer')
-        if customer_id:
-            queryset = queryset.filter(customer__id=customer_id)
-
-        # BillItem filtering
+        # BillItem filtering: resolve matching inventory through the search index, plus any
+        # item whose name contains item_name, then find their bills through the
+        # (inventory_item, bill) index without a join
         item_name = self.request.query_params.get('item_name')
         if item_name:
+            inventory_ids = search_inventory(self.request.membership.business, item_name, substring=True)
             queryset = queryset.filter(
-                items__inventory_item__name__icontains=item_name
+                id__in=BillItem.objects.filter(inventory_item_id__in=inventory_ids).values('bill_id')
             )
 
-        return queryset.distinct()
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand_items'] = 'items' in self.request.query_params.get('expand', '').split(',')
+        return context
+
+    # http://127.0.0.1:8000/api/bills/export/?output=jsonl&start_date=2024-04-01&end_date=2025-04-01
+    @action(detail=False)
+    def export(self, request):
+        """Every matching bill with its items, streamed as CSV (one line per item) or JSON Lines"""
+        output = export_format(request)
+        if output is None:
+            return Response({'detail': 'output must be csv or jsonl.'}, status=status.HTTP_400_BAD_REQUEST)
+        return export_response(bill_rows(self.get_queryset()), output, 'bills', BILL_COLUMNS, BILL_ITEM_COLUMNS)
 
-    def _get_user_business(self):
-        """Helper to get user's business (owner or staff)"""
-        if hasattr(self.request.user, 'owned_business'):
-            return self.request.user.owned_business
-        elif hasattr(self.request.user, 'staff_memberships'):
-            return self.request.user.staff_memberships.first().business
-        return None
+    # http://127.0.0.1:8000/api/bills/42/receipt/?output=pdf
+    @action(detail=True)
+    def receipt(self, request, pk=None):
+        """The bill's receipt as HTML, plain text for thermal printers or PDF, rendered once per version"""
+        output = request.query_params.get('output', 'html')
+        if output not in OUTPUTS:
+            return Response({'detail': f'output must be one of {", ".join(OUTPUTS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        business = request.membership.business
+        found = receipt_for(business.id, pk) if business is not None and pk.isdigit() else None
+        if found is None:
+            raise Http404
 
-class TransactionViewSet(viewsets.ModelViewSet):
+        etag = receipt_etag(*found, output)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            content_type, extension = OUTPUTS[output]
+            response = HttpResponse(render_cached(*found, output, etag), content_type=content_type)
+            response['Content-Disposition'] = f'inline; filename="receipt-{pk}.{extension}"'
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+class TransactionViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
 
+    # http://127.0.0.1:8000/api/transactions/?start_date=2023-01-01&end_date=2026-01-31&customer=1
     def get_queryset(self):
-        # A user can only access bills of their associated business
-        business = self.request.user.owned_business
-        return Transaction.objects.filter(customer__business=business)
+        # A user can only access transactions of their associated business
+        business = self.request.membership.business
+        return filter_history(Transaction.objects.filter(business=business), self.request.query_params)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['thumbnails_only'] = self.action == 'list'
+        return context
+
+    # http://127.0.0.1:8000/api/transactions/export/?output=csv&customer=1
+    @action(detail=False)
+    def export(self, request):
+        """Every matching transaction, streamed as CSV or JSON Lines"""
+        output = export_format(request)
+        if output is None:
+            return Response({'detail': 'output must be csv or jsonl.'}, status=status.HTTP_400_BAD_REQUEST)
+        return export_response(transaction_rows(self.get_queryset()), output, 'transactions', TRANSACTION_COLUMNS)
 
-class RoleViewSet(viewsets.ModelViewSet):
+class RoleViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Role.objects.all()
     serializer_class = RoleSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         # A user can only access roles of their associated business
-        business = self.request.user.owned_business
+        business = self.request.membership.business
         return Role.objects.filter(business=business)
 
-class StaffViewSet(viewsets.ModelViewSet):
+    def perform_create(self, serializer):
+        serializer.save(business=self.request.membership.business)
+
+class StaffViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Staff.objects.all()
     serializer_class = StaffSerializer
-    permission_classes = [IsAuthenticated]
+    permission_classes = [IsAuthenticated, RolePermission]
+    pagination_class = IdCursorPagination
 
     def get_queryset(self):
         # A user can only access staff of their associated business
-        business = self.request.user.owned_business
+        business = self.request.membership.business
         return Staff.objects.filter(business=business)
 
 
@@ -133,9 +325,109 @@ class UserRegistrationView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class ReportView(APIView):
+    permission_classes = [IsAuthenticated, RolePermission]
+    permission_resource = 'report'
+
+    # http://127.0.0.1:8000/api/reports/?start_date=2025-01-01&end_date=2025-12-31&top=10
+    def get(self, request):
+        try:
+            end = datetime.strptime(request.query_params['end_date'], '%Y-%m-%d').date() \
+                if 'end_date' in request.query_params else timezone.localdate()
+            start = datetime.strptime(request.query_params['start_date'], '%Y-%m-%d').date() \
+                if 'start_date' in request.query_params else end - timedelta(days=29)
+            top = min(int(request.query_params.get('top', 10)), 100)
+        except ValueError:
+            return Response({'detail': 'Dates must be YYYY-MM-DD and top a number.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(sales_report(request.membership.business, start, end, top=top))
+
+class ImportView(APIView):
+    permission_classes = [IsAuthenticated, RolePermission]
+    permission_resource = 'import'
+    parser_classes = [MultiPartParser]
+
+    # curl -F kind=bills -F file=@bills.csv [-F resume=1] http://127.0.0.1:8000/api/imports/
+    def post(self, request):
+        business = request.membership.business
+        kind = request.data.get('kind')
+        upload = request.data.get('file')
+        if business is None:
+            return Response({'detail': 'You are not part of a business.'}, status=status.HTTP_400_BAD_REQUEST)
+        if kind not in IMPORTERS or upload is None:
+            return Response({'detail': f'Send a file and a kind of {", ".join(IMPORTERS)}.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        file_format = detect_format(upload.name)
+        if file_format is None:
+            return Response({'detail': 'The file must be .csv or .jsonl.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        resume = request.data.get('resume', '').lower() in ('1', 'true', 'yes')
+        run = start_run(business, kind, upload.name, resume=resume)
+        import_file(run, codecs.iterdecode(upload, 'utf-8-sig'), file_format)
+        return Response(ImportRunSerializer(run).data)
+
+class ReservationView(APIView):
+    permission_classes = [IsAuthenticated, RolePermission]
+    permission_resource = 'reservation'
+
+    # POST http://127.0.0.1:8000/api/reservations/ {"items": [{"inventory_item": 1, "quantity": 2}]}
+    def post(self, request):
+        serializer = ReservationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        quantities = {}
+        for item in serializer.validated_data['items']:
+            quantities[item['inventory_item']] = quantities.get(item['inventory_item'], 0) + item['quantity']
+
+        token, expires_at = reserve_stock(
+            request.membership.business, quantities, token=serializer.validated_data.get('token')
+        )
+        return Response({'token': token, 'expires_at': expires_at}, status=status.HTTP_201_CREATED)
+
+    # DELETE http://127.0.0.1:8000/api/reservations/<token>/
+    def delete(self, request, token):
+        release_reservations(StockReservation.objects.filter(business=request.membership.business, token=token))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class SyncView(APIView):
+    permission_classes = [IsAuthenticated, RolePermission]
+    permission_resource = 'sync'
+
+    # POST http://127.0.0.1:8000/api/sync/
+    # {"cursor": "2025-01-31T10:00:00Z", "operations": [{"key": "till-1:42", "type": "bill", "data": {...}}]}
+    def post(self, request):
+        business = request.membership.business
+        if business is None:
+            return Response({'detail': 'You are not part of a business.'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = SyncBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            result = apply_batch(
+                business, serializer.validated_data['operations'], serializer.validated_data.get('cursor')
+            )
+        except IntegrityError:
+            # Another request applied some of these keys at the same moment; a retry replays them
+            return Response({'detail': 'Part of this batch was synced concurrently, send it again.'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(result)
+
 class CurrentUserBusinessView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        serializer = UserBusinessSerializer(request.user)
+        serializer = timed(UserBusinessSerializer(request.user, context={'request': request}))
         return Response(serializer.data)
+
+
+class MetricsView(APIView):
+    """Per-endpoint metrics summed over every worker, slowest endpoints first"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        directory = metrics_dir()
+        registry.flush(directory)  # So this worker's latest requests are included
+        workers, totals = collect_metrics(directory)
+        endpoints = [
+            {'route': route, 'method': method, **stats.summary()}
+            for (route, method), stats in sorted(totals.items(), key=lambda item: -item[1].latency_ms)
+        ]
+        return Response({'workers': workers, 'endpoints': endpoints})